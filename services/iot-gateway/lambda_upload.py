@@ -5,6 +5,7 @@ Recibe multipart/form-data desde API Gateway y sube a S3
 
 import json
 import base64
+import hashlib
 import boto3
 import os
 from datetime import datetime
@@ -89,7 +90,9 @@ def handler(event, context):
                     'drone_id': drone_id,
                     'timestamp': timestamp,
                     'uploaded_at': datetime.utcnow().isoformat() + 'Z',
-                    'environment': ENVIRONMENT
+                    'environment': ENVIRONMENT,
+                    # Hash del contenido: el processing engine lo usa para detectar duplicados
+                    'sha256': hashlib.sha256(image_data).hexdigest()
                 }
             )
             
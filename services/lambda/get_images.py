@@ -153,9 +153,10 @@ def lambda_handler(event, context):
         # Consultar las imágenes del usuario
         cur.execute("""
             SELECT id, raw_s3_key, processed_s3_key, field_status, 
-                   analysis_confidence, processed_at, analyzed_at
+                   analysis_confidence, processed_at, analyzed_at,
+                   preview_s3_key, thumbnail_s3_key
             FROM drone_images
-            WHERE user_id = %s
+            WHERE user_id = %s AND status = 'done'
             ORDER BY processed_at DESC
         """, (user_id,))
         
@@ -169,7 +170,8 @@ def lambda_handler(event, context):
         # Procesar cada imagen y generar URLs presigned
         images = []
         for row in rows:
-            image_id, raw_s3_key, processed_s3_key, field_status, analysis_confidence, processed_at, analyzed_at = row
+            (image_id, raw_s3_key, processed_s3_key, field_status, analysis_confidence, processed_at, analyzed_at,
+             preview_s3_key, thumbnail_s3_key) = row
             
             # Generar URLs presigned para raw y processed
             raw_url = None
@@ -180,6 +182,15 @@ def lambda_handler(event, context):
             if processed_s3_key and processed_images_bucket:
                 processed_url = generate_presigned_url(s3_client, processed_images_bucket, processed_s3_key, presigned_url_expiration)
             
+            # Renditions livianas para el dashboard (pueden faltar en imágenes viejas)
+            preview_url = None
+            if preview_s3_key and processed_images_bucket:
+                preview_url = generate_presigned_url(s3_client, processed_images_bucket, preview_s3_key, presigned_url_expiration)
+            
+            thumbnail_url = None
+            if thumbnail_s3_key and processed_images_bucket:
+                thumbnail_url = generate_presigned_url(s3_client, processed_images_bucket, thumbnail_s3_key, presigned_url_expiration)
+            
             # Formatear timestamps
             processed_at_iso = processed_at.isoformat() if processed_at else None
             analyzed_at_iso = analyzed_at.isoformat() if analyzed_at else None
@@ -190,6 +201,8 @@ def lambda_handler(event, context):
                 "processed_s3_key": processed_s3_key,
                 "raw_url": raw_url,
                 "processed_url": processed_url,
+                "preview_url": preview_url,
+                "thumbnail_url": thumbnail_url,
                 "field_status": field_status,
                 "analysis_confidence": float(analysis_confidence) if analysis_confidence else 0.0,
                 "processed_at": processed_at_iso,
@@ -48,16 +48,14 @@ def lambda_handler(event, context):
             );
         """)
 
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS sensor_data (
-                id SERIAL PRIMARY KEY,
-                userid     INTEGER REFERENCES users(userid),
-                timestamp  TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                temp       FLOAT,
-                hum        FLOAT,
-                soil       FLOAT
-                );
-        """)
+        # sensor_data (particionada por mes) la crea y la mantiene el processing engine al arrancar;
+        # acá solo se informa en qué estado está
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('sensor_data');")
+        row = cur.fetchone()
+        if row is None:
+            print("ℹ️ sensor_data todavía no existe: la crea el processing engine al arrancar")
+        elif row[0] == 'r':
+            print("⚠️ sensor_data no está particionada: correr `python main.py migrate-sensor-data` en el processing engine")
         cur.execute("""
             CREATE TABLE IF NOT EXISTS reports (
                 id SERIAL primary key,
@@ -77,7 +75,44 @@ def lambda_handler(event, context):
                 field_status VARCHAR(50) DEFAULT 'unknown',
                 analysis_confidence REAL DEFAULT 0.0,
                 processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                analyzed_at TIMESTAMP
+                analyzed_at TIMESTAMP,
+                fire_clusters JSONB,
+                preview_s3_key VARCHAR(500),
+                thumbnail_s3_key VARCHAR(500),
+                content_sha256 CHAR(64),
+                perceptual_hash VARCHAR(16)
+            );
+        """)
+        cur.execute("ALTER TABLE drone_images ADD COLUMN IF NOT EXISTS fire_clusters JSONB;")
+        cur.execute("ALTER TABLE drone_images ADD COLUMN IF NOT EXISTS preview_s3_key VARCHAR(500);")
+        cur.execute("ALTER TABLE drone_images ADD COLUMN IF NOT EXISTS thumbnail_s3_key VARCHAR(500);")
+        cur.execute("ALTER TABLE drone_images ADD COLUMN IF NOT EXISTS content_sha256 CHAR(64);")
+        cur.execute("ALTER TABLE drone_images ADD COLUMN IF NOT EXISTS perceptual_hash VARCHAR(16);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_drone_images_content_sha256 ON drone_images (content_sha256);")
+        # Limpieza de duplicados solo una vez, antes de crear el índice único
+        cur.execute("SELECT to_regclass('uq_drone_images_raw_s3_key');")
+        if cur.fetchone()[0] is None:
+            cur.execute("""
+                DELETE FROM drone_images a USING drone_images b
+                WHERE a.raw_s3_key = b.raw_s3_key AND a.id > b.id;
+            """)
+            if cur.rowcount:
+                print(f"⚠️ Eliminadas {cur.rowcount} filas duplicadas de drone_images")
+            cur.execute("CREATE UNIQUE INDEX uq_drone_images_raw_s3_key ON drone_images (raw_s3_key);")
+        cur.execute("ALTER TABLE drone_images ADD COLUMN IF NOT EXISTS status VARCHAR(20) NOT NULL DEFAULT 'done';")
+        cur.execute("ALTER TABLE drone_images ADD COLUMN IF NOT EXISTS lease_owner VARCHAR(100);")
+        cur.execute("ALTER TABLE drone_images ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP;")
+        cur.execute("ALTER TABLE drone_images ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;")
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_drone_images_expired_claims
+            ON drone_images (lease_expires_at) WHERE status = 'processing';
+        """)
+
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS image_scan_state (
+                name VARCHAR(100) PRIMARY KEY,
+                watermark VARCHAR(1024),
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             );
         """)
 
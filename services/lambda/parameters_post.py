@@ -29,6 +29,7 @@ def lambda_handler(event, context):
     db_user = os.environ.get("DB_USER", "postgres")
     db_password = os.environ.get("DB_PASSWORD")
     db_port = int(os.environ.get("DB_PORT", "5432"))
+    params_notify_channel = os.environ.get("PARAMS_NOTIFY_CHANNEL", "parameters_changed")
 
     try:
         # Verificar Bearer token
@@ -153,6 +154,10 @@ def lambda_handler(event, context):
             )
         )
         row = cur.fetchone()
+
+        # Avisar al processing engine para que invalide su cache de parámetros
+        # (NOTIFY se entrega recién al hacer commit)
+        cur.execute("SELECT pg_notify(%s, %s)", (params_notify_channel, str(row[1])))
         conn.commit()
         cur.close()
         conn.close()
@@ -1,6 +1,7 @@
 import json
 import os
 import base64
+import hashlib
 import boto3
 from datetime import datetime
 from cors_headers import add_cors_headers
@@ -72,8 +73,10 @@ def lambda_handler(event, context):
         # Crear el nombre del archivo con formato: user_id_timestamp.jpg
         filename = f"{user_id}_{timestamp}.jpg"
         
-        # Crear la key S3 con la estructura de carpetas
-        s3_key = f"drone-images/{filename}"
+        # Crear la key S3 con la estructura de carpetas por fecha (UTC): el processing engine
+        # escanea el bucket de forma incremental a partir de la última partición
+        date_str = datetime.utcnow().strftime("%Y/%m/%d")
+        s3_key = f"drone-images/{date_str}/{filename}"
         
         # Subir la imagen a S3
         s3_client = boto3.client('s3', region_name=aws_region)
@@ -86,7 +89,9 @@ def lambda_handler(event, context):
                 ContentType='image/jpeg',
                 Metadata={
                     'user_id': str(user_id),
-                    'uploaded_at': datetime.now().isoformat()
+                    'uploaded_at': datetime.now().isoformat(),
+                    # Hash del contenido: el processing engine lo usa para detectar duplicados
+                    'sha256': hashlib.sha256(image_bytes).hexdigest()
                 }
             )
             
@@ -119,16 +119,16 @@ def lambda_handler(event, context):
                 "body": json.dumps({"error": "Forbidden: Token does not match user"})
             })
         
-        # Rango horario del día seleccionado
+        # Rango horario del día seleccionado, [start, end) como los límites de las particiones
         start = datetime.combine(target_date, datetime.min.time())
-        end = datetime.combine(target_date, datetime.max.time())
+        end = start + timedelta(days=1)
 
         # --- Query a la base (reutilizamos la conexión) ---
         cur.execute(
             """
             SELECT timestamp, temp, hum, soil
             FROM sensor_data
-            WHERE userid = %s AND timestamp >= %s AND timestamp <= %s
+            WHERE userid = %s AND timestamp >= %s AND timestamp < %s
             ORDER BY timestamp ASC;
             """,
             (user_id, start, end)
@@ -2,6 +2,7 @@ import json
 import os
 import pg8000
 import base64
+from datetime import datetime, timedelta
 from cors_headers import add_cors_headers
 
 
@@ -72,6 +73,25 @@ def lambda_handler(event, context):
                 "body": json.dumps({"error": "Missing required parameter: user_id"})
             })
 
+        # Rango de fechas opcional (from/to, YYYY-MM-DD); sin fechas se devuelve todo el historial
+        # como siempre. sensor_data está particionada por mes: con el rango acotado solo se leen
+        # las particiones que lo cubren
+        query_params = event.get('queryStringParameters') or {}
+        conditions = ["userid = %s"]
+        params = [user_id]
+        try:
+            if query_params.get('from'):
+                conditions.append("timestamp >= %s")
+                params.append(datetime.strptime(query_params['from'], "%Y-%m-%d"))
+            if query_params.get('to'):
+                conditions.append("timestamp < %s")
+                params.append(datetime.strptime(query_params['to'], "%Y-%m-%d") + timedelta(days=1))
+        except ValueError:
+            return add_cors_headers({
+                "statusCode": 400,
+                "body": json.dumps({"error": "Invalid date format. Use YYYY-MM-DD"})
+            })
+
         conn = pg8000.connect(host=db_host, database=db_name, user=db_user, password=db_password, port=db_port)
         cur = conn.cursor()
         
@@ -99,13 +119,13 @@ def lambda_handler(event, context):
 
         # Si la validación pasa, obtener los datos del sensor
         cur.execute(
-            """
+            f"""
             SELECT id, userid, timestamp, temp, hum, soil
             FROM sensor_data
-            WHERE userid = %s
+            WHERE {' AND '.join(conditions)}
             ORDER BY timestamp DESC;
             """,
-            (user_id,)
+            tuple(params)
         )
         rows = cur.fetchall()
         colnames = [d[0] for d in cur.description]
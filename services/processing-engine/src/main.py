@@ -5,21 +5,114 @@ Reads from Redis queue and sends email alerts when sensor data is abnormal
 """
 
 import os
+import sys
 import json
 import threading
+import queue
 import time
+import zlib
+import struct
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 import boto3
 import smtplib
 from email.mime.text import MIMEText
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-from datetime import datetime
+from datetime import datetime, date, timedelta
 import logging
-from io import BytesIO
+import re
+import random
+import socket
+import atexit
+from logging.handlers import QueueHandler, QueueListener
+from io import BytesIO, RawIOBase
+from urllib.parse import unquote_plus
+from multiprocessing import shared_memory
+from dataclasses import dataclass, field
 from PIL import Image, ImageDraw, ImageFont, ImageEnhance
 import numpy as np
 
-logging.basicConfig(level=logging.INFO)
+# ---------------------
+# Logging
+# ---------------------
+# LOG_FORMAT=text (default) | json: una línea JSON por registro, con los campos estructurados
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Fracción de mensajes procesados OK que se loguean (los errores se loguean siempre)
+LOG_SUCCESS_SAMPLE_RATE = float(os.getenv("LOG_SUCCESS_SAMPLE_RATE", "1.0"))
+# Con LOG_ASYNC el formateo y la escritura a stdout ocurren en el thread del QueueListener
+LOG_ASYNC = os.getenv("LOG_ASYNC", "true").lower() in ("1", "true", "yes")
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro; los campos de extra={"fields": {...}} van al nivel raíz"""
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + ".%03dZ" % record.msecs,
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Formato clásico de basicConfig + los campos estructurados como key=value"""
+
+    def __init__(self):
+        super().__init__(logging.BASIC_FORMAT)
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler que encola el LogRecord sin formatearlo: QueueHandler.prepare() arma el
+    mensaje en el thread que loguea, acá eso queda a cargo del QueueListener.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+log_listener = None
+
+
+def configure_logging():
+    """Configura el root logger según LOG_FORMAT / LOG_LEVEL / LOG_ASYNC"""
+    global log_listener
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    if LOG_ASYNC:
+        log_queue = queue.SimpleQueue()
+        root.addHandler(DeferredQueueHandler(log_queue))
+        log_listener = QueueListener(log_queue, handler, respect_handler_level=True)
+        log_listener.start()
+        atexit.register(log_listener.stop)
+    else:
+        root.addHandler(handler)
+
+
+configure_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
@@ -33,6 +126,14 @@ SQS_QUEUE_URL = os.getenv("SQS_QUEUE_URL")
 AWS_REGION = os.getenv("AWS_DEFAULT_REGION", "us-east-1")
 RAW_IMAGES_BUCKET = os.getenv("RAW_IMAGES_BUCKET")
 PROCESSED_IMAGES_BUCKET = os.getenv("PROCESSED_IMAGES_BUCKET")
+# Cola con las notificaciones ObjectCreated del bucket raw; si está configurada, las imágenes se
+# procesan al llegar el evento y el listado de S3 queda como reconciliador cada IMAGE_POLL_INTERVAL
+IMAGE_EVENTS_QUEUE_URL = os.getenv("IMAGE_EVENTS_QUEUE_URL")
+IMAGE_POLL_INTERVAL = int(os.getenv("IMAGE_POLL_INTERVAL", 300 if IMAGE_EVENTS_QUEUE_URL else 30))
+# Endpoint alternativo para SQS/S3 (LocalStack, moto server) en desarrollo y pruebas
+AWS_ENDPOINT_URL = os.getenv("AWS_ENDPOINT_URL") or None
+# Días hacia atrás que el reconciliador vuelve a listar (subidas tardías / reintentos)
+IMAGE_SCAN_LOOKBACK_DAYS = int(os.getenv("IMAGE_SCAN_LOOKBACK_DAYS", 1))
 
 # Database Configuration
 DB_HOST = os.getenv("DB_HOST", "postgres")
@@ -41,13 +142,310 @@ DB_USER = os.getenv("DB_USER", "agro")
 DB_PASS = os.getenv("DB_PASSWORD", "agro12345")
 DB_NAME = os.getenv("DB_NAME", "agrodb")
 
+# Database connection pool (compartido por todo el proceso)
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))  # seconds waiting for a free connection
+DB_POOL_HEALTHCHECK_IDLE = float(os.getenv("DB_POOL_HEALTHCHECK_IDLE", 30))  # validate if idle longer
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", 5))
+
+# SQS retries: backoff exponencial (segundos) para mensajes con errores transitorios
+SQS_RETRY_BASE_DELAY = int(os.getenv("SQS_RETRY_BASE_DELAY", 5))
+SQS_RETRY_MAX_DELAY = int(os.getenv("SQS_RETRY_MAX_DELAY", 300))
+
+# User parameters cache
+PARAMS_CACHE_TTL = float(os.getenv("PARAMS_CACHE_TTL", 600))  # seconds
+PARAMS_CACHE_MAX_SIZE = int(os.getenv("PARAMS_CACHE_MAX_SIZE", 10000))
+PARAMS_NOTIFY_CHANNEL = os.getenv("PARAMS_NOTIFY_CHANNEL", "parameters_changed")
+
 # Configuración SMTP SendGrid
 SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
 SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
 SMTP_USER = os.getenv("SMTP_USER", "partitba@gmail.com")
 SMTP_PASS = os.getenv("SMTP_PASS", "zsxp daba umvz kzar")
 
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", 30))
+SMTP_IDLE_CHECK_SECONDS = float(os.getenv("SMTP_IDLE_CHECK_SECONDS", 60))  # NOOP si la sesión estuvo ociosa
+
 ALERT_EMAIL = os.getenv("ALERT_EMAIL", "alertas@agrosynchro.com")
+ALERT_QUEUE_SIZE = int(os.getenv("ALERT_QUEUE_SIZE", 1000))
+ALERT_BURST_SIZE = int(os.getenv("ALERT_BURST_SIZE", 50))
+ALERT_RATE_BURST = int(os.getenv("ALERT_RATE_BURST", 5))  # mails seguidos por destinatario
+ALERT_RATE_PER_HOUR = float(os.getenv("ALERT_RATE_PER_HOUR", 12))  # recarga del token bucket
+ALERT_DIGEST_SECONDS = float(os.getenv("ALERT_DIGEST_SECONDS", 0))  # > 0: un mail resumen por ventana
+ALERT_HYSTERESIS_RATIO = float(os.getenv("ALERT_HYSTERESIS_RATIO", 0.05))  # margen para rearmar la alerta
+
+# Sensor ingest batching
+SENSOR_BATCH_MAX_ROWS = int(os.getenv("SENSOR_BATCH_MAX_ROWS", 100))
+SENSOR_BATCH_WINDOW_SECONDS = float(os.getenv("SENSOR_BATCH_WINDOW_SECONDS", 0))
+
+# sensor_data particionada por rango de timestamp: una partición cada SENSOR_PARTITION_MONTHS
+# meses, creadas con SENSOR_PARTITIONS_AHEAD particiones de anticipación. Con
+# SENSOR_RETENTION_MONTHS > 0 las particiones más viejas se desenganchan ('detach': quedan como
+# tablas sueltas para archivar) o se borran ('drop')
+SENSOR_PARTITION_MONTHS = int(os.getenv("SENSOR_PARTITION_MONTHS", 1))
+SENSOR_PARTITIONS_AHEAD = int(os.getenv("SENSOR_PARTITIONS_AHEAD", 3))
+SENSOR_RETENTION_MONTHS = int(os.getenv("SENSOR_RETENTION_MONTHS", 0))
+SENSOR_RETENTION_MODE = os.getenv("SENSOR_RETENTION_MODE", "detach")
+SENSOR_PARTITION_CHECK_INTERVAL = int(os.getenv("SENSOR_PARTITION_CHECK_INTERVAL", 3600))  # seconds
+
+# Sensor ingest parallelism (también configurable vía payload de /api/start)
+SQS_POLLER_COUNT = int(os.getenv("SQS_POLLER_COUNT", 1))
+SQS_PROCESSOR_COUNT = int(os.getenv("SQS_PROCESSOR_COUNT", 1))
+SQS_BUFFER_SIZE = int(os.getenv("SQS_BUFFER_SIZE", 100))  # lecturas en memoria por processor
+
+# Image processing: con IMAGE_WORKERS > 0 el trabajo de CPU (PIL/NumPy/JPEG) corre en un
+# pool de procesos; con 0 se procesa en un solo thread de CPU del pipeline
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 0))
+IMAGE_MAX_IN_FLIGHT = int(os.getenv("IMAGE_MAX_IN_FLIGHT", 0)) or 2 * max(IMAGE_WORKERS, 1)
+# Pipeline de imágenes: threads de I/O para descargas y subidas a S3, colas acotadas entre
+# etapas (backpressure) y un writer que agrupa hasta IMAGE_DB_BATCH filas por transacción
+IMAGE_IO_THREADS = int(os.getenv("IMAGE_IO_THREADS", 4))
+IMAGE_STAGE_QUEUE_SIZE = int(os.getenv("IMAGE_STAGE_QUEUE_SIZE", 0)) or IMAGE_MAX_IN_FLIGHT
+IMAGE_DB_BATCH = int(os.getenv("IMAGE_DB_BATCH", 20))
+IMAGE_DB_BATCH_WAIT = float(os.getenv("IMAGE_DB_BATCH_WAIT", 0.5))  # segundos
+# Varias tasks del engine se reparten las imágenes reservándolas en drone_images (status
+# 'processing' + lease): de a IMAGE_CLAIM_BATCH keys, con un lease de IMAGE_LEASE_SECONDS que
+# otra task puede retomar si vence (la task murió a mitad de camino)
+ENGINE_INSTANCE_ID = os.getenv("ENGINE_INSTANCE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+IMAGE_LEASE_SECONDS = int(os.getenv("IMAGE_LEASE_SECONDS", 600))
+# Una imagen que falla se reintenta con backoff exponencial; tras IMAGE_MAX_ATTEMPTS reservas
+# queda en status 'failed' y no se reintenta más
+IMAGE_MAX_ATTEMPTS = int(os.getenv("IMAGE_MAX_ATTEMPTS", 5))
+IMAGE_RETRY_BASE_DELAY = int(os.getenv("IMAGE_RETRY_BASE_DELAY", 60))
+IMAGE_RETRY_MAX_DELAY = int(os.getenv("IMAGE_RETRY_MAX_DELAY", 3600))
+IMAGE_CLAIM_BATCH = int(os.getenv("IMAGE_CLAIM_BATCH", 0)) or 2 * IMAGE_MAX_IN_FLIGHT
+# Lado mayor de la imagen procesada (el JPEG se decodifica directo cerca de este tamaño)
+IMAGE_OUTPUT_MAX_SIZE = int(os.getenv("IMAGE_OUTPUT_MAX_SIZE", 1920))  # Full HD
+# Lado mayor de la imagen sobre la que se calculan fuego/vegetación (puede superar la salida:
+# el JPEG se decodifica al mayor de los dos)
+IMAGE_ANALYSIS_MAX_SIZE = int(os.getenv("IMAGE_ANALYSIS_MAX_SIZE", IMAGE_OUTPUT_MAX_SIZE))
+# Renditions: JPEG completo (IMAGE_OUTPUT_MAX_SIZE), preview WebP y thumbnail JPEG para el dashboard
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", 85))
+IMAGE_PREVIEW_MAX_SIZE = int(os.getenv("IMAGE_PREVIEW_MAX_SIZE", 960))
+IMAGE_PREVIEW_QUALITY = int(os.getenv("IMAGE_PREVIEW_QUALITY", 75))
+IMAGE_THUMBNAIL_MAX_SIZE = int(os.getenv("IMAGE_THUMBNAIL_MAX_SIZE", 320))
+IMAGE_THUMBNAIL_QUALITY = int(os.getenv("IMAGE_THUMBNAIL_QUALITY", 70))
+# Ortomosaicos: por encima de IMAGE_TILED_MIN_PIXELS se procesa por bandas de ~IMAGE_TILE_SIZE²
+# píxeles (IMAGE_TILE_WORKERS en paralelo; raw, TIFF por strips/tiles y JPEG, el resto se rechaza);
+# por encima de IMAGE_MAX_PIXELS se rechaza la imagen
+IMAGE_TILED_MIN_PIXELS = int(os.getenv("IMAGE_TILED_MIN_PIXELS", 50_000_000))
+IMAGE_TILE_SIZE = int(os.getenv("IMAGE_TILE_SIZE", 2048))
+IMAGE_TILE_WORKERS = int(os.getenv("IMAGE_TILE_WORKERS", 1))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", 1_000_000_000))
+# La descarga se lee directo a segmentos de memoria compartida reutilizables (los lee la etapa
+# de CPU, thread o pool); los mayores a IMAGE_BUFFER_KEEP_BYTES se liberan después de usarlos
+IMAGE_BUFFER_KEEP_BYTES = int(os.getenv("IMAGE_BUFFER_KEEP_BYTES", 64 * 1024 * 1024))
+# Clusters de fuego: se etiquetan sobre la máscara reducida a FIRE_CLUSTER_GRID celdas de lado;
+# los clusters con menos de FIRE_MIN_CLUSTER_AREA (% de la imagen) se descartan como ruido
+FIRE_CLUSTER_GRID = int(os.getenv("FIRE_CLUSTER_GRID", 256))
+FIRE_MIN_CLUSTER_AREA = float(os.getenv("FIRE_MIN_CLUSTER_AREA", 0.05))
+FIRE_MAX_CLUSTERS = int(os.getenv("FIRE_MAX_CLUSTERS", 50))  # se guardan los más grandes
+# Deduplicación: si el SHA-256 del contenido coincide con una imagen ya procesada se reutilizan
+# su análisis y sus imágenes procesadas; el hash perceptual (dHash) solo se guarda como referencia
+IMAGE_DEDUP = os.getenv("IMAGE_DEDUP", "true").lower() == "true"
+IMAGE_PERCEPTUAL_HASH = os.getenv("IMAGE_PERCEPTUAL_HASH", "true").lower() == "true"
+
+
+# ---------------------
+# Metrics (formato de texto de Prometheus, expuesto en /metrics)
+# ---------------------
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LAG_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 900.0, 3600.0)
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in items)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    """Contador monótono con labels; inc() es seguro entre threads"""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [(self.name, key, value) for key, value in values.items()]
+
+
+class Histogram:
+    """Histograma con buckets fijos (acumulados recién al exportar)"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self._buckets = tuple(buckets)
+        self._values = {}  # labels -> [conteo por bucket (+Inf al final), suma]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = len(self._buckets)
+        for i, bound in enumerate(self._buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self._buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def time(self, **labels):
+        """with HISTOGRAM.time(stage="x"): ... observa la duración del bloque en segundos"""
+        return _HistogramTimer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        samples = []
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self._buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append((self.name + "_bucket", key, cumulative, ("le", _format_value(bound))))
+            samples.append((self.name + "_sum", key, total))
+            samples.append((self.name + "_count", key, cumulative))
+        return samples
+
+
+class _HistogramTimer:
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._histogram.observe(time.perf_counter() - self._start, **self._labels)
+        return False
+
+
+class CallbackGauge:
+    """Gauge cuyo valor se calcula al exportar; callback devuelve un número o {labels: valor}"""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, callback):
+        self.name = name
+        self.documentation = documentation
+        self._callback = callback
+
+    def samples(self):
+        value = self._callback()
+        if value is None:
+            return []
+        if isinstance(value, dict):
+            return [(self.name, tuple(sorted(labels)), v) for labels, v in value.items()]
+        return [(self.name, (), value)]
+
+
+class MetricsRegistry:
+    def __init__(self, namespace):
+        self._namespace = namespace
+        self._metrics = []
+
+    def counter(self, name, documentation):
+        return self._register(Counter(f"{self._namespace}_{name}", documentation))
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(f"{self._namespace}_{name}", documentation, buckets))
+
+    def gauge(self, name, documentation, callback):
+        return self._register(CallbackGauge(f"{self._namespace}_{name}", documentation, callback))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                logger.debug("Metric %s unavailable: %s", metric.name, e)
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample in samples:
+                name, labels, value = sample[:3]
+                lines.append(f"{name}{_format_labels(labels, sample[3] if len(sample) > 3 else None)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry("agro")
+
+SQS_RECEIVE_SECONDS = metrics.histogram("sqs_receive_seconds", "Duración de receive_message (long poll incluido)")
+SQS_RECEIVED_MESSAGES = metrics.counter("sqs_received_messages_total", "Mensajes recibidos de SQS")
+SQS_ERRORS = metrics.counter("sqs_errors_total", "Errores de llamadas a SQS por operación")
+SQS_QUEUE_LAG_SECONDS = metrics.histogram(
+    "sqs_queue_lag_seconds", "Tiempo en cola de cada mensaje (recepción - SentTimestamp)", LAG_BUCKETS
+)
+SENSOR_MESSAGES = metrics.counter("sensor_messages_total", "Mensajes de sensores procesados por resultado")
+PARAMETER_LOOKUP_SECONDS = metrics.histogram("parameter_lookup_seconds", "Duración de get_user_parameters")
+DB_INSERT_SECONDS = metrics.histogram("db_insert_seconds", "Duración del INSERT por lote de sensor_data")
+DB_INSERT_ROWS = metrics.counter("db_insert_rows_total", "Filas insertadas en sensor_data")
+DB_INSERT_ERRORS = metrics.counter("db_insert_errors_total", "Lotes de sensor_data que fallaron al insertar")
+ALERT_SEND_SECONDS = metrics.histogram("alert_send_seconds", "Duración del envío SMTP de cada mail de alerta")
+ALERTS_TRIGGERED = metrics.counter("alerts_triggered_total", "Alertas disparadas por medición")
+S3_SECONDS = metrics.histogram("s3_request_seconds", "Duración de llamadas a S3 por operación")
+S3_ERRORS = metrics.counter("s3_errors_total", "Errores de llamadas a S3 por operación")
+IMAGE_STAGE_SECONDS = metrics.histogram("image_stage_seconds", "Duración de cada etapa del procesamiento de imágenes")
+IMAGES_PROCESSED = metrics.counter("images_processed_total", "Imágenes procesadas por resultado")
+IMAGE_EVENTS = metrics.counter("image_events_total", "Mensajes de la cola de eventos de imágenes por resultado")
+IMAGE_PIPELINE_BUSY = metrics.counter("image_pipeline_busy_seconds_total",
+                                      "Tiempo ocupado de cada etapa del pipeline de imágenes")
+
+
+def _stats_samples(stats):
+    """Exporta los valores numéricos de un dict de stats() como {stat="clave"}"""
+    if stats is None:
+        return None
+    return {
+        (("stat", key),): float(value) for key, value in stats.items()
+        if isinstance(value, (int, float))
+    }
+
+
+metrics.gauge("db_pool", "Estado del pool de conexiones a la BD",
+              lambda: _stats_samples(db_pool.stats() if db_pool is not None else None))
+metrics.gauge("parameters_cache", "Estado del cache de parámetros de usuario",
+              lambda: _stats_samples(user_parameters_cache.stats()))
+metrics.gauge("alert_dispatcher", "Estado del sender de mails de alerta",
+              lambda: _stats_samples(alert_dispatcher.stats()))
+metrics.gauge("processed_image_keys", "Set en memoria de imágenes ya registradas",
+              lambda: _stats_samples(processed_image_keys.stats()))
+metrics.gauge("alerts_firing", "Pares usuario/medición con alerta activa", lambda: alert_state.firing_count())
+metrics.gauge("image_pipeline_utilization", "Utilización de cada etapa en la última corrida del pipeline de imágenes",
+              lambda: {(("stage", stage),): value for stage, value in image_pipeline_utilization.items()})
 
 # AWS clients
 sqs_client = None
@@ -58,8 +456,8 @@ def get_aws_clients():
     global sqs_client, s3_client
     if sqs_client is None:
         try:
-            sqs_client = boto3.client('sqs', region_name=AWS_REGION)
-            s3_client = boto3.client('s3', region_name=AWS_REGION)
+            sqs_client = boto3.client('sqs', region_name=AWS_REGION, endpoint_url=AWS_ENDPOINT_URL)
+            s3_client = boto3.client('s3', region_name=AWS_REGION, endpoint_url=AWS_ENDPOINT_URL)
             logger.info("AWS clients initialized")
         except Exception as e:
             logger.error(f"AWS clients initialization failed: {e}")
@@ -71,29 +469,297 @@ def get_aws_clients():
 # ---------------------
 # Mail sender
 # ---------------------
-def send_email_alert(user_email, user_id, measurement, value, expected_range):
-    logger.info("sending mail to: " + user_email)
-    subject = f"⚠️ Alerta sensor!"
-    body = (
-        f"Se reportó un valor fuera de rango:\n\n"
-        f"- Medición: {measurement}\n"
-        f"- Valor recibido: {value}\n"
-        f"- Rango esperado: {expected_range}\n\n"
-        f"Hora: {datetime.now().isoformat()}"
-    )
+class TokenBucket:
+    """Token bucket simple: `capacity` envíos de ráfaga, recarga `rate` tokens por segundo"""
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def consume(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class AlertDispatcher:
+    """
+    Envía las alertas por mail desde un thread propio para que el ingest de sensores
+    no espere al servidor SMTP.
+    - enqueue() nunca bloquea: si la cola está llena la alerta se descarta (y se cuenta)
+    - El sender mantiene una sesión SMTP autenticada (STARTTLS + login una sola vez),
+      la valida con NOOP si estuvo ociosa y reconecta ante desconexiones
+    - Envía en ráfagas todo lo que haya acumulado en la cola (hasta ALERT_BURST_SIZE)
+    - Cada destinatario tiene un token bucket (ALERT_RATE_BURST mails, ALERT_RATE_PER_HOUR
+      por hora); lo que exceda el límite se descarta
+    - Con digest_seconds > 0 las alertas de cada destinatario se agrupan en un único mail
+      por ventana; si el bucket no alcanza, el digest sigue acumulando hasta la próxima
+    """
+
+    def __init__(self, host, port, user, password, max_queue, burst_size, idle_check,
+                 rate_burst, rate_per_hour, digest_seconds):
+        self._host = host
+        self._port = port
+        self._user = user
+        self._password = password
+        self._burst_size = burst_size
+        self._idle_check = idle_check
+        self._rate_burst = rate_burst
+        self._rate_per_second = rate_per_hour / 3600.0
+        self._digest_seconds = digest_seconds
+        self._buckets = {}
+        self._digests = {}
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._server = None
+        self._last_used = 0.0
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"queued": 0, "sent": 0, "failed": 0, "dropped": 0, "rate_limited": 0, "connects": 0}
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="alert-dispatcher", daemon=True)
+                self._thread.start()
+
+    def enqueue(self, alert):
+        self.start()
+        try:
+            self._queue.put_nowait(alert)
+            self._count("queued")
+        except queue.Full:
+            self._count("dropped")
+            logger.error(f"Alert queue full, dropping alert for {alert['recipient']}")
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["pending"] = self._queue.qsize()
+        stats["pending_digests"] = len(self._digests)
+        stats["connected"] = self._server is not None
+        return stats
+
+    def _run(self):
+        # Un error inesperado no puede matar el thread: se perderían la cola y los digests pendientes
+        while True:
+            try:
+                self._run_once()
+            except Exception:
+                logger.exception("Alert dispatcher iteration failed")
+                time.sleep(1)
+
+    def _run_once(self):
+        try:
+            first = self._queue.get(timeout=self._next_digest_wait())
+        except queue.Empty:
+            first = None
+        burst = [first] if first is not None else []
+        while len(burst) < self._burst_size:
+            try:
+                burst.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        for alert in burst:
+            try:
+                self._dispatch(alert)
+            except Exception:
+                self._count("failed")
+                logger.exception(f"Failed to dispatch alert {alert!r}")
+
+        if self._digests:
+            self._flush_digests()
+
+    def _dispatch(self, alert):
+        if self._digest_seconds > 0:
+            digest = self._digests.setdefault(
+                alert["recipient"], {"due": time.monotonic() + self._digest_seconds, "alerts": []}
+            )
+            digest["alerts"].append(alert)
+        elif self._allow(alert["recipient"]):
+            self._send(alert["recipient"], build_alert_message(alert["recipient"], [alert]))
+        else:
+            self._count("rate_limited")
+            logger.warning(f"Alert rate limit reached for {alert['recipient']}, dropping alert")
+
+    def _next_digest_wait(self):
+        if not self._digests:
+            return None
+        return max(0.0, min(d["due"] for d in self._digests.values()) - time.monotonic())
+
+    def _flush_digests(self):
+        now = time.monotonic()
+        for recipient, digest in list(self._digests.items()):
+            if digest["due"] > now:
+                continue
+            if self._allow(recipient):
+                del self._digests[recipient]
+                try:
+                    self._send(recipient, build_alert_message(recipient, digest["alerts"]))
+                except Exception:
+                    self._count("failed")
+                    logger.exception(f"Failed to send alert digest to {recipient}")
+            else:
+                digest["due"] = now + self._digest_seconds
+
+    def _allow(self, recipient):
+        bucket = self._buckets.get(recipient)
+        if bucket is None:
+            bucket = self._buckets[recipient] = TokenBucket(self._rate_burst, self._rate_per_second)
+        return bucket.consume()
+
+    def _connect(self):
+        self._disconnect()
+        server = smtplib.SMTP(self._host, self._port, timeout=SMTP_TIMEOUT)
+        server.starttls()
+        server.login(self._user, self._password)
+        self._server = server
+        self._count("connects")
+        logger.info(f"SMTP session opened with {self._host}:{self._port}")
+
+    def _disconnect(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+    def _ensure_connected(self):
+        if self._server is None:
+            self._connect()
+        elif time.monotonic() - self._last_used > self._idle_check:
+            # El servidor suele cerrar sesiones ociosas; verificar antes de usarla
+            try:
+                if self._server.noop()[0] != 250:
+                    self._connect()
+            except smtplib.SMTPException:
+                self._connect()
+            except OSError:
+                self._connect()
+
+    def _send(self, recipient, msg):
+        # Un reintento con una sesión nueva si la actual se cayó a mitad de camino
+        for attempt in range(2):
+            try:
+                self._ensure_connected()
+                with ALERT_SEND_SECONDS.time():
+                    self._server.sendmail(self._user, [recipient], msg.as_string())
+                self._last_used = time.monotonic()
+                self._count("sent")
+                logger.info("Alert email sent to %s", recipient)
+                return
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError) as e:
+                logger.warning(f"SMTP connection lost ({e}), reconnecting...")
+                self._disconnect()
+            except Exception as e:
+                logger.error(f"Failed to send email: {e}")
+                break
+        self._count("failed")
+
+
+def build_alert_message(recipient, alerts):
+    """Arma el mail para una alerta o, en modo digest, para varias juntas"""
+    lines = []
+    for alert in alerts:
+        lines.append(
+            f"- Medición: {alert['measurement']}\n"
+            f"  Valor recibido: {alert['value']}\n"
+            f"  Rango esperado: {alert['expected_range']}\n"
+            f"  Hora: {alert['at']}"
+        )
+    if len(alerts) == 1:
+        subject = f"⚠️ Alerta sensor!"
+        body = "Se reportó un valor fuera de rango:\n\n" + lines[0]
+    else:
+        subject = f"⚠️ Alerta sensor! ({len(alerts)} valores fuera de rango)"
+        body = f"Se reportaron {len(alerts)} valores fuera de rango:\n\n" + "\n\n".join(lines)
     msg = MIMEText(body)
     msg["Subject"] = subject
     msg["From"] = SMTP_USER
-    msg["To"] = user_email
+    msg["To"] = recipient
+    return msg
 
-    try:
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USER, SMTP_PASS)
-            server.sendmail(SMTP_USER, [user_email], msg.as_string())
-        logger.info(f"Alert email sent to {user_email}")
-    except Exception as e:
-        logger.error(f"Failed to send email: {e}")
+
+alert_dispatcher = AlertDispatcher(
+    SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS,
+    ALERT_QUEUE_SIZE, ALERT_BURST_SIZE, SMTP_IDLE_CHECK_SECONDS,
+    ALERT_RATE_BURST, ALERT_RATE_PER_HOUR, ALERT_DIGEST_SECONDS
+)
+
+
+def send_email_alert(user_email, user_id, measurement, value, expected_range):
+    """Deja la alerta en la cola del dispatcher (no bloquea)"""
+    logger.debug("Queueing mail to %s", user_email)
+    alert_dispatcher.enqueue({
+        "recipient": user_email,
+        "user_id": user_id,
+        "measurement": measurement,
+        "value": value,
+        "expected_range": expected_range,
+        "at": datetime.now().isoformat(),
+    })
+
+
+class AlertStateTracker:
+    """
+    Estado de alerta por (userid, medición) para no mandar un mail por cada lectura:
+    - Se dispara solo en la transición hacia fuera de rango (o si cambia de alto a bajo)
+    - Mientras siga fuera de rango no se vuelve a disparar
+    - Se rearma recién cuando el valor vuelve al rango con un margen de histéresis
+      (ratio * ancho del rango), así un valor oscilando sobre el límite no genera ráfagas
+    """
+
+    def __init__(self, hysteresis_ratio):
+        self._hysteresis_ratio = hysteresis_ratio
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def update(self, user_id, measure, value, low, high):
+        """Devuelve True si la lectura debe disparar una alerta"""
+        key = (str(user_id), measure)
+        if value > high:
+            violation = "high"
+        elif value < low:
+            violation = "low"
+        else:
+            violation = None
+
+        with self._lock:
+            current = self._states.get(key)
+            if violation is not None:
+                if current == violation:
+                    return False
+                self._states[key] = violation
+                return True
+            if current is not None:
+                margin = (high - low) * self._hysteresis_ratio
+                if low + margin <= value <= high - margin:
+                    del self._states[key]
+            return False
+
+    def firing_count(self):
+        with self._lock:
+            return len(self._states)
+
+    def firing_users(self):
+        """userids con al menos una medición en estado de alerta"""
+        with self._lock:
+            return {user_id for user_id, _ in self._states}
+
+
+alert_state = AlertStateTracker(ALERT_HYSTERESIS_RATIO)
 
 
 # ---------------------
@@ -104,391 +770,1144 @@ worker_running = False
 
 
 import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from contextlib import contextmanager
+from collections import OrderedDict
+import select
 
 from datetime import datetime
 
 # Database configuration now uses environment variables from top of file
 
 
+# ---------------------
+# Database connection pool
+# ---------------------
+class DBConnectionPool:
+    """
+    Pool de conexiones PostgreSQL thread-safe y acotado, compartido por el worker SQS,
+    el poller de imágenes y los handlers de Flask.
+    - getconn() bloquea (hasta `timeout` segundos) si las `maxconn` conexiones están en uso
+    - Las conexiones ociosas más de `healthcheck_idle` segundos se validan con SELECT 1
+    - stats() expone métricas de espera y uso
+    """
 
-def get_user_parameters(user_id):
-    conn = psycopg2.connect(
-        host=DB_HOST,
-        port=DB_PORT,
-        user=DB_USER,
-        password=DB_PASS,
-        dbname=DB_NAME
-    )
-    cursor = conn.cursor()
+    def __init__(self, minconn, maxconn, timeout, healthcheck_idle, **connect_kwargs):
+        self._pool = ThreadedConnectionPool(minconn, maxconn, **connect_kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._timeout = timeout
+        self._healthcheck_idle = healthcheck_idle
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "timeouts": 0,
+            "discarded": 0,
+            "in_use": 0,
+        }
 
-    cursor.execute(
-        """
-        SELECT 
-               min_temperature, max_temperature,
-               min_humidity, max_humidity,
-               min_soil_moisture, max_soil_moisture,
-               mail
-        FROM parameters
-        JOIN users ON parameters.userid = users.userid
-        WHERE users.userid = %s
-        """,
-        (user_id,),
-    )
-    row = cursor.fetchone()
-    conn.close()
+    def getconn(self):
+        started = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            if not self._slots.acquire(timeout=self._timeout):
+                with self._lock:
+                    self._stats["timeouts"] += 1
+                raise PoolError(f"Timed out after {self._timeout}s waiting for a database connection")
+            waited = time.monotonic() - started
+            with self._lock:
+                self._stats["waits"] += 1
+                self._stats["wait_seconds_total"] += waited
+                self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], waited)
+
+        try:
+            conn = self._checkout_healthy()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+        return conn
+
+    def _checkout_healthy(self):
+        # Una conexión rota se descarta y el siguiente getconn() abre una nueva
+        for _ in range(self.maxconn + 1):
+            conn = self._pool.getconn()
+            if not conn.closed and self._is_alive(conn):
+                return conn
+            with self._lock:
+                self._stats["discarded"] += 1
+                self._last_used.pop(id(conn), None)
+            self._pool.putconn(conn, close=True)
+        raise PoolError("Could not obtain a healthy database connection")
+
+    def _is_alive(self, conn):
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < self._healthcheck_idle:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def putconn(self, conn):
+        close = bool(conn.closed)
+        if not close and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                close = True
+        with self._lock:
+            if close:
+                self._last_used.pop(id(conn), None)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+            self._stats["in_use"] -= 1
+        try:
+            self._pool.putconn(conn, close=close)
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["min_size"] = self.minconn
+        stats["max_size"] = self.maxconn
+        stats["wait_seconds_total"] = round(stats["wait_seconds_total"], 4)
+        stats["wait_seconds_max"] = round(stats["wait_seconds_max"], 4)
+        return stats
+
+
+db_pool = None
+db_pool_lock = threading.Lock()
+
+
+def get_db_pool():
+    global db_pool
+    if db_pool is None:
+        with db_pool_lock:
+            if db_pool is None:
+                db_pool = DBConnectionPool(
+                    DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_HEALTHCHECK_IDLE,
+                    host=DB_HOST, port=DB_PORT, user=DB_USER,
+                    password=DB_PASS, dbname=DB_NAME, connect_timeout=DB_CONNECT_TIMEOUT
+                )
+                logger.info(f"Database pool initialized (min={DB_POOL_MIN}, max={DB_POOL_MAX})")
+    return db_pool
+
+
+@contextmanager
+def db_connection():
+    """Presta una conexión del pool; al salir se devuelve (con rollback de lo no commiteado)"""
+    pool = get_db_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+# ---------------------
+# User parameters cache
+# ---------------------
+USER_PARAMETERS_QUERY = """
+    SELECT 
+           min_temperature, max_temperature,
+           min_humidity, max_humidity,
+           min_soil_moisture, max_soil_moisture,
+           mail, users.userid
+    FROM parameters
+    JOIN users ON parameters.userid = users.userid
+"""
+
+
+def _parameters_from_row(row):
+    return {
+        "min_temperature": row[0],
+        "max_temperature": row[1],
+        "min_humidity": row[2],
+        "max_humidity": row[3],
+        "min_soil_moisture": row[4],
+        "max_soil_moisture": row[5],
+        "email": row[6],
+    }
+
+
+def fetch_user_parameters(user_id):
+    """Consulta los rangos y el mail de un usuario directamente en la base"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(USER_PARAMETERS_QUERY + " WHERE users.userid = %s", (user_id,))
+        row = cursor.fetchone()
     if row:
-        return {
-            "min_temperature": row[0],
-            "max_temperature": row[1],
-            "min_humidity": row[2],
-            "max_humidity": row[3],
-            "min_soil_moisture": row[4],
-            "max_soil_moisture": row[5],
-            "email": row[6],
-        }
+        return _parameters_from_row(row)
     return None
 
-def insert_sensor_data(user_id, timestamp, temperature, humidity, soil_moisture):
-    try:
-        logger.info(f"🔄 Inserting sensor data: user_id={user_id}, timestamp={timestamp}, temperature={temperature}, humidity={humidity}, soil_moisture={soil_moisture}")
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            user=DB_USER,
-            password=DB_PASS,
-            dbname=DB_NAME
-        )
+
+def fetch_all_user_parameters():
+    """Carga los parámetros de todos los usuarios en una sola consulta (warm-up del cache)"""
+    with db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO sensor_data (userid, timestamp, temp, hum, soil) VALUES (%s, %s, %s, %s, %s)",
-            (user_id, timestamp, temperature, humidity, soil_moisture),
+        cursor.execute(USER_PARAMETERS_QUERY)
+        rows = cursor.fetchall()
+    return {str(row[7]): _parameters_from_row(row) for row in rows}
+
+
+class UserParametersCache:
+    """
+    Cache LRU con TTL de parámetros por userid.
+    Los umbrales cambian muy poco, así que cada mensaje de sensor los lee de memoria;
+    las entradas se invalidan vía LISTEN/NOTIFY (ver parameters_listener) y el TTL
+    acota la desactualización si se pierde una notificación.
+    Los usuarios inexistentes también se cachean (como None) para no consultar en cada mensaje.
+    """
+
+    def __init__(self, loader, bulk_loader, ttl, max_size):
+        self._loader = loader
+        self._bulk_loader = bulk_loader
+        self._ttl = ttl
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, user_id):
+        key = str(user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[1]
+            self._stats["misses"] += 1
+
+        parameters = self._loader(user_id)
+        self._store(key, parameters)
+        return parameters
+
+    def _store(self, key, parameters):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl, parameters)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def warm_up(self):
+        """
+        Carga todos los usuarios con parámetros (hasta max_size) y reemplaza el contenido del
+        cache de una vez: lo que hubiera quedado desactualizado se descarta sin dejar el cache vacío
+        """
+        all_parameters = self._bulk_loader()
+        expires = time.monotonic() + self._ttl
+        entries = OrderedDict(
+            (str(key), (expires, parameters))
+            for key, parameters in list(all_parameters.items())[:self._max_size]
         )
-        conn.commit()
-        conn.close()
-        logger.info(f"✅ Successfully inserted sensor data for user {user_id}")
-    except Exception as e:
-        logger.error(f"❌ Failed to insert sensor data: {e}")
-        raise
+        with self._lock:
+            self._entries = entries
+        logger.info(f"User parameters cache warmed up with {len(entries)} users")
+
+    def invalidate(self, user_id=None):
+        """Invalida un usuario, o todo el cache si user_id es None"""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(str(user_id), None)
+            self._stats["invalidations"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        stats["max_size"] = self._max_size
+        stats["ttl_seconds"] = self._ttl
+        return stats
+
+
+user_parameters_cache = UserParametersCache(
+    fetch_user_parameters, fetch_all_user_parameters,
+    PARAMS_CACHE_TTL, PARAMS_CACHE_MAX_SIZE
+)
 
 
-def worker():
-    global worker_running
-    try:
-        sqs, s3 = get_aws_clients()
-        if not sqs:
-            logger.error("Worker stopped: AWS clients unavailable")
-            return
+def get_user_parameters(user_id):
+    return user_parameters_cache.get(user_id)
 
-        if not SQS_QUEUE_URL:
-            logger.error("Worker stopped: SQS_QUEUE_URL not configured")
-            return
 
-        logger.info(f"Worker started, polling SQS queue: {SQS_QUEUE_URL}")
-        while worker_running:
-            try:
-                # Poll SQS for messages with optimized long polling
-                response = sqs.receive_message(
-                    QueueUrl=SQS_QUEUE_URL,
-                    MaxNumberOfMessages=10,
-                    WaitTimeSeconds=20,  # Long polling - SQS notifies immediately when messages arrive
-                    VisibilityTimeout=300  # 5 minutes to process
-                )
-                
-                messages = response.get('Messages', [])
-                if not messages:
-                    logger.debug("No messages received")
-                    continue
-                    
-                logger.info(f"📨 Received {len(messages)} sensor messages")
-                
-                for message in messages:
-                    try:
-                        payload = json.loads(message['Body'])
-                        logger.info(f"🔍 Processing sensor message: {payload}")
-                        
-                        user_id = payload.get("user_id")
-                        timestamp = payload.get("timestamp", time.strftime("%Y-%m-%d %H:%M:%S"))
-                        hum = payload.get("humidity")
-                        temp = payload.get("temperature")
-                        soil = payload.get("soil_moisture")
-
-                        if not user_id:
-                            logger.warning("No user_id in message, skipping")
-                            continue
-
-                        # Convertir valores a float para asegurar comparaciones numéricas
-                        logger.info(f"� Converting sensor values to float...")
-                        try:
-                            hum = float(hum) if hum is not None else None
-                            temp = float(temp) if temp is not None else None
-                            soil = float(soil) if soil is not None else None
-                            logger.info(f"✅ Conversion successful")
-                        except (ValueError, TypeError) as e:
-                            logger.error(f"❌ Invalid sensor values for user {user_id}: hum={hum}, temp={temp}, soil={soil}. Error: {e}")
-                            continue
-
-                        logger.info(f"📊 Sensor values (converted): user_id={user_id}, temp={temp} (type: {type(temp).__name__}), hum={hum} (type: {type(hum).__name__}), soil={soil} (type: {type(soil).__name__})")
-
-                        # Obtener parámetros del usuario
-                        logger.info(f"🔍 Fetching parameters for user {user_id}...")
-                        parameters = get_user_parameters(user_id)
-                        if parameters is None:
-                            logger.warning(f"❌ User {user_id} not found in database, skipping message")
-                            continue
-                        
-                        logger.info(f"📋 User parameters retrieved:")
-                        logger.info(f"   - Email: {parameters.get('email', 'N/A')}")
-                        logger.info(f"   - Temperature range: [{parameters.get('min_temperature', 'N/A')}, {parameters.get('max_temperature', 'N/A')}]")
-                        logger.info(f"   - Humidity range: [{parameters.get('min_humidity', 'N/A')}, {parameters.get('max_humidity', 'N/A')}]")
-                        logger.info(f"   - Soil moisture range: [{parameters.get('min_soil_moisture', 'N/A')}, {parameters.get('max_soil_moisture', 'N/A')}]")
-                        
-                        # Verificar alertas - HUMIDITY
-                        if hum is not None and parameters.get('min_humidity') is not None and parameters.get('max_humidity') is not None:
-                            logger.info(f"🔍 Checking HUMIDITY: {hum} vs range [{parameters['min_humidity']}, {parameters['max_humidity']}]")
-                            
-                            if hum > parameters['max_humidity']:
-                                logger.warning(f"⚠️  HUMIDITY TOO HIGH! {hum} > {parameters['max_humidity']}")
-                                logger.info(f"📧 Triggering email alert for HIGH humidity...")
-                                send_email_alert(
-                                    parameters['email'], user_id, "Humedad", hum,
-                                    f"{parameters['min_humidity']} - {parameters['max_humidity']}"
-                                )
-                            elif hum < parameters['min_humidity']:
-                                logger.warning(f"⚠️  HUMIDITY TOO LOW! {hum} < {parameters['min_humidity']}")
-                                logger.info(f"📧 Triggering email alert for LOW humidity...")
-                                send_email_alert(
-                                    parameters['email'], user_id, "Humedad", hum,
-                                    f"{parameters['min_humidity']} - {parameters['max_humidity']}"
-                                )
-                            else:
-                                logger.info(f"✅ Humidity within range: {hum}")
-                        else:
-                            logger.info(f"ℹ️  Skipping humidity check (value or parameters missing)")
-                        
-                        # Verificar alertas - TEMPERATURE
-                        if temp is not None and parameters.get('min_temperature') is not None and parameters.get('max_temperature') is not None:
-                            logger.info(f"🔍 Checking TEMPERATURE: {temp} vs range [{parameters['min_temperature']}, {parameters['max_temperature']}]")
-                            
-                            if temp > parameters['max_temperature']:
-                                logger.warning(f"⚠️  TEMPERATURE TOO HIGH! {temp} > {parameters['max_temperature']}")
-                                logger.info(f"📧 Triggering email alert for HIGH temperature...")
-                                send_email_alert(
-                                    parameters['email'], user_id, "Temperatura", temp,
-                                    f"{parameters['min_temperature']} - {parameters['max_temperature']}"
-                                )
-                            elif temp < parameters['min_temperature']:
-                                logger.warning(f"⚠️  TEMPERATURE TOO LOW! {temp} < {parameters['min_temperature']}")
-                                logger.info(f"📧 Triggering email alert for LOW temperature...")
-                                send_email_alert(
-                                    parameters['email'], user_id, "Temperatura", temp,
-                                    f"{parameters['min_temperature']} - {parameters['max_temperature']}"
-                                )
-                            else:
-                                logger.info(f"✅ Temperature within range: {temp}")
-                        else:
-                            logger.info(f"ℹ️  Skipping temperature check (value or parameters missing)")
-                        
-                        # Verificar alertas - SOIL MOISTURE
-                        if soil is not None and parameters.get('min_soil_moisture') is not None and parameters.get('max_soil_moisture') is not None:
-                            logger.info(f"🔍 Checking SOIL MOISTURE: {soil} vs range [{parameters['min_soil_moisture']}, {parameters['max_soil_moisture']}]")
-                            
-                            if soil > parameters['max_soil_moisture']:
-                                logger.warning(f"⚠️  SOIL MOISTURE TOO HIGH! {soil} > {parameters['max_soil_moisture']}")
-                                logger.info(f"📧 Triggering email alert for HIGH soil moisture...")
-                                send_email_alert(
-                                    parameters['email'], user_id, "Humedad del suelo", soil,
-                                    f"{parameters['min_soil_moisture']} - {parameters['max_soil_moisture']}"
-                                )
-                            elif soil < parameters['min_soil_moisture']:
-                                logger.warning(f"⚠️  SOIL MOISTURE TOO LOW! {soil} < {parameters['min_soil_moisture']}")
-                                logger.info(f"📧 Triggering email alert for LOW soil moisture...")
-                                send_email_alert(
-                                    parameters['email'], user_id, "Humedad del suelo", soil,
-                                    f"{parameters['min_soil_moisture']} - {parameters['max_soil_moisture']}"
-                                )
-                            else:
-                                logger.info(f"✅ Soil moisture within range: {soil}")
-                        else:
-                            logger.info(f"ℹ️  Skipping soil moisture check (value or parameters missing)")
-
-                        logger.info(f"💾 Saving sensor data for user {user_id}: temp={temp}, hum={hum}, soil={soil}")
-                        
-                        insert_sensor_data(user_id, timestamp, temp, hum, soil)
-                        logger.info(f"✅ Saved sensor data: for user {user_id}")
-                        
-                        # Delete message from queue after successful processing
-                        sqs.delete_message(
-                            QueueUrl=SQS_QUEUE_URL,
-                            ReceiptHandle=message['ReceiptHandle']
-                        )
-                        logger.info("📤 Message processed and deleted from queue")
-                        
-                    except json.JSONDecodeError as e:
-                        logger.error(f"Invalid JSON in message: {e}")
-                    except Exception as e:
-                        logger.error(f"Error processing message: {e}")
+parameters_listener_ready = threading.Event()
 
+
+def parameters_listener():
+    """
+    Escucha el canal PARAMS_NOTIFY_CHANNEL (lo emite el Lambda parameters_post al hacer
+    el upsert) e invalida la entrada del usuario. Usa una conexión dedicada fuera del pool
+    porque LISTEN queda asociado a la sesión.
+    La precarga del cache se hace acá, recién con el LISTEN activo, así ningún cambio queda
+    entre la carga y la escucha; parameters_listener_ready se activa tras la primera.
+    """
+    logger.info(f"Parameters listener started on channel '{PARAMS_NOTIFY_CHANNEL}'")
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(
+                host=DB_HOST, port=DB_PORT, user=DB_USER,
+                password=DB_PASS, dbname=DB_NAME, connect_timeout=DB_CONNECT_TIMEOUT
+            )
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute(f"LISTEN {PARAMS_NOTIFY_CHANNEL}")
+            # Carga completa (al arrancar, o tras reconectar porque se pudieron perder
+            # notificaciones); si falla, se invalida todo y se carga por usuario
+            try:
+                user_parameters_cache.warm_up()
             except Exception as e:
-                logger.error(f"Worker error: {e}")
-                time.sleep(2)
-                
-    except Exception as e:
-        logger.error(f"❌ Failed to start SQS worker: {e}")
-        raise
+                logger.error(f"❌ User parameters cache warm-up failed: {e}")
+                user_parameters_cache.invalidate()
+            parameters_listener_ready.set()
 
+            while True:
+                if select.select([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    logger.info(f"Parameters changed for user {notify.payload or '*'}, invalidating cache")
+                    user_parameters_cache.invalidate(notify.payload or None)
+        except Exception as e:
+            logger.error(f"Parameters listener error: {e}")
+            time.sleep(5)
+        finally:
+            if conn is not None:
+                conn.close()
 
 # ---------------------
-# API endpoints
+# sensor_data partitions
 # ---------------------
-@app.route("/api/start", methods=["POST"])
-def start_worker():
-    global worker_thread, worker_running
-    if worker_running:
-        return jsonify({"success": False, "message": "Worker already running"}), 400
+SENSOR_PARTITION_LOCK_ID = 7201  # pg_advisory_lock: una sola task toca las particiones a la vez
+SENSOR_PARTITION_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+SENSOR_LEGACY_RANGE_CHECK = "sensor_data_legacy_range"
+
+# Sin PRIMARY KEY: en una tabla particionada tendría que incluir timestamp y la tabla original
+# (PRIMARY KEY (id)) no se podría enganchar como partición sin reconstruirla. El id sigue siendo
+# único por la secuencia, que es la misma de la tabla original (los ids continúan).
+SENSOR_DATA_DDL = """
+    CREATE TABLE IF NOT EXISTS sensor_data (
+        id         INTEGER NOT NULL DEFAULT nextval('sensor_data_id_seq'),
+        userid     INTEGER REFERENCES users(userid),
+        timestamp  TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        temp       FLOAT,
+        hum        FLOAT,
+        soil       FLOAT
+    ) PARTITION BY RANGE (timestamp)
+"""
 
-    worker_running = True
-    worker_thread = threading.Thread(target=worker, daemon=True)
-    worker_thread.start()
-    return jsonify({"success": True, "message": "Worker started"})
 
+def add_months(day, months):
+    """Primer día del mes que está months meses después del mes de day"""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
 
-@app.route("/api/stop", methods=["POST"])
-def stop_worker():
-    global worker_running
-    if not worker_running:
-        return jsonify({"success": False, "message": "Worker not running"}), 400
-    worker_running = False
-    return jsonify({"success": True, "message": "Worker stopping"})
 
+def sensor_partition_start(day):
+    """Primer día de la partición de sensor_data que contiene day"""
+    index = day.year * 12 + day.month - 1
+    index -= index % SENSOR_PARTITION_MONTHS
+    return date(index // 12, index % 12 + 1, 1)
 
-@app.route("/ping", methods=["GET"])
-def ping():
-    return jsonify({"status": "ok", "service": "iot-consumer", "timestamp": datetime.now().isoformat()})
 
-@app.route("/health", methods=["GET"])
-def health():
-    """Extended health check with database connectivity"""
-    health_data = {
-        "status": "ok",
-        "service": "processing-engine", 
-        "timestamp": datetime.now().isoformat(),
-        "database": {"connected": False, "tables": []},
-        "s3": {"configured": bool(RAW_IMAGES_BUCKET and PROCESSED_IMAGES_BUCKET)},
-        "sqs": {"configured": bool(SQS_QUEUE_URL)}
-    }
-    
-    # Check database connectivity and tables
-    try:
-        conn = psycopg2.connect(
-            host=DB_HOST, port=DB_PORT, user=DB_USER, 
-            password=DB_PASS, dbname=DB_NAME, connect_timeout=5
+def sensor_data_relkind(cursor):
+    """'p' si sensor_data ya está particionada, 'r' si es la tabla común original, None si no existe"""
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('sensor_data')")
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def sensor_partition_bounds(cursor):
+    """{partición: límite superior} de las particiones con rango (la default no aparece)"""
+    cursor.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'sensor_data'::regclass
+    """)
+    bounds = {}
+    for name, bound in cursor.fetchall():
+        match = SENSOR_PARTITION_UPPER_BOUND.search(bound)
+        if match:
+            bounds[name] = datetime.fromisoformat(match[1]).date()
+    return bounds
+
+
+def create_sensor_partition(cursor, start):
+    """
+    Crea la partición de sensor_data que empieza en start (si no existe). Las filas de ese rango
+    que hayan caído en la partición default (llegaron antes de que existiera) se mueven a la
+    nueva antes de engancharla. Devuelve True si la creó.
+    """
+    name = f"sensor_data_p{start:%Y%m}"
+    cursor.execute("SELECT to_regclass(%s)", (name,))
+    if cursor.fetchone()[0] is not None:
+        return False
+    end = add_months(start, SENSOR_PARTITION_MONTHS)
+    cursor.execute(f"CREATE TABLE {name} (LIKE sensor_data INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cursor.execute(f"""
+        WITH moved AS (
+            DELETE FROM sensor_data_default WHERE timestamp >= %s AND timestamp < %s RETURNING *
         )
-        cursor = conn.cursor()
-        
-        # Check if tables exist
-        cursor.execute("""
-            SELECT table_name 
-            FROM information_schema.tables 
-            WHERE table_schema = 'public'
-            ORDER BY table_name
-        """)
-        tables = [row[0] for row in cursor.fetchall()]
-        
-        # Count records in drone_images if exists
-        drone_images_count = 0
-        if 'drone_images' in tables:
-            cursor.execute("SELECT COUNT(*) FROM drone_images")
-            drone_images_count = cursor.fetchone()[0]
-        
-        conn.close()
-        
-        health_data["database"] = {
-            "connected": True,
-            "tables": tables,
-            "drone_images_count": drone_images_count
-        }
-        
-    except Exception as e:
-        health_data["database"] = {
-            "connected": False,
-            "error": str(e)
-        }
-    
-    return jsonify(health_data)
+        INSERT INTO {name} SELECT * FROM moved
+    """, (start, end))
+    cursor.execute(f"ALTER TABLE sensor_data ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')")
+    logger.info(f"🗄️ Created sensor_data partition {name} [{start}, {end})")
+    return True
 
 
-@app.route("/api/sensors/average", methods=["GET"])
-def get_sensor_averages():
-    """Get recent sensor data averages"""
+def ensure_sensor_partitions(cursor):
+    """
+    Crea las particiones desde la actual hasta SENSOR_PARTITIONS_AHEAD particiones adelante,
+    sin pisar el rango de la tabla original enganchada (sensor_data_legacy). Devuelve cuántas creó.
+    """
+    current = sensor_partition_start(datetime.utcnow().date())
+    start = max(current, sensor_partition_bounds(cursor).get("sensor_data_legacy", current))
+    last = add_months(current, SENSOR_PARTITIONS_AHEAD * SENSOR_PARTITION_MONTHS)
+    created = 0
+    while start <= last:
+        created += create_sensor_partition(cursor, start)
+        start = add_months(start, SENSOR_PARTITION_MONTHS)
+    return created
+
+
+def expire_sensor_partitions(cursor):
+    """
+    Retención: desengancha (y con SENSOR_RETENTION_MODE=drop, borra) las particiones que terminan
+    antes de SENSOR_RETENTION_MONTHS meses atrás. Devuelve cuántas expiró.
+    """
+    if SENSOR_RETENTION_MONTHS <= 0:
+        return 0
+    cutoff = add_months(datetime.utcnow().date(), -SENSOR_RETENTION_MONTHS)
+    expired = 0
+    for name, end in sensor_partition_bounds(cursor).items():
+        if end > cutoff:
+            continue
+        cursor.execute(f"ALTER TABLE sensor_data DETACH PARTITION {name}")
+        if SENSOR_RETENTION_MODE == "drop":
+            cursor.execute(f"DROP TABLE {name}")
+        logger.info(f"🗄️ sensor_data partition {name} {'dropped' if SENSOR_RETENTION_MODE == 'drop' else 'detached'} "
+                    f"(retention {SENSOR_RETENTION_MONTHS} months)")
+        expired += 1
+    return expired
+
+
+def create_sensor_data_table(cursor):
+    """Crea sensor_data particionada (si no existe) con su partición default y el índice del dashboard"""
+    cursor.execute("CREATE SEQUENCE IF NOT EXISTS sensor_data_id_seq")
+    cursor.execute(SENSOR_DATA_DDL)
+    cursor.execute("ALTER SEQUENCE sensor_data_id_seq OWNED BY sensor_data.id")
+    cursor.execute("CREATE TABLE IF NOT EXISTS sensor_data_default PARTITION OF sensor_data DEFAULT")
+    # Las consultas del dashboard filtran por usuario y rango de fechas
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sensor_data_userid_timestamp ON sensor_data (userid, timestamp)")
+
+
+def ensure_sensor_data_schema(cursor):
+    """
+    Startup: crea sensor_data particionada y sus particiones por delante. Si sensor_data todavía
+    es la tabla común original no la toca (sigue funcionando igual) y avisa que falta correr la
+    migración única `python main.py migrate-sensor-data`; no copia ni valida filas en el arranque.
+    """
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (SENSOR_PARTITION_LOCK_ID,))
+    if sensor_data_relkind(cursor) == 'r':
+        logger.warning("⚠️  sensor_data is not partitioned yet: run `python main.py migrate-sensor-data` once")
+        return False
+    create_sensor_data_table(cursor)
+    ensure_sensor_partitions(cursor)
+    return True
+
+
+def migrate_legacy_sensor_data():
+    """
+    Migración única (fuera del arranque) de la tabla sensor_data original a la particionada, sin
+    copiar filas ni cortar la ingesta: la tabla original se engancha como partición
+    sensor_data_legacy [MINVALUE, boundary) y las particiones mensuales empiezan en boundary.
+
+    1. CHECK (timestamp < boundary) NOT VALID y VALIDATE: el scan no bloquea los INSERT.
+    2. CREATE INDEX CONCURRENTLY del índice (userid, timestamp), que el ATTACH reutiliza.
+    3. En una transacción corta: rename, tabla particionada y ATTACH, que con el CHECK ya
+       validado no vuelve a recorrer la tabla.
+    boundary es el inicio de la partición siguiente a la próxima, para que las lecturas que
+    lleguen mientras corren los pasos 1 y 2 sigan cumpliendo el CHECK.
+    """
+    boundary = add_months(sensor_partition_start(datetime.utcnow().date()), 2 * SENSOR_PARTITION_MONTHS)
+    conn = psycopg2.connect(
+        host=DB_HOST, port=DB_PORT, user=DB_USER,
+        password=DB_PASS, dbname=DB_NAME, connect_timeout=DB_CONNECT_TIMEOUT
+    )
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST, port=DB_PORT, user=DB_USER, 
-            password=DB_PASS, dbname=DB_NAME
-        )
+        conn.autocommit = True
         cursor = conn.cursor()
-        
-        # Get last 5 minutes of data for averages
+        if sensor_data_relkind(cursor) != 'r':
+            logger.info("sensor_data is already partitioned (or missing), nothing to migrate")
+            return False
+
+        logger.info(f"Validating sensor_data rows before {boundary}...")
+        cursor.execute(f"ALTER TABLE sensor_data DROP CONSTRAINT IF EXISTS {SENSOR_LEGACY_RANGE_CHECK}")
+        cursor.execute(f"""
+            ALTER TABLE sensor_data ADD CONSTRAINT {SENSOR_LEGACY_RANGE_CHECK}
+            CHECK (timestamp IS NOT NULL AND timestamp < '{boundary}') NOT VALID
+        """)
+        cursor.execute(f"ALTER TABLE sensor_data VALIDATE CONSTRAINT {SENSOR_LEGACY_RANGE_CHECK}")
+        logger.info("Indexing sensor_data (userid, timestamp) concurrently...")
         cursor.execute("""
-            SELECT measure, AVG(value) as avg_value, COUNT(*) as count
-            FROM sensor_data 
-            WHERE timestamp >= NOW() - INTERVAL '5 minutes'
-            GROUP BY measure
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS sensor_data_legacy_userid_timestamp
+            ON sensor_data (userid, timestamp)
         """)
-        
-        results = cursor.fetchall()
+
+        conn.autocommit = False
+        cursor.execute("SET LOCAL lock_timeout = '10s'")
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (SENSOR_PARTITION_LOCK_ID,))
+        cursor.execute("ALTER TABLE sensor_data RENAME TO sensor_data_legacy")
+        cursor.execute("ALTER INDEX IF EXISTS sensor_data_pkey RENAME TO sensor_data_legacy_pkey")
+        create_sensor_data_table(cursor)
+        cursor.execute(f"""
+            ALTER TABLE sensor_data ATTACH PARTITION sensor_data_legacy
+            FOR VALUES FROM (MINVALUE) TO ('{boundary}')
+        """)
+        cursor.execute(f"ALTER TABLE sensor_data_legacy DROP CONSTRAINT {SENSOR_LEGACY_RANGE_CHECK}")
+        ensure_sensor_partitions(cursor)
+        conn.commit()
+        logger.info(f"✅ sensor_data partitioned: legacy rows attached as sensor_data_legacy (< {boundary})")
+        return True
+    finally:
         conn.close()
-        
-        averages = {}
-        sensors_count = 0
-        for measure, avg_value, count in results:
-            averages[measure] = round(float(avg_value), 2)
-            sensors_count += count
-        
-        return jsonify({
-            "success": True,
-            "data": {
-                "timestamp": datetime.now().isoformat(),
-                "sensors_count": sensors_count,
-                "averages": averages
-            }
-        })
-        
-    except Exception as e:
-        logger.error(f"Error getting sensor averages: {e}")
-        return jsonify({
-            "success": False,
-            "error": str(e)
-        }), 500
 
 
-@app.route("/api/images/analysis", methods=["GET"])
-def get_image_analysis():
-    """Get recent image analysis results"""
+def sensor_partition_maintainer():
+    """Cada SENSOR_PARTITION_CHECK_INTERVAL crea las particiones que faltan y aplica la retención"""
+    logger.info("sensor_data partition maintainer started")
+    while True:
+        time.sleep(SENSOR_PARTITION_CHECK_INTERVAL)
+        try:
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                # Si otra task ya lo está haciendo, no hace falta esperarla
+                cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (SENSOR_PARTITION_LOCK_ID,))
+                if cursor.fetchone()[0] and sensor_data_relkind(cursor) == 'p':
+                    ensure_sensor_partitions(cursor)
+                    expire_sensor_partitions(cursor)
+                conn.commit()
+        except Exception as e:
+            logger.error(f"sensor_data partition maintenance failed: {e}")
+
+
+def insert_sensor_data_batch(rows):
+    """
+    Inserta un lote de lecturas en una sola sentencia multi-row y una sola transacción.
+    rows: lista de tuplas (user_id, timestamp, temperature, humidity, soil_moisture)
+    """
+    if not rows:
+        return 0
     try:
-        limit = request.args.get('limit', 10, type=int)
-        
-        conn = psycopg2.connect(
-            host=DB_HOST, port=DB_PORT, user=DB_USER, 
-            password=DB_PASS, dbname=DB_NAME
+        with DB_INSERT_SECONDS.time(), db_connection() as conn:
+            cursor = conn.cursor()
+            execute_values(
+                cursor,
+                "INSERT INTO sensor_data (userid, timestamp, temp, hum, soil) VALUES %s",
+                rows,
+                page_size=len(rows),
+            )
+            conn.commit()
+        DB_INSERT_ROWS.inc(len(rows))
+        logger.debug("Inserted %d sensor readings", len(rows))
+        return len(rows)
+    except Exception as e:
+        DB_INSERT_ERRORS.inc()
+        logger.error("Failed to insert sensor data batch: %s", e)
+        raise
+
+
+def receive_sensor_messages(sqs):
+    """Long-poll de SQS: devuelve hasta 10 mensajes (lista vacía si no llegó nada en 20s)"""
+    try:
+        with SQS_RECEIVE_SECONDS.time():
+            response = sqs.receive_message(
+                QueueUrl=SQS_QUEUE_URL,
+                MaxNumberOfMessages=10,
+                WaitTimeSeconds=20,  # Long polling - SQS notifies immediately when messages arrive
+                VisibilityTimeout=300,  # 5 minutes to process
+                AttributeNames=['ApproximateReceiveCount', 'SentTimestamp']
+            )
+    except Exception:
+        SQS_ERRORS.inc(operation="receive")
+        raise
+    messages = response.get('Messages', [])
+    if messages:
+        SQS_RECEIVED_MESSAGES.inc(len(messages))
+        # Lag de la cola: cuánto esperó cada mensaje desde que se publicó (SentTimestamp en ms)
+        now = time.time()
+        for message in messages:
+            sent = message.get('Attributes', {}).get('SentTimestamp')
+            if sent:
+                SQS_QUEUE_LAG_SECONDS.observe(max(0.0, now - int(sent) / 1000.0))
+    return messages
+
+
+def log_sensor_message(message, status, **fields):
+    """
+    Una línea estructurada por mensaje SQS (status: persisted / poison / retry + timings).
+    Los persistidos se muestrean con LOG_SUCCESS_SAMPLE_RATE; los fallidos se loguean siempre.
+    """
+    SENSOR_MESSAGES.inc(status=status)
+    if status == "persisted":
+        if LOG_SUCCESS_SAMPLE_RATE < 1.0 and random.random() >= LOG_SUCCESS_SAMPLE_RATE:
+            return
+        level = logging.INFO
+    else:
+        level = logging.WARNING
+    if not logger.isEnabledFor(level):
+        return
+    fields["message_id"] = message.get("MessageId")
+    fields["status"] = status
+    logger.log(level, "sensor_message", extra={"fields": fields})
+
+
+def parse_sensor_message(message):
+    """Parsea el body de un mensaje SQS. Devuelve un dict con la lectura o None si es inválido."""
+    try:
+        payload = json.loads(message['Body'])
+    except json.JSONDecodeError as e:
+        log_sensor_message(message, "poison", reason="invalid_json", error=str(e))
+        return None
+    logger.debug("Sensor message payload: %s", payload)
+
+    user_id = payload.get("user_id")
+    timestamp = payload.get("timestamp", time.strftime("%Y-%m-%d %H:%M:%S"))
+    hum = payload.get("humidity")
+    temp = payload.get("temperature")
+    soil = payload.get("soil_moisture")
+
+    if not user_id:
+        log_sensor_message(message, "poison", reason="missing_user_id")
+        return None
+
+    # Convertir valores a float para asegurar comparaciones numéricas
+    try:
+        hum = float(hum) if hum is not None else None
+        temp = float(temp) if temp is not None else None
+        soil = float(soil) if soil is not None else None
+    except (ValueError, TypeError) as e:
+        log_sensor_message(message, "poison", user_id=user_id, reason="invalid_values", error=str(e))
+        return None
+
+    return {
+        "user_id": user_id,
+        "timestamp": timestamp,
+        "temperature": temp,
+        "humidity": hum,
+        "soil_moisture": soil,
+        "received_at": time.monotonic(),
+    }
+
+
+SENSOR_MEASURES = [
+    # (campo de la lectura, sufijo de los parámetros min_/max_, nombre en el mail)
+    ("humidity", "humidity", "Humedad"),
+    ("temperature", "temperature", "Temperatura"),
+    ("soil_moisture", "soil_moisture", "Humedad del suelo"),
+]
+
+
+def _threshold(value):
+    return np.nan if value is None else value
+
+
+def evaluate_sensor_alerts(readings, parameters):
+    """
+    Evalúa los umbrales de todo un lote en una sola pasada vectorizada.
+    readings: lecturas parseadas; parameters: parámetros del usuario de cada lectura (mismo orden).
+    Arma una matriz lecturas x mediciones y la compara contra la matriz de rangos de los
+    usuarios del lote. Una medición se evalúa solo si tiene valor y el usuario definió los dos
+    límites (min_ y max_): sin valor o con un rango de un solo lado (NaN) no dispara ni rearma
+    la alerta. Solo las celdas que
+    pueden cambiar el estado de alerta (violaciones, o vuelta al rango de un usuario con
+    alertas activas) pasan por AlertStateTracker, en orden de llegada.
+    Devuelve la lista de alertas a enviar.
+    """
+    if not readings:
+        return []
+
+    fields = [field for field, _, _ in SENSOR_MEASURES]
+    values = np.array(
+        [[_threshold(reading[field]) for field in fields] for reading in readings],
+        dtype=np.float64,
+    )
+
+    # Una fila de rangos por usuario distinto del lote + índice de usuario por lectura
+    user_rows = {}
+    user_parameters = []
+    user_idx = np.empty(len(readings), dtype=np.intp)
+    for i, (reading, params) in enumerate(zip(readings, parameters)):
+        key = str(reading["user_id"])
+        row = user_rows.get(key)
+        if row is None:
+            row = user_rows[key] = len(user_parameters)
+            user_parameters.append(params)
+        user_idx[i] = row
+    low = np.array(
+        [[_threshold(p.get(f"min_{param}")) for _, param, _ in SENSOR_MEASURES] for p in user_parameters],
+        dtype=np.float64,
+    )[user_idx]
+    high = np.array(
+        [[_threshold(p.get(f"max_{param}")) for _, param, _ in SENSOR_MEASURES] for p in user_parameters],
+        dtype=np.float64,
+    )[user_idx]
+
+    # Rango incompleto o valor faltante: la celda no se evalúa (ni dispara ni rearma)
+    valid = ~np.isnan(low) & ~np.isnan(high) & ~np.isnan(values)
+
+    with np.errstate(invalid='ignore'):
+        candidates = valid & ((values > high) | (values < low))
+        # Usuarios cuyo estado puede rearmarse: ya en alerta o con violaciones en este lote
+        firing_users = alert_state.firing_users()
+        user_active = np.array([key in firing_users for key in user_rows], dtype=bool)
+        user_active[user_idx[candidates.any(axis=1)]] = True
+        if user_active.any():
+            margin = (high - low) * ALERT_HYSTERESIS_RATIO
+            rearm = (values >= low + margin) & (values <= high - margin)
+            candidates |= valid & rearm & user_active[user_idx][:, None]
+
+    alerts = []
+    for i, m in np.argwhere(candidates):
+        field, param, label = SENSOR_MEASURES[m]
+        reading = readings[i]
+        if alert_state.update(reading["user_id"], field, values[i, m], low[i, m], high[i, m]):
+            params = parameters[i]
+            alerts.append({
+                "email": params["email"],
+                "user_id": reading["user_id"],
+                "measurement": label,
+                "value": reading[field],
+                "expected_range": f"{params[f'min_{param}']} - {params[f'max_{param}']}",
+            })
+    return alerts
+
+
+# ---------------------
+# SQS acknowledgement
+# ---------------------
+SQS_BATCH_LIMIT = 10  # máximo de entries por llamada *_batch de SQS
+
+
+def delete_messages(sqs, queue_url, messages):
+    """Elimina mensajes procesados con delete_message_batch (hasta 10 por llamada)"""
+    for start in range(0, len(messages), SQS_BATCH_LIMIT):
+        chunk = messages[start:start + SQS_BATCH_LIMIT]
+        response = sqs.delete_message_batch(
+            QueueUrl=queue_url,
+            Entries=[
+                {"Id": str(i), "ReceiptHandle": message['ReceiptHandle']}
+                for i, message in enumerate(chunk)
+            ]
         )
-        cursor = conn.cursor()
+        for failed in response.get('Failed', []):
+            SQS_ERRORS.inc(operation="delete")
+            logger.error("Failed to delete message %s: %s",
+                         chunk[int(failed['Id'])].get('MessageId'), failed.get('Message'))
+
+
+def retry_delay(message):
+    """Backoff exponencial según ApproximateReceiveCount: base, 2*base, 4*base... hasta el máximo"""
+    receive_count = int(message.get('Attributes', {}).get('ApproximateReceiveCount', 1))
+    return min(SQS_RETRY_BASE_DELAY * 2 ** (receive_count - 1), SQS_RETRY_MAX_DELAY)
+
+
+def release_messages(sqs, queue_url, retryable=(), poison=()):
+    """
+    Devuelve mensajes fallidos a la cola con change_message_visibility_batch:
+    - retryable: errores transitorios (BD caída, etc.), reaparecen tras un backoff exponencial
+    - poison: mensajes que nunca se van a poder procesar (JSON inválido, usuario inexistente);
+      con visibilidad 0 se reciben de nuevo enseguida y alcanzan maxReceiveCount,
+      así la redrive policy los mueve a la DLQ sin esperar el VisibilityTimeout de 300s
+    """
+    entries = [(message, retry_delay(message)) for message in retryable]
+    entries += [(message, 0) for message in poison]
+    for start in range(0, len(entries), SQS_BATCH_LIMIT):
+        chunk = entries[start:start + SQS_BATCH_LIMIT]
+        response = sqs.change_message_visibility_batch(
+            QueueUrl=queue_url,
+            Entries=[
+                {"Id": str(i), "ReceiptHandle": message['ReceiptHandle'], "VisibilityTimeout": timeout}
+                for i, (message, timeout) in enumerate(chunk)
+            ]
+        )
+        for failed in response.get('Failed', []):
+            SQS_ERRORS.inc(operation="change_visibility")
+            logger.error("Failed to change visibility of message %s: %s",
+                         chunk[int(failed['Id'])][0].get('MessageId'), failed.get('Message'))
+
+
+def process_sensor_batch(sqs, items):
+    """
+    Procesa un lote de lecturas ya parseadas: parámetros, alertas, un único INSERT
+    multi-row y el ack correspondiente en SQS.
+    items: lista de tuplas (message, reading) en orden de llegada
+    """
+    started = time.monotonic()
+    accepted = []
+    readings = []
+    parameters = []
+    retryable = []
+    poison = []
+    for message, reading in items:
+        try:
+            user_id = reading["user_id"]
+            with PARAMETER_LOOKUP_SECONDS.time():
+                user_parameters = get_user_parameters(user_id)
+            if user_parameters is None:
+                log_sensor_message(message, "poison", user_id=user_id, reason="unknown_user")
+                poison.append(message)
+                continue
+            accepted.append(message)
+            readings.append(reading)
+            parameters.append(user_parameters)
+        except Exception as e:
+            log_sensor_message(message, "retry", user_id=reading["user_id"], reason="parameters", error=str(e))
+            retryable.append(message)
+    params_done = time.monotonic()
+
+    for alert in evaluate_sensor_alerts(readings, parameters):
+        ALERTS_TRIGGERED.inc(measurement=alert["measurement"])
+        logger.warning("%s fuera de rango para user %s: %s (rango %s)", alert['measurement'],
+                       alert['user_id'], alert['value'], alert['expected_range'])
+        send_email_alert(alert["email"], alert["user_id"], alert["measurement"],
+                         alert["value"], alert["expected_range"])
+    alerts_done = time.monotonic()
+
+    rows = [
+        (reading["user_id"], reading["timestamp"], reading["temperature"],
+         reading["humidity"], reading["soil_moisture"])
+        for reading in readings
+    ]
+
+    # Un único INSERT multi-row + commit para todo el lote.
+    # Si falla, ningún mensaje se borra y todos vuelven a la cola con backoff.
+    insert_error = None
+    if rows:
+        try:
+            insert_sensor_data_batch(rows)
+        except Exception as e:
+            insert_error = str(e)
+            retryable.extend(accepted)
+    insert_done = time.monotonic()
+
+    # Solo se eliminan de la cola los mensajes efectivamente persistidos
+    persisted = accepted if insert_error is None else []
+    if persisted:
+        delete_messages(sqs, SQS_QUEUE_URL, persisted)
+    if retryable or poison:
+        release_messages(sqs, SQS_QUEUE_URL, retryable=retryable, poison=poison)
+    finished = time.monotonic()
+
+    # Timings del lote, compartidos por todos sus mensajes (ms)
+    timings = {
+        "batch_size": len(items),
+        "params_ms": round((params_done - started) * 1000, 2),
+        "alerts_ms": round((alerts_done - params_done) * 1000, 2),
+        "insert_ms": round((insert_done - alerts_done) * 1000, 2),
+        "ack_ms": round((finished - insert_done) * 1000, 2),
+    }
+    for message, reading in zip(accepted, readings):
+        queued_ms = round((started - reading["received_at"]) * 1000, 2)
+        total_ms = round((finished - reading["received_at"]) * 1000, 2)
+        if insert_error is None:
+            log_sensor_message(message, "persisted", user_id=reading["user_id"],
+                               queued_ms=queued_ms, total_ms=total_ms, **timings)
+        else:
+            log_sensor_message(message, "retry", user_id=reading["user_id"], reason="insert",
+                               error=insert_error, queued_ms=queued_ms, total_ms=total_ms, **timings)
+
+
+def shard_for_user(user_id, shard_count):
+    """Todas las lecturas de un mismo userid van al mismo processor (orden por usuario)"""
+    return zlib.crc32(str(user_id).encode()) % shard_count
+
+
+def sensor_poller(sqs, shards):
+    """
+    Recibe mensajes de SQS, descarta los inválidos y reparte las lecturas entre las
+    colas de los processors. put() bloquea si la cola está llena (backpressure):
+    el poller deja de recibir hasta que los processors se ponen al día.
+    """
+    while worker_running:
+        try:
+            messages = receive_sensor_messages(sqs)
+            if not messages:
+                logger.debug("No messages received")
+                continue
+
+            logger.debug("Received %d sensor messages", len(messages))
+            poison = []
+            for message in messages:
+                reading = parse_sensor_message(message)
+                if reading is None:
+                    poison.append(message)
+                    continue
+                shards[shard_for_user(reading["user_id"], len(shards))].put((message, reading))
+            if poison:
+                release_messages(sqs, SQS_QUEUE_URL, poison=poison)
+
+        except Exception as e:
+            logger.error(f"Poller error: {e}")
+            time.sleep(2)
+
+
+def sensor_processor(sqs, shard):
+    """
+    Toma lecturas de su cola (bloqueando mientras esté vacía) y las procesa en lotes de
+    hasta SENSOR_BATCH_MAX_ROWS. Con SENSOR_BATCH_WINDOW_SECONDS > 0 espera hasta esa
+    ventana para juntar más lecturas por commit. Termina al recibir None.
+    """
+    stopping = False
+    while not stopping:
+        item = shard.get()
+        if item is None:
+            break
+        items = [item]
+        deadline = time.monotonic() + SENSOR_BATCH_WINDOW_SECONDS
+        while len(items) < SENSOR_BATCH_MAX_ROWS:
+            try:
+                remaining = deadline - time.monotonic()
+                item = shard.get(timeout=remaining) if remaining > 0 else shard.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stopping = True
+                break
+            items.append(item)
+
+        try:
+            process_sensor_batch(sqs, items)
+        except Exception as e:
+            logger.error(f"Processor error: {e}")
+
+
+def worker(pollers=None, processors=None):
+    """
+    Arranca SQS_POLLER_COUNT pollers y SQS_PROCESSOR_COUNT processors conectados por
+    colas acotadas (SQS_BUFFER_SIZE lecturas por processor) y espera a que terminen.
+    """
+    global worker_running
+    pollers = pollers or SQS_POLLER_COUNT
+    processors = processors or SQS_PROCESSOR_COUNT
+    try:
+        sqs, s3 = get_aws_clients()
+        if not sqs:
+            logger.error("Worker stopped: AWS clients unavailable")
+            return
+
+        if not SQS_QUEUE_URL:
+            logger.error("Worker stopped: SQS_QUEUE_URL not configured")
+            return
+
+        logger.info(f"Worker started, polling SQS queue: {SQS_QUEUE_URL} ({pollers} pollers, {processors} processors)")
+        shards = [queue.Queue(maxsize=SQS_BUFFER_SIZE) for _ in range(processors)]
+        processor_threads = [
+            threading.Thread(target=sensor_processor, args=(sqs, shard), name=f"sensor-processor-{i}", daemon=True)
+            for i, shard in enumerate(shards)
+        ]
+        poller_threads = [
+            threading.Thread(target=sensor_poller, args=(sqs, shards), name=f"sensor-poller-{i}", daemon=True)
+            for i in range(pollers)
+        ]
+        for thread in processor_threads + poller_threads:
+            thread.start()
+
+        # Al detenerse: primero terminan los pollers, después los processors vacían sus colas
+        for thread in poller_threads:
+            thread.join()
+        for shard in shards:
+            shard.put(None)
+        for thread in processor_threads:
+            thread.join()
+        logger.info("Worker stopped")
+
+    except Exception as e:
+        logger.error(f"❌ Failed to start SQS worker: {e}")
+        raise
+
+
+# ---------------------
+# API endpoints
+# ---------------------
+@app.route("/api/start", methods=["POST"])
+def start_worker():
+    global worker_thread, worker_running
+    if worker_running:
+        return jsonify({"success": False, "message": "Worker already running"}), 400
+
+    # Paralelismo opcional en el payload: {"pollers": 2, "processors": 4}
+    payload = request.get_json(silent=True) or {}
+    try:
+        pollers = int(payload.get("pollers") or SQS_POLLER_COUNT)
+        processors = int(payload.get("processors") or SQS_PROCESSOR_COUNT)
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "pollers and processors must be integers"}), 400
+    if pollers < 1 or processors < 1:
+        return jsonify({"success": False, "message": "pollers and processors must be >= 1"}), 400
+
+    worker_running = True
+    worker_thread = threading.Thread(target=worker, args=(pollers, processors), daemon=True)
+    worker_thread.start()
+    return jsonify({"success": True, "message": "Worker started", "pollers": pollers, "processors": processors})
+
+
+@app.route("/api/stop", methods=["POST"])
+def stop_worker():
+    global worker_running
+    if not worker_running:
+        return jsonify({"success": False, "message": "Worker not running"}), 400
+    worker_running = False
+    return jsonify({"success": True, "message": "Worker stopping"})
+
+
+@app.route("/ping", methods=["GET"])
+def ping():
+    return jsonify({"status": "ok", "service": "iot-consumer", "timestamp": datetime.now().isoformat()})
+
+@app.route("/health", methods=["GET"])
+def health():
+    """Extended health check with database connectivity"""
+    health_data = {
+        "status": "ok",
+        "service": "processing-engine", 
+        "timestamp": datetime.now().isoformat(),
+        "database": {"connected": False, "tables": []},
+        "s3": {"configured": bool(RAW_IMAGES_BUCKET and PROCESSED_IMAGES_BUCKET)},
+        "sqs": {"configured": bool(SQS_QUEUE_URL)},
+        "alerts": {**alert_dispatcher.stats(), "firing": alert_state.firing_count()}
+    }
+    
+    # Check database connectivity and tables
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Check if tables exist
+            cursor.execute("""
+                SELECT table_name 
+                FROM information_schema.tables 
+                WHERE table_schema = 'public'
+                ORDER BY table_name
+            """)
+            tables = [row[0] for row in cursor.fetchall()]
+            
+            # Count records in drone_images if exists
+            drone_images_count = 0
+            if 'drone_images' in tables:
+                cursor.execute("SELECT COUNT(*) FROM drone_images")
+                drone_images_count = cursor.fetchone()[0]
         
-        cursor.execute("""
-            SELECT drone_id, raw_s3_key, processed_s3_key, field_status, 
-                   analysis_confidence, analyzed_at, processed_at
-            FROM drone_images 
-            WHERE analyzed_at IS NOT NULL
-            ORDER BY analyzed_at DESC 
-            LIMIT %s
-        """, (limit,))
+        health_data["database"] = {
+            "connected": True,
+            "tables": tables,
+            "drone_images_count": drone_images_count,
+            "pool": db_pool.stats(),
+            "parameters_cache": user_parameters_cache.stats()
+        }
         
-        results = cursor.fetchall()
-        conn.close()
+    except Exception as e:
+        health_data["database"] = {
+            "connected": False,
+            "error": str(e),
+            "pool": db_pool.stats() if db_pool is not None else None
+        }
+    
+    return jsonify(health_data)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Métricas en formato de texto de Prometheus (throughput, latencias por etapa, errores, lag)"""
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+@app.route("/api/sensors/average", methods=["GET"])
+def get_sensor_averages():
+    """Get recent sensor data averages"""
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Get last 5 minutes of data for averages (LOCALTIMESTAMP: la columna es sin zona
+            # horaria, así el planner descarta las particiones viejas)
+            cursor.execute("""
+                SELECT AVG(temp), COUNT(temp), AVG(hum), COUNT(hum), AVG(soil), COUNT(soil)
+                FROM sensor_data 
+                WHERE timestamp >= LOCALTIMESTAMP - INTERVAL '5 minutes'
+            """)
+            
+            row = cursor.fetchone()
+        
+        averages = {}
+        sensors_count = 0
+        for i, measure in enumerate(['TEMP', 'HUM', 'SOIL']):
+            avg_value, count = row[2 * i], row[2 * i + 1]
+            if count:
+                averages[measure] = round(float(avg_value), 2)
+                sensors_count += count
+        
+        return jsonify({
+            "success": True,
+            "data": {
+                "timestamp": datetime.now().isoformat(),
+                "sensors_count": sensors_count,
+                "averages": averages
+            }
+        })
+        
+    except Exception as e:
+        logger.error(f"Error getting sensor averages: {e}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+
+@app.route("/api/images/analysis", methods=["GET"])
+def get_image_analysis():
+    """Get recent image analysis results"""
+    try:
+        limit = request.args.get('limit', 10, type=int)
+        
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT user_id, raw_s3_key, processed_s3_key, field_status, 
+                       analysis_confidence, analyzed_at, processed_at
+                FROM drone_images 
+                WHERE analyzed_at IS NOT NULL
+                ORDER BY analyzed_at DESC 
+                LIMIT %s
+            """, (limit,))
+            
+            results = cursor.fetchall()
         
         analyses = []
         for row in results:
             analyses.append({
-                "drone_id": row[0],
+                "drone_id": row[0],  # la columna es user_id, pero guarda el id del drone del nombre del archivo
                 "raw_s3_key": row[1],
                 "processed_s3_key": row[2],
                 "field_status": row[3],
@@ -517,40 +1936,42 @@ def get_sensor_data():
     try:
         limit = request.args.get('limit', 20, type=int)
         user_id = request.args.get('user_id', None)
+        # Opcional: solo las últimas `hours` horas, así el scan se limita a esas particiones
+        hours = request.args.get('hours', None, type=int)
         
-        conn = psycopg2.connect(
-            host=DB_HOST, port=DB_PORT, user=DB_USER, 
-            password=DB_PASS, dbname=DB_NAME
-        )
-        cursor = conn.cursor()
-        
+        conditions = []
+        params = []
         if user_id:
-            cursor.execute("""
-                SELECT user_id, timestamp, measure, value
-                FROM sensor_data 
-                WHERE user_id = %s
-                ORDER BY timestamp DESC 
-                LIMIT %s
-            """, (user_id, limit))
-        else:
-            cursor.execute("""
-                SELECT user_id, timestamp, measure, value
+            conditions.append("userid = %s")
+            params.append(user_id)
+        if hours:
+            conditions.append("timestamp >= LOCALTIMESTAMP - make_interval(hours => %s)")
+            params.append(hours)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT userid, timestamp, temp, hum, soil
                 FROM sensor_data 
+                {where}
                 ORDER BY timestamp DESC 
                 LIMIT %s
-            """, (limit,))
-        
-        results = cursor.fetchall()
-        conn.close()
+            """, (*params, limit))
+            results = cursor.fetchall()
         
+        # Una entrada por medida, con el formato de siempre (measure/value)
         data = []
         for row in results:
-            data.append({
-                "user_id": row[0],
-                "timestamp": row[1].isoformat() if row[1] else None,
-                "measure": row[2],
-                "value": float(row[3]) if row[3] else 0.0
-            })
+            for measure, value in zip(("TEMP", "HUM", "SOIL"), row[2:]):
+                if value is None:
+                    continue
+                data.append({
+                    "user_id": row[0],
+                    "timestamp": row[1].isoformat() if row[1] else None,
+                    "measure": measure,
+                    "value": float(value)
+                })
         
         return jsonify({
             "success": True,
@@ -569,29 +1990,65 @@ def get_sensor_data():
 # ---------------------
 # Image Processing Functions
 # ---------------------
-def is_image_processed(s3_key):
-    """Verifica si la imagen ya fue procesada"""
-    try:
-        conn = psycopg2.connect(
-            host=DB_HOST, port=DB_PORT, user=DB_USER, 
-            password=DB_PASS, dbname=DB_NAME
-        )
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1 FROM drone_images WHERE raw_s3_key = %s", (s3_key,))
-        result = cursor.fetchone()
-        conn.close()
-        return result is not None
-    except Exception as e:
-        logger.error(f"Error checking if image processed: {e}")
-        # En caso de error de BD, verificar si existe en S3 processed
-        try:
-            processed_key = f"processed/{s3_key}"
-            s3_client.head_object(Bucket=PROCESSED_IMAGES_BUCKET, Key=processed_key)
-            logger.info(f"Image found in processed bucket: {processed_key}")
-            return True  # Existe en S3 processed, asumir que fue procesada
-        except:
-            logger.warning(f"Image not found in processed bucket, will process: {s3_key}")
-            return False  # No existe en processed, procesar
+class ProcessedImageKeys:
+    """
+    Set en memoria de las raw_s3_key ya procesadas (status 'done') en drone_images, precargado
+    al arrancar. unprocessed() resuelve una página entera de keys: las que están en el set no van
+    a la BD y el resto se consulta con una sola query (raw_s3_key = ANY(...), índice único).
+    Solo crece: las filas de drone_images no se borran.
+    """
+
+    def __init__(self):
+        self._keys = set()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "queries": 0, "queried_keys": 0}
+
+    def warm_up(self):
+        """Carga todas las keys procesadas (cursor del lado del servidor, en tandas)"""
+        count = 0
+        with db_connection() as conn:
+            with conn.cursor(name="processed_image_keys") as cursor:
+                cursor.itersize = 10000
+                cursor.execute("SELECT raw_s3_key FROM drone_images WHERE raw_s3_key IS NOT NULL AND status = 'done'")
+                for (s3_key,) in cursor:
+                    with self._lock:
+                        self._keys.add(s3_key)
+                    count += 1
+            conn.commit()
+        logger.info(f"Processed image keys warmed up with {count} keys")
+
+    def add(self, s3_key):
+        with self._lock:
+            self._keys.add(s3_key)
+
+    def unprocessed(self, s3_keys):
+        """Keys (sin repetir, en orden) que todavía no terminaron de procesarse. Propaga errores de BD."""
+        s3_keys = list(dict.fromkeys(s3_keys))
+        with self._lock:
+            unknown = [s3_key for s3_key in s3_keys if s3_key not in self._keys]
+            self._stats["hits"] += len(s3_keys) - len(unknown)
+        if not unknown:
+            return []
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT raw_s3_key FROM drone_images WHERE raw_s3_key = ANY(%s) AND status = 'done'",
+                           (unknown,))
+            found = {row[0] for row in cursor.fetchall()}
+        with self._lock:
+            self._keys.update(found)
+            self._stats["queries"] += 1
+            self._stats["queried_keys"] += len(unknown)
+        return [s3_key for s3_key in unknown if s3_key not in found]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._keys)
+        return stats
+
+
+processed_image_keys = ProcessedImageKeys()
+
 
 def extract_user_id_from_key(s3_key):
     """Extrae user_id del path S3"""
@@ -602,254 +2059,813 @@ def extract_user_id_from_key(s3_key):
     except:
         return "unknown"
 
-def detect_fire(image):
+FIRE_COVERAGE_THRESHOLD = 0.5  # % de la imagen con píxeles de fuego para disparar la alerta
+ANALYSIS_STRIP_ROWS = 256  # filas por franja: los temporales del kernel son de una franja, no de la imagen
+
+# El límite de PIL (DecompressionBombError) se alinea con el nuestro: los ortomosaicos grandes son esperables
+Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+
+
+@dataclass
+class AnalysisTotals:
+    """Acumuladores de analyze_image; se suman entre bandas/tiles de una misma imagen"""
+    pixel_count: int = 0
+    fire_pixels: int = 0
+    green_index_sum: float = 0.0
+    channel_sum: int = 0
+
+    def add(self, other):
+        self.pixel_count += other.pixel_count
+        self.fire_pixels += other.fire_pixels
+        self.green_index_sum += other.green_index_sum
+        self.channel_sum += other.channel_sum
+
+
+@dataclass
+class ImageAnalysis:
+    """Resultado compacto de analyze_image (máscaras booleanas + métricas agregadas)"""
+    fire_mask: np.ndarray
+    green_mask: np.ndarray
+    fire_coverage: float
+    fire_detected: bool
+    green_coverage: float
+    brightness: float
+    fire_clusters: list = field(default_factory=list)
+
+    def fire_info(self):
+        return {'fire_detected': self.fire_detected, 'fire_coverage': self.fire_coverage,
+                'fire_clusters': self.fire_clusters}
+
+    def metrics(self):
+        return {'green_coverage': self.green_coverage, 'brightness': self.brightness}
+
+    @classmethod
+    def from_totals(cls, fire_mask, green_mask, totals):
+        pixel_count = max(totals.pixel_count, 1)
+        fire_coverage = round(totals.fire_pixels / pixel_count * 100, 2)
+        return cls(
+            fire_mask=fire_mask,
+            green_mask=green_mask,
+            fire_coverage=fire_coverage,
+            fire_detected=fire_coverage > FIRE_COVERAGE_THRESHOLD,
+            # Índice [-1, 1] llevado a 0-100
+            green_coverage=round((totals.green_index_sum / pixel_count + 1) / 2 * 100, 1),
+            brightness=round(totals.channel_sum / (pixel_count * 3), 1),
+        )
+
+    def scaled_to(self, size):
+        """Copia con las máscaras llevadas a size (width, height) por vecino más cercano"""
+        def scale(mask):
+            return np.asarray(Image.fromarray(mask).resize(size, Image.Resampling.NEAREST))
+        return ImageAnalysis(
+            fire_mask=scale(self.fire_mask),
+            green_mask=scale(self.green_mask),
+            fire_coverage=self.fire_coverage,
+            fire_detected=self.fire_detected,
+            green_coverage=self.green_coverage,
+            brightness=self.brightness,
+        )
+
+
+def analyze_image(image):
     """
-    Detecta presencia de fuego basado en análisis de color
-    Busca píxeles con tonos naranja/rojo brillante característicos del fuego
+    Análisis de la imagen en una sola pasada, franja por franja, sobre los uint8 originales:
+    - Fuego: rojo intenso (> 180), verde presente pero menor que el rojo (80 < g < 0.8r),
+      azul mucho menor (b < 0.7g) y brillo alto (r + g + b > 400)
+    - Vegetación (heatmap): verde > 1.1 * rojo y verde > 1.1 * azul
+    - Índice de verdor (g - r) / (g + r) normalizado a 0-100 y brillo promedio
+    Las comparaciones con factores se hacen en enteros (5g < 4r en vez de g < 0.8r) y el
+    índice en float32, así que no se materializa ningún buffer float64 del tamaño de la imagen.
     """
-    img_array = np.array(image)
-    
-    # Separar canales RGB
-    r = img_array[:, :, 0].astype(float)
-    g = img_array[:, :, 1].astype(float)
-    b = img_array[:, :, 2].astype(float)
-    
-    # Criterios para detectar fuego:
-    # 1. Rojo alto (> 180)
-    # 2. Verde moderado-bajo (< rojo)
-    # 3. Azul bajo (< verde)
-    # 4. Brillo alto (suma RGB > 400)
-    
-    fire_mask = (
-        (r > 180) &  # Rojo intenso
-        (g > 80) & (g < r * 0.8) &  # Verde presente pero menor que rojo
-        (b < g * 0.7) &  # Azul mucho menor
-        ((r + g + b) > 400)  # Brillo alto
-    )
-    
-    # Calcular porcentaje de píxeles que parecen fuego
-    total_pixels = fire_mask.size
-    fire_pixels = np.sum(fire_mask)
-    fire_percentage = (fire_pixels / total_pixels) * 100
-    
-    # Detectar regiones contiguas de fuego (clusters)
-    fire_detected = fire_percentage > 0.5  # Más de 0.5% de la imagen
-    
-    return {
-        'fire_detected': fire_detected,
-        'fire_coverage': round(fire_percentage, 2),
-        'fire_mask': fire_mask
-    }
+    return ImageAnalysis.from_totals(*analyze_pixels(np.asarray(image)))
+
+
+def analyze_pixels(pixels):
+    """Kernel de analyze_image sobre un array HxWx3 uint8: (fire_mask, green_mask, AnalysisTotals)"""
+    height, width = pixels.shape[:2]
+    fire_mask = np.empty((height, width), dtype=bool)
+    green_mask = np.empty((height, width), dtype=bool)
+    totals = AnalysisTotals(pixel_count=height * width)
+
+    for top in range(0, height, ANALYSIS_STRIP_ROWS):
+        strip = pixels[top:top + ANALYSIS_STRIP_ROWS]
+        r = strip[:, :, 0].astype(np.int16)
+        g = strip[:, :, 1].astype(np.int16)
+        b = strip[:, :, 2].astype(np.int16)
+        total = r + g + b
+
+        fire = fire_mask[top:top + ANALYSIS_STRIP_ROWS]
+        np.greater(r, 180, out=fire)
+        fire &= g > 80
+        fire &= g * 5 < r * 4
+        fire &= b * 10 < g * 7
+        fire &= total > 400
+        totals.fire_pixels += int(np.count_nonzero(fire))
+
+        green = green_mask[top:top + ANALYSIS_STRIP_ROWS]
+        g10 = g * 10
+        np.greater(g10, r * 11, out=green)
+        green &= g10 > b * 11
+
+        # Índice de verdor (donde g + r == 0 la diferencia ya es 0)
+        gr_sum = (g + r).astype(np.float32)
+        gr_diff = (g - r).astype(np.float32)
+        np.divide(gr_diff, gr_sum, out=gr_diff, where=gr_sum > 0)
+        totals.green_index_sum += float(gr_diff.sum(dtype=np.float64))
+        totals.channel_sum += int(total.sum(dtype=np.int64))
+
+    return fire_mask, green_mask, totals
+
+
+def _label_runs(grid):
+    """
+    Etiquetado de componentes conexas (8-vecindad) por runs + union-find: cada fila se
+    parte en tramos contiguos de celdas en True y cada tramo se une con los tramos de la
+    fila anterior que lo tocan (incluyendo diagonales).
+    Devuelve [(fila, inicio, fin exclusivo, raíz)] de todos los tramos.
+    """
+    parent = []
+
+    def find(label):
+        while parent[label] != label:
+            parent[label] = parent[parent[label]]
+            label = parent[label]
+        return label
+
+    runs = []
+    previous = []
+    for y, row in enumerate(grid):
+        edges = np.diff(np.concatenate(([0], row.view(np.int8), [0])))
+        current = []
+        for start, end in zip(np.flatnonzero(edges == 1).tolist(), np.flatnonzero(edges == -1).tolist()):
+            label = None
+            for prev_start, prev_end, prev_label in previous:
+                # El tramo anterior [prev_start, prev_end) toca a [start, end) en 8-vecindad
+                if prev_start <= end and prev_end >= start:
+                    if label is None:
+                        label = find(prev_label)
+                    else:
+                        root = find(prev_label)
+                        if root != label:
+                            parent[root] = label
+            if label is None:
+                label = len(parent)
+                parent.append(label)
+            current.append((start, end, label))
+            runs.append((y, start, end, label))
+        previous = current
+    return [(y, start, end, find(label)) for y, start, end, label in runs]
+
+
+def find_fire_clusters(fire_mask, grid_size=FIRE_CLUSTER_GRID, min_area=FIRE_MIN_CLUSTER_AREA):
+    """
+    Agrupa la máscara de fuego en regiones contiguas. La máscara se reduce a una grilla de
+    lado <= grid_size (cada celda cuenta sus píxeles de fuego) y se etiqueta la grilla, así el
+    costo no depende de la resolución. Por cluster: área (% de la imagen, sumando los píxeles
+    reales de sus celdas), centroide ponderado y bounding box, ambos en fracciones 0-1 de
+    ancho/alto. Descarta los clusters de menos de min_area % y devuelve los más grandes primero.
+    """
+    height, width = fire_mask.shape
+    if height == 0 or width == 0 or not fire_mask.any():
+        return []
+    cell = max(1, -(-max(height, width) // grid_size))
+    rows, cols = -(-height // cell), -(-width // cell)
+    padded = np.zeros((rows * cell, cols * cell), dtype=np.uint8)
+    padded[:height, :width] = fire_mask
+    counts = padded.reshape(rows, cell, cols, cell).sum(axis=(1, 3), dtype=np.int32)
+
+    clusters = {}
+    for y, start, end, root in _label_runs(counts > 0):
+        row_counts = counts[y, start:end]
+        entry = clusters.get(root)
+        if entry is None:
+            entry = clusters[root] = {"pixels": 0, "sx": 0.0, "sy": 0.0,
+                                      "x0": start, "y0": y, "x1": end, "y1": y + 1}
+        pixels = int(row_counts.sum())
+        entry["pixels"] += pixels
+        entry["sx"] += float(((np.arange(start, end) + 0.5) * row_counts).sum())
+        entry["sy"] += (y + 0.5) * pixels
+        entry["x0"] = min(entry["x0"], start)
+        entry["x1"] = max(entry["x1"], end)
+        entry["y1"] = y + 1
+
+    total = height * width
+    result = []
+    for entry in clusters.values():
+        area = entry["pixels"] / total * 100
+        if area < min_area:
+            continue
+        result.append({
+            "area": round(area, 3),
+            "centroid": [round(entry["sx"] / entry["pixels"] * cell / width, 4),
+                         round(entry["sy"] / entry["pixels"] * cell / height, 4)],
+            "bbox": [round(entry["x0"] * cell / width, 4), round(entry["y0"] * cell / height, 4),
+                     round(min(entry["x1"] * cell, width) / width, 4),
+                     round(min(entry["y1"] * cell, height) / height, 4)],
+        })
+    result.sort(key=lambda cluster: cluster["area"], reverse=True)
+    return result
 
 
-def calculate_vegetation_metrics(image):
-    """Calcula métricas de vegetación basadas en análisis de color"""
-    img_array = np.array(image)
-    
-    # Separar canales RGB
-    r = img_array[:, :, 0].astype(float)
-    g = img_array[:, :, 1].astype(float)
-    b = img_array[:, :, 2].astype(float)
-    
-    # Calcular "índice de verdor" simple (más verde = más vegetación)
-    # Formula: (Verde - Rojo) / (Verde + Rojo) normalizado
-    with np.errstate(divide='ignore', invalid='ignore'):
-        green_index = np.where((g + r) > 0, (g - r) / (g + r), 0)
-    
-    # Normalizar a 0-100
-    green_percentage = np.clip(green_index, -1, 1)
-    green_percentage = ((green_percentage + 1) / 2) * 100
-    
-    avg_green = float(np.mean(green_percentage))
-    
-    # Calcular brillo promedio
-    brightness = float(np.mean(img_array))
-    
-    return {
-        'green_coverage': round(avg_green, 1),
-        'brightness': round(brightness, 1)
-    }
+def detect_fire_clusters(analysis):
+    """
+    Completa analysis con los clusters de fuego. La alerta solo queda en pie si los clusters
+    que superan el tamaño mínimo suman más de FIRE_COVERAGE_THRESHOLD (filtra el ruido de
+    píxeles sueltos con color de fuego)
+    """
+    clusters = find_fire_clusters(analysis.fire_mask)
+    analysis.fire_clusters = clusters[:FIRE_MAX_CLUSTERS]
+    if analysis.fire_detected and sum(cluster["area"] for cluster in clusters) <= FIRE_COVERAGE_THRESHOLD:
+        logger.info(f"Fire coverage {analysis.fire_coverage}% discarded: no cluster above {FIRE_MIN_CLUSTER_AREA}%")
+        analysis.fire_detected = False
+    return analysis
 
 
-def create_vegetation_heatmap(image, fire_info=None):
-    """Crea un overlay SUTIL de mapa de calor sobre zonas verdes y FUEGO"""
+def create_vegetation_heatmap(image, analysis):
+    """
+    Crea un overlay SUTIL de mapa de calor sobre zonas verdes y FUEGO.
+    Solo se tocan los píxeles de las máscaras (el resto de la imagen queda igual).
+    """
     img_array = np.array(image)
-    
-    # Separar canales
-    r = img_array[:, :, 0].astype(float)
-    g = img_array[:, :, 1].astype(float)
-    b = img_array[:, :, 2].astype(float)
-    
-    # Detectar píxeles "verdes" (donde verde > rojo y verde > azul)
-    green_mask = (g > r * 1.1) & (g > b * 1.1)
-    
-    # Crear overlay
-    overlay = img_array.copy()
-    overlay[green_mask] = [0, 200, 0]  # Verde más suave
-    
-    # Si hay detección de fuego, resaltar en ROJO BRILLANTE
-    if fire_info and fire_info['fire_detected']:
-        fire_mask = fire_info['fire_mask']
-        overlay[fire_mask] = [255, 50, 0]  # ROJO-NARANJA INTENSO para fuego
-        logger.warning(f"🔥 FIRE DETECTED IN IMAGE! Coverage: {fire_info['fire_coverage']}%")
-    
+
     # Mezclar original con overlay - MÁS SUTIL (20% overlay normal, 50% si hay fuego)
-    blend_factor = 0.5 if (fire_info and fire_info['fire_detected']) else 0.2
-    blended = (img_array * (1 - blend_factor) + overlay * blend_factor).astype(np.uint8)
-    
-    return Image.fromarray(blended)
+    blend_factor = 0.5 if analysis.fire_detected else 0.2
+    layers = [(analysis.green_mask, (0, 200, 0))]  # Verde más suave
+    if analysis.fire_detected:
+        # ROJO-NARANJA INTENSO para fuego (tiene prioridad sobre el verde)
+        layers = [(analysis.green_mask & ~analysis.fire_mask, (0, 200, 0)),
+                  (analysis.fire_mask, (255, 50, 0))]
+
+    for mask, color in layers:
+        selected = img_array[mask].astype(np.float32)
+        selected *= 1 - blend_factor
+        selected += np.array(color, dtype=np.float32) * blend_factor
+        img_array[mask] = selected.astype(np.uint8)
+
+    return Image.fromarray(img_array)
+
+
+class OverlayRenderer:
+    """
+    Dibuja el overlay de información sin recorrer la imagen completa:
+    - Las fuentes se cargan una sola vez
+    - Las plantillas semitransparentes (franja superior, caja de fuego, caja de estado) se
+      pre-renderizan en RGBA una vez por tamaño y se cachean
+    - Cada plantilla se pega en su rectángulo usando su propio alfa como máscara, que es
+      lo mismo que alpha_composite sobre una imagen opaca pero solo toca esos píxeles
+    - El texto se dibuja encima, opaco, igual que antes (solo toca los píxeles de los glifos)
+    Las plantillas miden un píxel más que la caja nominal porque los rectángulos de
+    ImageDraw incluyen su borde final.
+    """
+
+    FONT_BOLD = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+    FONT_REGULAR = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+    BAND_HEIGHT = 120  # OVERLAY SUPERIOR COMPACTO - TAMAÑO FIJO
+    FIRE_BOX = (350, 80)
+    STATUS_BOX = (200, 50)
+    MARGIN = 15
+
+    def __init__(self, max_templates=32):
+        self._fonts = None
+        self._templates = OrderedDict()
+        self._max_templates = max_templates
+        self._lock = threading.Lock()
+
+    def fonts(self):
+        if self._fonts is None:
+            # Intentar cargar fuentes con tamaños fijos
+            try:
+                self._fonts = {
+                    "title": ImageFont.truetype(self.FONT_BOLD, 28),
+                    "small": ImageFont.truetype(self.FONT_REGULAR, 20),
+                    "alert": ImageFont.truetype(self.FONT_BOLD, 32),
+                }
+            except OSError:
+                default = ImageFont.load_default()
+                self._fonts = {"title": default, "small": default, "alert": default}
+        return self._fonts
+
+    def _template(self, key, builder):
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+                return template
+        template = builder()
+        with self._lock:
+            self._templates[key] = template
+            while len(self._templates) > self._max_templates:
+                self._templates.popitem(last=False)
+        return template
+
+    def _band(self, width):
+        return self._template(("band", width), lambda: Image.new(
+            'RGBA', (width, self.BAND_HEIGHT + 1), (0, 0, 0, 160)))
+
+    def _fire_box(self):
+        return self._template(("fire",), lambda: Image.new(
+            'RGBA', (self.FIRE_BOX[0] + 1, self.FIRE_BOX[1] + 1), (220, 0, 0, 200)))
+
+    def _status_box(self):
+        return self._template(("status",), lambda: Image.new(
+            'RGBA', (self.STATUS_BOX[0] + 1, self.STATUS_BOX[1] + 1), (0, 0, 0, 160)))
+
+    def render(self, image, metrics, user_id, fire_info=None):
+        """Dibuja el overlay sobre image (en el lugar) y la devuelve"""
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        width, height = image.size
+        fonts = self.fonts()
+
+        band = self._band(width)
+        image.paste(band, (0, 0), band)
+        draw = ImageDraw.Draw(image)
+
+        # Contenido del overlay superior
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M")
+        draw.text((15, 10), f"AgroSynchro - Análisis de Campo", fill=(255, 255, 255), font=fonts["title"])
+        draw.text((15, 45), f"📅 {timestamp}", fill=(200, 200, 200), font=fonts["small"])
+        draw.text((15, 75), f"🌱 Vegetación: {metrics['green_coverage']}%", fill=(100, 255, 100), font=fonts["small"])
+
+        # ALERTA DE FUEGO - ESQUINA INFERIOR DERECHA FIJA (si hay fuego)
+        if fire_info and fire_info['fire_detected']:
+            box = self._fire_box()
+            fire_x = width - self.FIRE_BOX[0] - self.MARGIN
+            fire_y = height - self.FIRE_BOX[1] - self.MARGIN
+            image.paste(box, (fire_x, fire_y), box)
+
+            # Texto de alerta
+            draw.text((fire_x + 10, fire_y + 10), "🔥 FUEGO DETECTADO", fill=(255, 255, 255), font=fonts["alert"])
+            draw.text((fire_x + 10, fire_y + 50), f"Cobertura: {fire_info['fire_coverage']}%",
+                      fill=(255, 255, 0), font=fonts["small"])
+        else:
+            # Indicador de estado solo si NO hay fuego - ESQUINA INFERIOR DERECHA
+            box = self._status_box()
+            status_x = width - self.STATUS_BOX[0] - self.MARGIN
+            status_y = height - self.STATUS_BOX[1] - self.MARGIN
+
+            status_color = (100, 255, 100) if metrics['green_coverage'] > 50 else (255, 200, 100) if metrics['green_coverage'] > 30 else (255, 100, 100)
+            status_text = "Excelente" if metrics['green_coverage'] > 50 else "Moderado" if metrics['green_coverage'] > 30 else "Bajo"
+
+            image.paste(box, (status_x, status_y), box)
+            draw.text((status_x + 10, status_y + 15), f"Estado: {status_text}", fill=status_color, font=fonts["small"])
+
+        return image
+
+
+overlay_renderer = OverlayRenderer()
 
 
 def add_info_overlay(image, metrics, user_id, fire_info=None):
     """Agrega overlay de información sobre la imagen - TAMAÑO FIJO Y COMPACTO"""
+    return overlay_renderer.render(image, metrics, user_id, fire_info)
+
+
+class _StageTimer:
+    def __init__(self, stage, timings):
+        self._stage = stage
+        self._timings = timings
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        if self._timings is None:
+            IMAGE_STAGE_SECONDS.observe(elapsed, stage=self._stage)
+        else:
+            self._timings[self._stage] = self._timings.get(self._stage, 0.0) + elapsed
+        return False
+
+
+def image_stage(stage, timings=None):
+    """
+    Mide una etapa del procesamiento de imágenes. Sin timings se observa directo en
+    IMAGE_STAGE_SECONDS; con un dict (proceso hijo del pool) se acumula ahí y el padre
+    lo registra con record_image_stages().
+    """
+    return _StageTimer(stage, timings)
+
+
+def record_image_stages(timings):
+    for stage, seconds in timings.items():
+        IMAGE_STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+def perceptual_hash(image):
+    """dHash de 64 bits (hex): compara el brillo de píxeles vecinos en una versión 9x8 en grises"""
+    pixels = np.asarray(image.convert("L").resize((9, 8), Image.Resampling.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return f"{int(''.join('1' if b else '0' for b in bits), 2):016x}"
+
+
+class BufferReader(RawIOBase):
+    """Archivo de solo lectura sobre bytes/bytearray/memoryview, sin copiar el buffer (BytesIO sí lo copia)"""
+
+    def __init__(self, data):
+        self._view = memoryview(data).cast("B")
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=0):
+        base = {0: 0, 1: self._pos, 2: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+class ImageTooLargeError(ValueError):
+    """
+    La imagen supera IMAGE_MAX_PIXELS, o IMAGE_TILED_MIN_PIXELS en un formato que no se puede
+    decodificar por bandas: se rechaza (no cae en el fallback de devolver el original)
+    """
+
+
+def open_image(image_bytes):
+    """Abre la imagen (solo lee el header) y valida el tamaño contra IMAGE_MAX_PIXELS"""
+    image = Image.open(BufferReader(image_bytes))
+    if image.width * image.height > IMAGE_MAX_PIXELS:
+        raise ImageTooLargeError(f"Image too large: {image.width}x{image.height} > IMAGE_MAX_PIXELS={IMAGE_MAX_PIXELS}")
+    return image
+
+
+def decode_image(image, max_size, analysis_size=None):
+    """
+    Decodifica la imagen (recién abierta con open_image) una sola vez y devuelve
+    (imagen de salida de lado mayor max_size, frame de análisis de lado mayor analysis_size), en RGB.
+    Para JPEG, draft() hace que el decoder escale en el dominio DCT (1/2, 1/4 o 1/8) hasta el
+    mayor de los dos tamaños, sin armar la imagen a resolución completa. De ese frame:
+    - el de análisis se reduce por vecino más cercano: no mezcla colores de píxeles vecinos más
+      allá de lo que ya promedió el decoder al escalar (bloques de 2-8 px según el factor)
+    - la salida se reduce con LANCZOS
+    """
+    analysis_size = analysis_size or max_size
     width, height = image.size
-    
-    # Intentar cargar fuentes con tamaños fijos
-    try:
-        font_title = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 28)
-        font_small = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 20)
-        font_alert = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 32)
-    except:
-        font_title = ImageFont.load_default()
-        font_small = ImageFont.load_default()
-        font_alert = ImageFont.load_default()
-    
-    # OVERLAY SUPERIOR COMPACTO - TAMAÑO FIJO (120px altura)
-    overlay_height = 120
-    overlay = Image.new('RGBA', image.size, (0, 0, 0, 0))
-    overlay_draw = ImageDraw.Draw(overlay)
-    overlay_draw.rectangle([(0, 0), (width, overlay_height)], fill=(0, 0, 0, 160))
-    
-    # Combinar overlay con imagen original
-    image = image.convert('RGBA')
-    image = Image.alpha_composite(image, overlay)
-    image = image.convert('RGB')
-    
-    draw = ImageDraw.Draw(image)
-    
-    # Contenido del overlay superior
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M")
-    draw.text((15, 10), f"AgroSynchro - Análisis de Campo", fill=(255, 255, 255), font=font_title)
-    draw.text((15, 45), f"📅 {timestamp}", fill=(200, 200, 200), font=font_small)
-    draw.text((15, 75), f"🌱 Vegetación: {metrics['green_coverage']}%", fill=(100, 255, 100), font=font_small)
-    
-    # ALERTA DE FUEGO - ESQUINA INFERIOR DERECHA FIJA (si hay fuego)
-    if fire_info and fire_info['fire_detected']:
-        fire_box_width = 350
-        fire_box_height = 80
-        fire_x = width - fire_box_width - 15
-        fire_y = height - fire_box_height - 15
-        
-        # Crear overlay rojo semi-transparente
-        fire_overlay = Image.new('RGBA', image.size, (0, 0, 0, 0))
-        fire_draw = ImageDraw.Draw(fire_overlay)
-        fire_draw.rectangle(
-            [(fire_x, fire_y), (fire_x + fire_box_width, fire_y + fire_box_height)], 
-            fill=(220, 0, 0, 200)
-        )
-        
-        image = image.convert('RGBA')
-        image = Image.alpha_composite(image, fire_overlay)
+    scale = max(max_size, analysis_size) / max(width, height)
+    if scale < 1:
+        # draft elige la mayor reducción que deja la imagen >= al tamaño pedido
+        image.draft('RGB', (max(1, int(width * scale)), max(1, int(height * scale))))
+
+    # Convertir a RGB si es necesario
+    if image.mode != 'RGB':
         image = image.convert('RGB')
-        
-        # Texto de alerta
-        fire_draw_final = ImageDraw.Draw(image)
-        fire_draw_final.text((fire_x + 10, fire_y + 10), "🔥 FUEGO DETECTADO", fill=(255, 255, 255), font=font_alert)
-        fire_draw_final.text((fire_x + 10, fire_y + 50), f"Cobertura: {fire_info['fire_coverage']}%", fill=(255, 255, 0), font=font_small)
+    return (_reduce_to(image, max_size, Image.Resampling.LANCZOS),
+            _reduce_to(image, analysis_size, Image.Resampling.NEAREST))
+
+
+def _reduce_to(image, max_size, resample):
+    """Copia reducida a lado mayor max_size (la misma imagen si ya entra)"""
+    if max(image.size) <= max_size:
+        return image
+    scale = max_size / max(image.size)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    # reducing_gap reduce antes por promedio de bloques: solo para LANCZOS, no para el análisis
+    reducing_gap = None if resample == Image.Resampling.NEAREST else 2.0
+    return image.resize(size, resample, reducing_gap=reducing_gap)
+
+
+# ---------------------
+# Tiled processing (ortomosaicos)
+# ---------------------
+def _raw_band_reader(image_bytes, image):
+    """
+    Para formatos sin compresión (TIFF raw, BMP, PPM) devuelve read(top, bottom) que decodifica
+    solo esas filas directo del buffer, sin armar la imagen completa. None si el formato no
+    permite leer por filas (PNG, TIFF comprimido por libtiff, etc.).
+    """
+    width, height = image.size
+    entries = []
+    for codec, extents, offset, args in image.tile:
+        if codec != "raw" or extents[0] != 0 or extents[2] != width:
+            return None
+        rawmode, stride, ystep = args if isinstance(args, tuple) else (args, 0, 1)
+        if ystep not in (1, -1) or (ystep == -1 and len(image.tile) > 1):
+            return None
+        if stride == 0:
+            try:
+                stride = len(Image.new(image.mode, (width, 1)).tobytes("raw", rawmode))
+            except Exception:
+                return None
+        entries.append((extents[1], extents[3], offset, rawmode, stride, ystep))
+    if not entries:
+        return None
+    buffer = memoryview(image_bytes)
+
+    def read(top, bottom):
+        band = Image.new(image.mode, (width, bottom - top))
+        for y0, y1, offset, rawmode, stride, ystep in entries:
+            start, end = max(top, y0), min(bottom, y1)
+            if start >= end:
+                continue
+            # Bottom-up (BMP): la fila y está guardada en la posición (y1 - 1 - y)
+            first = start - y0 if ystep == 1 else y1 - end
+            data = buffer[offset + first * stride:offset + (first + end - start) * stride]
+            piece = Image.frombuffer(image.mode, (width, end - start), data, "raw", rawmode, stride, ystep)
+            band.paste(piece, (0, start - top))
+        return band.convert('RGB') if band.mode != 'RGB' else band
+
+    return read
+
+
+# Tags del IFD original que se copian al TIFF de cada banda, con su tipo TIFF (3 SHORT, 7 UNDEFINED):
+# BitsPerSample, Compression, Photometric, SamplesPerPixel, PlanarConfiguration, Predictor,
+# ColorMap, ExtraSamples, SampleFormat, JPEGTables, YCbCrSubSampling
+TIFF_BAND_TAGS = {258: 3, 259: 3, 262: 3, 277: 3, 284: 3, 317: 3, 320: 3, 338: 3, 339: 3, 347: 7, 530: 3}
+TIFF_TYPE_FORMATS = {3: "H", 4: "L", 7: "B"}
+
+
+def _tiff_values(value):
+    """Valor de tag_v2 como tupla de enteros (los tags de un solo valor vienen sueltos)"""
+    if isinstance(value, bytes):
+        return tuple(value)
+    return value if isinstance(value, tuple) else (value,)
+
+
+def _tiff_bytes(tags, chunks, offsets_tag, counts_tag):
+    """
+    Arma un TIFF little-endian mínimo con tags {tag: (tipo, valores)} y los chunks comprimidos
+    (strips o tiles) tal cual vienen del archivo original; offsets_tag/counts_tag se completan acá.
+    """
+    def pack(typ, values):
+        return struct.pack(f"<{len(values)}{TIFF_TYPE_FORMATS[typ]}", *values)
+
+    tags = {**tags, offsets_tag: (4, (0,) * len(chunks)), counts_tag: (4, tuple(len(chunk) for chunk in chunks))}
+    # header (8) + IFD (cantidad, 12 bytes por tag, offset del siguiente IFD) + valores que no entran
+    # en 4 bytes (alineados a 2) + chunks
+    aux_start = 8 + 2 + 12 * len(tags) + 4
+    position = aux_start + sum((len(pack(*tag)) + 1) // 2 * 2 for tag in tags.values() if len(pack(*tag)) > 4)
+    offsets = []
+    for chunk in chunks:
+        offsets.append(position)
+        position += len(chunk)
+    tags[offsets_tag] = (4, tuple(offsets))
+
+    entries, aux = [struct.pack("<H", len(tags))], []
+    position = aux_start
+    for tag in sorted(tags):
+        typ, values = tags[tag]
+        data = pack(typ, values)
+        if len(data) <= 4:
+            entries.append(struct.pack("<HHL", tag, typ, len(values)) + data.ljust(4, b"\0"))
+        else:
+            entries.append(struct.pack("<HHLL", tag, typ, len(values), position))
+            data += b"\0" * (len(data) % 2)
+            aux.append(data)
+            position += len(data)
+    entries.append(b"\0\0\0\0")
+    return b"".join([b"II*\0", struct.pack("<L", 8), *entries, *aux, *chunks])
+
+
+def _tiff_band_reader(image_bytes, image):
+    """
+    Para TIFF comprimidos (LZW, Deflate, PackBits, JPEG) por strips o tiles devuelve read(top, bottom)
+    que decodifica solo los strips/tiles que cubren esas filas: arma un TIFF chico con los tags del
+    original y esos chunks comprimidos (PIL/libtiff decodifica siempre el archivo entero). None si
+    no es un TIFF que se pueda leer por partes (planar, una sola strip con toda la imagen, etc.).
+    """
+    if image.format != "TIFF":
+        return None
+    tags = image.tag_v2
+    width, height = image.size
+    if tags.get(284, 1) != 1:
+        return None
+    if 322 in tags:
+        chunk_width, chunk_height = tags[322], tags[323]
+        offsets, counts = tags.get(324, ()), tags.get(325, ())
+        layout = {322: (4, (chunk_width,)), 323: (4, (chunk_height,))}
+        offsets_tag, counts_tag = 324, 325
     else:
-        # Indicador de estado solo si NO hay fuego - ESQUINA INFERIOR DERECHA
-        status_box_width = 200
-        status_box_height = 50
-        status_x = width - status_box_width - 15
-        status_y = height - status_box_height - 15
-        
-        status_color = (100, 255, 100) if metrics['green_coverage'] > 50 else (255, 200, 100) if metrics['green_coverage'] > 30 else (255, 100, 100)
-        status_text = "Excelente" if metrics['green_coverage'] > 50 else "Moderado" if metrics['green_coverage'] > 30 else "Bajo"
-        
-        status_overlay = Image.new('RGBA', image.size, (0, 0, 0, 0))
-        status_draw = ImageDraw.Draw(status_overlay)
-        status_draw.rectangle(
-            [(status_x, status_y), (status_x + status_box_width, status_y + status_box_height)], 
-            fill=(0, 0, 0, 160)
-        )
-        
-        image = image.convert('RGBA')
-        image = Image.alpha_composite(image, status_overlay)
+        chunk_width, chunk_height = width, min(tags.get(278, height), height)
+        offsets, counts = tags.get(273, ()), tags.get(279, ())
+        layout = {278: (4, (chunk_height,))}
+        offsets_tag, counts_tag = 273, 279
+    per_row = -(-width // chunk_width)
+    # Cada lectura decodifica filas enteras de chunks: tienen que ser del orden de una banda
+    if chunk_height * per_row * chunk_width > IMAGE_TILE_SIZE * IMAGE_TILE_SIZE:
+        return None
+    if len(offsets) != per_row * -(-height // chunk_height) or len(counts) != len(offsets):
+        return None
+    base = {256: (4, (width,)), **layout}
+    base.update((tag, (typ, _tiff_values(tags[tag]))) for tag, typ in TIFF_BAND_TAGS.items() if tag in tags)
+    buffer = memoryview(image_bytes)
+
+    def read(top, bottom):
+        first, last = top // chunk_height, -(-bottom // chunk_height)
+        chunks = [buffer[offset:offset + count]
+                  for offset, count in zip(offsets[first * per_row:last * per_row], counts[first * per_row:last * per_row])]
+        rows = min(last * chunk_height, height) - first * chunk_height
+        band = Image.open(BytesIO(_tiff_bytes({**base, 257: (4, (rows,))}, chunks, offsets_tag, counts_tag)))
+        skip = top - first * chunk_height
+        band = band.crop((0, skip, width, skip + bottom - top))
+        return band.convert('RGB') if band.mode != 'RGB' else band
+
+    return read
+
+
+def _decoded_band_reader(image, max_size):
+    """
+    JPEG: decodifica una sola vez con draft() al tamaño de salida (hasta 1/8 por lado, 1/64 de la
+    memoria) y recorta bandas. Devuelve (read, tamaño de la imagen decodificada).
+    """
+    width, height = image.size
+    scale = min(1.0, max_size / max(width, height))
+    image.draft('RGB', (max(1, int(width * scale)), max(1, int(height * scale))))
+    if image.mode != 'RGB':
         image = image.convert('RGB')
-        
-        status_draw_final = ImageDraw.Draw(image)
-        status_draw_final.text((status_x + 10, status_y + 15), f"Estado: {status_text}", fill=status_color, font=font_small)
-    
-    return image
+    image.load()
 
+    def read(top, bottom):
+        return image.crop((0, top, image.width, bottom))
 
-def simple_image_process(image_bytes):
+    return read, image.size
+
+
+def process_tiled(image_bytes, image, max_size):
+    """
+    Procesa una imagen enorme por bandas horizontales de ~IMAGE_TILE_SIZE² píxeles:
+    - cada banda se decodifica sola (formatos raw, TIFF por strips/tiles) o se recorta de la imagen
+      reducida (JPEG); el resto de los formatos se rechaza (ImageTooLargeError)
+    - fuego/vegetación se acumulan en AnalysisTotals a la resolución de la banda
+    - cada banda se reduce (box, factor entero) y se pega en la preview de salida
+    La memoria pico es ~IMAGE_TILE_WORKERS bandas + la preview, sin importar el tamaño de la imagen.
+    Devuelve (preview RGB de lado mayor <= max_size, AnalysisTotals).
+    """
+    width, height = image.size
+    read = _raw_band_reader(image_bytes, image) or _tiff_band_reader(image_bytes, image)
+    if read is not None:
+        source_width, source_height = width, height
+    elif image.format in ("JPEG", "MPO"):
+        read, (source_width, source_height) = _decoded_band_reader(image, max_size)
+    else:
+        # PNG, TIFF de una sola strip, etc.: solo se pueden decodificar completos
+        raise ImageTooLargeError(f"{image.format} image {width}x{height} cannot be decoded by bands "
+                                 f"(> IMAGE_TILED_MIN_PIXELS={IMAGE_TILED_MIN_PIXELS})")
+
+    # Factor entero de reducción de la fuente a la preview (queda >= max_size, el thumbnail
+    # final ajusta) y filas por banda (múltiplo del factor, para que las bandas no dejen costuras)
+    factor = max(1, max(source_width, source_height) // max_size)
+    rows = max(factor, (IMAGE_TILE_SIZE * IMAGE_TILE_SIZE // source_width) // factor * factor)
+    preview = Image.new('RGB', (-(-source_width // factor), -(-source_height // factor)))
+
+    def process_band(top):
+        band = read(top, min(top + rows, source_height))
+        _, _, totals = analyze_pixels(np.asarray(band))
+        reduced = band.reduce(factor) if factor > 1 else band
+        return top, reduced, totals
+
+    totals = AnalysisTotals()
+    bands = range(0, source_height, rows)
+    if IMAGE_TILE_WORKERS > 1:
+        with ThreadPoolExecutor(max_workers=IMAGE_TILE_WORKERS, thread_name_prefix="image-tile") as executor:
+            results = executor.map(process_band, bands)
+            for top, reduced, band_totals in results:
+                preview.paste(reduced, (0, top // factor))
+                totals.add(band_totals)
+    else:
+        for top in bands:
+            top, reduced, band_totals = process_band(top)
+            preview.paste(reduced, (0, top // factor))
+            totals.add(band_totals)
+
+    if max(preview.size) > max_size:
+        preview.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    logger.info(f"🧩 Tiled processing: {width}x{height} in {len(bands)} bands of {rows} rows → {preview.size}")
+    return preview, totals
+
+
+# (nombre, lado mayor, formato, opciones de save, content type, extensión); None = tamaño de salida.
+# Cada rendition se reduce desde la anterior; optimize solo en el JPEG completo (en las chicas
+# cuesta una pasada extra de Huffman para ahorrar muy pocos bytes)
+IMAGE_RENDITIONS = [
+    ("full", None, "JPEG", {"quality": IMAGE_JPEG_QUALITY, "optimize": True}, "image/jpeg", None),
+    ("preview", IMAGE_PREVIEW_MAX_SIZE, "WEBP", {"quality": IMAGE_PREVIEW_QUALITY, "method": 4}, "image/webp", ".webp"),
+    ("thumbnail", IMAGE_THUMBNAIL_MAX_SIZE, "JPEG", {"quality": IMAGE_THUMBNAIL_QUALITY}, "image/jpeg", ".jpg"),
+]
+RENDITION_CONTENT_TYPES = {name: content_type for name, _, _, _, content_type, _ in IMAGE_RENDITIONS}
+
+
+def rendition_key(s3_key, name):
+    """processed/<key> para la imagen completa; processed/<name>/<key sin extensión>.<ext> para el resto"""
+    if name == "full":
+        return f"processed/{s3_key}"
+    extension = next(ext for rendition, _, _, _, _, ext in IMAGE_RENDITIONS if rendition == name)
+    return f"processed/{name}/{os.path.splitext(s3_key)[0]}{extension}"
+
+
+def encode_renditions(image, timings=None):
+    """Codifica todas las renditions a partir de la misma imagen procesada: {nombre: bytes}"""
+    renditions = {}
+    for name, max_size, image_format, options, _, _ in IMAGE_RENDITIONS:
+        with image_stage(f"encode_{name}", timings):
+            if max_size is not None and max(image.size) > max_size:
+                scale = max_size / max(image.size)
+                image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                                     Image.Resampling.LANCZOS, reducing_gap=2.0)
+            output = BytesIO()
+            image.save(output, format=image_format, **options)
+            renditions[name] = output.getvalue()
+    return renditions
+
+
+def simple_image_process(image_bytes, timings=None):
     """
     Procesamiento de imagen agrícola con análisis visual
     - Detección de FUEGO 🔥
     - Mejora de contraste
     - Mapa de calor de vegetación
     - Overlay de información
+    timings: dict opcional donde acumular la duración de cada etapa (ver image_stage)
     """
     try:
-        # Abrir imagen desde bytes
-        image = Image.open(BytesIO(image_bytes))
-        
-        # Convertir a RGB si es necesario
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
+        # Abrir imagen desde bytes, ya al tamaño de salida: todo lo que sigue trabaja
+        # sobre la imagen chica (antes se procesaba a resolución completa y se reducía al final)
+        with image_stage("decode", timings):
+            image = open_image(image_bytes)
+            tiled = image.width * image.height > IMAGE_TILED_MIN_PIXELS
+            if not tiled:
+                image, analysis_frame = decode_image(image, IMAGE_OUTPUT_MAX_SIZE, IMAGE_ANALYSIS_MAX_SIZE)
         
-        # 1. DETECTAR FUEGO PRIMERO (crítico)
-        fire_info = detect_fire(image)
-        if fire_info['fire_detected']:
-            logger.warning(f"🔥🔥🔥 FIRE ALERT! Coverage: {fire_info['fire_coverage']}% 🔥🔥🔥")
-        
-        # 2. Calcular métricas de vegetación
-        metrics = calculate_vegetation_metrics(image)
+        # 1-2. Detectar FUEGO (crítico) y calcular métricas de vegetación en una sola pasada
+        if tiled:
+            # Ortomosaico: estadísticas acumuladas banda por banda sobre la imagen completa,
+            # máscaras del heatmap calculadas sobre la preview
+            with image_stage("tiled", timings):
+                image, totals = process_tiled(image_bytes, image, IMAGE_OUTPUT_MAX_SIZE)
+            with image_stage("analysis", timings):
+                fire_mask, green_mask, _ = analyze_pixels(np.asarray(image))
+                analysis = ImageAnalysis.from_totals(fire_mask, green_mask, totals)
+        else:
+            # Estadísticas a IMAGE_ANALYSIS_MAX_SIZE; las máscaras se llevan al tamaño de salida
+            # (vecino más cercano) para el heatmap
+            with image_stage("analysis", timings):
+                analysis = analyze_image(analysis_frame)
+                if analysis_frame.size != image.size:
+                    analysis = analysis.scaled_to(image.size)
+                del analysis_frame
+        with image_stage("fire_clusters", timings):
+            detect_fire_clusters(analysis)
+        fire_info = analysis.fire_info()
+        if IMAGE_PERCEPTUAL_HASH:
+            fire_info['perceptual_hash'] = perceptual_hash(image)
+        metrics = analysis.metrics()
+        if analysis.fire_detected:
+            logger.warning(f"🔥🔥🔥 FIRE ALERT! Coverage: {analysis.fire_coverage}% in {len(analysis.fire_clusters)} clusters 🔥🔥🔥")
         logger.info(f"📊 Image metrics: {metrics}")
         
-        # 3. Mejorar contraste (hace la imagen más "clara")
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(1.3)  # 30% más contraste
-        
-        # 4. Mejorar saturación (hace los colores más vivos)
-        enhancer = ImageEnhance.Color(image)
-        image = enhancer.enhance(1.2)  # 20% más saturación
+        with image_stage("enhance", timings):
+            # 3. Mejorar contraste (hace la imagen más "clara")
+            enhancer = ImageEnhance.Contrast(image)
+            image = enhancer.enhance(1.3)  # 30% más contraste
+
+            # 4. Mejorar saturación (hace los colores más vivos)
+            enhancer = ImageEnhance.Color(image)
+            image = enhancer.enhance(1.2)  # 20% más saturación
         
         # 5. Crear mapa de calor (vegetación + FUEGO)
-        image = create_vegetation_heatmap(image, fire_info)
+        with image_stage("heatmap", timings):
+            image = create_vegetation_heatmap(image, analysis)
+        del analysis
         
         # 6. Agregar overlay de información (incluye alerta de fuego)
-        image = add_info_overlay(image, metrics, "user", fire_info)
-        
-        # 7. Resize a tamaño óptimo (si la imagen es muy grande)
-        max_size = 1920  # Full HD
-        if max(image.size) > max_size:
-            image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        with image_stage("overlay", timings):
+            image = add_info_overlay(image, metrics, "user", fire_info)
         
-        # Convertir de vuelta a bytes
-        output = BytesIO()
-        image.save(output, format='JPEG', quality=85, optimize=True)
-        processed_bytes = output.getvalue()
+        # Convertir de vuelta a bytes: completa, preview y thumbnail desde la misma imagen
+        renditions = encode_renditions(image, timings)
         
-        logger.info(f"✅ Image processed: {len(image_bytes)} bytes → {len(processed_bytes)} bytes")
-        
-        # Devolver bytes procesados + info de fuego para alertas
-        return processed_bytes, fire_info
+        logger.info(f"✅ Image processed: {len(image_bytes)} bytes → "
+                    + ", ".join(f"{name} {len(data)} bytes" for name, data in renditions.items()))
         
+        # Devolver renditions + info de fuego para alertas
+        return renditions, fire_info
+
+    except (ImageTooLargeError, Image.DecompressionBombError):
+        # Rechazo: la imagen falla en el pipeline en vez de subir el original (posiblemente GBs)
+        raise
     except Exception as e:
         logger.error(f"❌ Error processing image: {e}")
         # Si falla el procesamiento, devolver original sin info de fuego
-        return image_bytes, {'fire_detected': False, 'fire_coverage': 0.0}
+        return {"full": bytes(image_bytes)}, {'fire_detected': False, 'fire_coverage': 0.0, 'fire_clusters': []}
 
-def analyze_field_condition(image_bytes):
-    """Simula análisis de condición del campo basado en imagen"""
+def analyze_field_condition(image_size):
+    """Simula análisis de condición del campo basado en el tamaño de la imagen (bytes)"""
     import random
     from datetime import datetime
     
-    # Simulación simple basada en "tamaño" de imagen
-    image_size = len(image_bytes)
-    
     # Lógica simulada de análisis
     conditions = ['excellent', 'good', 'fair', 'poor', 'critical']
     weights = [0.3, 0.35, 0.2, 0.1, 0.05]  # Más probable que sea bueno
@@ -870,122 +2886,925 @@ def analyze_field_condition(image_bytes):
     return field_status, confidence
 
 
-def save_to_db(user_id, raw_key, processed_key, field_status=None, confidence=None):
-    """Guarda metadatos en RDS"""
+@dataclass
+class ImageRecord:
+    """Fila de drone_images de una imagen procesada, lista para el writer de la BD"""
+    raw_key: str
+    user_id: str
+    processed_key: str
+    field_status: str
+    confidence: float
+    fire_detected: bool = False
+    fire_clusters: list = field(default_factory=list)
+    preview_key: str = None
+    thumbnail_key: str = None
+    content_sha256: str = None
+    phash: str = None
+
+    def values(self):
+        return (self.raw_key, self.user_id, self.processed_key, self.field_status or 'unknown',
+                self.confidence or 0.0, json.dumps(self.fire_clusters or []), self.preview_key,
+                self.thumbnail_key, self.content_sha256, self.phash, ENGINE_INSTANCE_ID)
+
+
+def save_to_db(records):
+    """
+    Guarda metadatos en RDS: completa las filas reservadas por claim_images y las pasa a 'done',
+    todas en una sola sentencia y transacción. Si el lease de alguna venció y la retomó otra
+    task, no se pisa su trabajo. Devuelve el set de raw keys guardadas; los errores de BD se
+    propagan (fallan todas las filas del lote).
+    """
+    with IMAGE_STAGE_SECONDS.time(stage="db"), db_connection() as conn:
+        cursor = conn.cursor()
+        rows = execute_values(cursor, """
+            UPDATE drone_images AS d
+            SET user_id = v.user_id, processed_s3_key = v.processed_s3_key, field_status = v.field_status,
+                analysis_confidence = v.analysis_confidence,
+                analyzed_at = CURRENT_TIMESTAMP, processed_at = CURRENT_TIMESTAMP,
+                fire_clusters = v.fire_clusters, preview_s3_key = v.preview_s3_key,
+                thumbnail_s3_key = v.thumbnail_s3_key,
+                content_sha256 = v.content_sha256, perceptual_hash = v.perceptual_hash,
+                status = 'done', lease_owner = NULL, lease_expires_at = NULL
+            FROM (VALUES %s) AS v(raw_s3_key, user_id, processed_s3_key, field_status, analysis_confidence,
+                                  fire_clusters, preview_s3_key, thumbnail_s3_key, content_sha256,
+                                  perceptual_hash, lease_owner)
+            WHERE d.raw_s3_key = v.raw_s3_key AND d.status = 'processing' AND d.lease_owner = v.lease_owner
+            RETURNING d.raw_s3_key
+        """, [record.values() for record in records],
+            template="(%s, %s, %s, %s, %s::real, %s::jsonb, %s, %s, %s, %s, %s)",
+            page_size=len(records), fetch=True)
+        conn.commit()
+
+    saved = {row[0] for row in rows}
+    for record in records:
+        if record.raw_key not in saved:
+            logger.warning(f"Lease lost for {record.raw_key}: result discarded")
+            continue
+        processed_image_keys.add(record.raw_key)
+        IMAGES_PROCESSED.inc(result="fire" if record.fire_detected else "ok")
+        logger.info(f"✅ Processed image: {record.raw_key} - Status: {record.field_status} ({record.confidence:.2f})")
+    logger.info(f"💾 Saved to DB: {len(saved)}/{len(records)} images")
+    return saved
+
+
+def find_processed_duplicate(content_sha256):
+    """Id de una imagen ya procesada con el mismo contenido, o None"""
+    if not IMAGE_DEDUP or not content_sha256:
+        return None
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST, port=DB_PORT, user=DB_USER, 
-            password=DB_PASS, dbname=DB_NAME
-        )
+        with IMAGE_STAGE_SECONDS.time(stage="dedup_lookup"), db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id FROM drone_images
+                WHERE content_sha256 = %s AND status = 'done' AND processed_s3_key IS NOT NULL
+                ORDER BY id LIMIT 1
+            """, (content_sha256,))
+            row = cursor.fetchone()
+        return row[0] if row else None
+    except Exception as e:
+        logger.error(f"Error looking up duplicate image: {e}")
+        return None
+
+
+def save_duplicate(s3_key, content_sha256, original_id):
+    """
+    Registra s3_key reutilizando el análisis y las imágenes procesadas (mismas keys en S3)
+    de la imagen original con el mismo contenido, sin volver a procesarla
+    """
+    with IMAGE_STAGE_SECONDS.time(stage="db"):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE drone_images AS d
+                SET processed_s3_key = o.processed_s3_key, field_status = o.field_status,
+                    analysis_confidence = o.analysis_confidence, analyzed_at = o.analyzed_at,
+                    processed_at = CURRENT_TIMESTAMP, fire_clusters = o.fire_clusters,
+                    preview_s3_key = o.preview_s3_key, thumbnail_s3_key = o.thumbnail_s3_key,
+                    content_sha256 = %s, perceptual_hash = o.perceptual_hash,
+                    status = 'done', lease_owner = NULL, lease_expires_at = NULL
+                FROM drone_images AS o
+                WHERE o.id = %s AND d.raw_s3_key = %s AND d.status = 'processing' AND d.lease_owner = %s
+            """, (content_sha256, original_id, s3_key, ENGINE_INSTANCE_ID))
+            updated = cursor.rowcount
+            conn.commit()
+    if not updated:
+        logger.warning(f"Lease lost for {s3_key}: duplicate not recorded")
+        return
+    processed_image_keys.add(s3_key)
+    IMAGES_PROCESSED.inc(result="duplicate")
+    logger.info(f"♻️ Duplicate image {s3_key}: reusing analysis of drone_images.id={original_id}")
+
+
+def claim_images(s3_keys):
+    """
+    Reserva keys para esta task: inserta su fila en estado 'processing' con un lease, o retoma
+    una cuyo lease venció. Cada reserva cuenta un intento (attempts). Devuelve las keys
+    reservadas; el resto ya está procesado, falló definitivamente o lo tiene otra task. Es una
+    sola sentencia atómica, así que dos tasks nunca reservan la misma key.
+    """
+    if not s3_keys:
+        return []
+    with db_connection() as conn:
         cursor = conn.cursor()
-        
-        # Crear tabla si no existe (por seguridad) - versión actualizada
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS drone_images (
-                id SERIAL PRIMARY KEY,
-                user_id VARCHAR(255),
-                raw_s3_key VARCHAR(500),
-                processed_s3_key VARCHAR(500),
-                field_status VARCHAR(50) DEFAULT 'unknown',
-                analysis_confidence REAL DEFAULT 0.0,
-                processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                analyzed_at TIMESTAMP
-            )
-        """)
-        
-        # Insertar registro con análisis
         cursor.execute("""
-            INSERT INTO drone_images (user_id, raw_s3_key, processed_s3_key, field_status, analysis_confidence, analyzed_at) 
-            VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-        """, (user_id, raw_key, processed_key, field_status or 'unknown', confidence or 0.0))
-
+            INSERT INTO drone_images (user_id, raw_s3_key, status, lease_owner, lease_expires_at, attempts)
+            SELECT claims.user_id, claims.raw_s3_key, 'processing', %s, NOW() + make_interval(secs => %s), 1
+            FROM unnest(%s::varchar[], %s::varchar[]) AS claims(raw_s3_key, user_id)
+            ON CONFLICT (raw_s3_key) DO UPDATE
+                SET lease_owner = EXCLUDED.lease_owner, lease_expires_at = EXCLUDED.lease_expires_at,
+                    attempts = drone_images.attempts + 1
+                WHERE drone_images.status = 'processing' AND drone_images.lease_expires_at < NOW()
+            RETURNING raw_s3_key
+        """, (ENGINE_INSTANCE_ID, IMAGE_LEASE_SECONDS, list(s3_keys),
+              [extract_user_id_from_key(s3_key) for s3_key in s3_keys]))
+        claimed = {row[0] for row in cursor.fetchall()}
         conn.commit()
-        conn.close()
-        logger.info(f"💾 Saved to DB: {user_id} - Status: {field_status} ({confidence:.2f})")
+    return [s3_key for s3_key in s3_keys if s3_key in claimed]
+
+
+def release_image_claims(s3_keys):
+    """
+    Libera keys que fallaron: el lease vence tras un backoff exponencial según los intentos
+    (cualquier task las reintenta después), o pasan a status 'failed' si ya usaron
+    IMAGE_MAX_ATTEMPTS. Para reintentar una fallida a mano: status = 'processing', attempts = 0,
+    lease_expires_at = NOW().
+    """
+    if not s3_keys:
+        return
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE drone_images
+                SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE status END,
+                    lease_owner = CASE WHEN attempts >= %s THEN NULL ELSE lease_owner END,
+                    lease_expires_at = CASE WHEN attempts >= %s THEN NULL
+                        ELSE NOW() + make_interval(secs => LEAST(%s * power(2, attempts - 1), %s)) END
+                WHERE raw_s3_key = ANY(%s) AND status = 'processing' AND lease_owner = %s
+                RETURNING raw_s3_key, status
+            """, (IMAGE_MAX_ATTEMPTS, IMAGE_MAX_ATTEMPTS, IMAGE_MAX_ATTEMPTS,
+                  IMAGE_RETRY_BASE_DELAY, IMAGE_RETRY_MAX_DELAY, list(s3_keys), ENGINE_INSTANCE_ID))
+            given_up = [s3_key for s3_key, status in cursor.fetchall() if status == 'failed']
+            conn.commit()
+        for s3_key in given_up:
+            IMAGES_PROCESSED.inc(result="failed")
+            logger.error(f"❌ Giving up on {s3_key} after {IMAGE_MAX_ATTEMPTS} attempts (status 'failed')")
     except Exception as e:
-        logger.error(f"Error saving to DB: {e}")
+        logger.error(f"Error releasing image claims (they expire in {IMAGE_LEASE_SECONDS}s): {e}")
+
+
+def expired_image_claims(limit=1000):
+    """Keys reservadas cuyo lease venció (task caída o backoff de una imagen fallida cumplido), para reintentarlas"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT raw_s3_key FROM drone_images
+            WHERE status = 'processing' AND lease_expires_at < NOW()
+            ORDER BY lease_expires_at
+            LIMIT %s
+        """, (limit,))
+        return [row[0] for row in cursor.fetchall()]
+
+
+def read_body_into(body, view):
+    """Lee el body de S3 directo en view, sin armar un bytes intermedio con todo el objeto"""
+    filled = 0
+    readinto = getattr(body, "readinto", None)
+    while filled < len(view):
+        if readinto is not None:
+            n = readinto(view[filled:])
+        else:
+            chunk = body.read(min(len(view) - filled, 1024 * 1024))
+            n = len(chunk)
+            view[filled:filled + n] = chunk
+        if not n:
+            raise IOError(f"S3 body ended after {filled} of {len(view)} bytes")
+        filled += n
+
 
-def process_image_from_s3(s3_key):
-    """Descarga, procesa y guarda imagen con detección de fuego"""
+def download_image(s3_key, get_buffer):
+    """
+    Descarga la imagen original del bucket raw directo a un buffer pedido con get_buffer(tamaño).
+    Devuelve (memoryview, sha256, id del duplicado o None); la memoryview es válida hasta que
+    se devuelva el buffer. Si el objeto trae el sha256 en la metadata (lo agregan los lambdas
+    de upload) y ya hay una imagen procesada con ese contenido, no se descarga el body y la
+    memoryview es None.
+    """
     try:
-        # Extraer user_id del s3_key
-        user_id = extract_user_id_from_key(s3_key)
-        
-        # Descargar imagen
-        response = s3_client.get_object(Bucket=RAW_IMAGES_BUCKET, Key=s3_key)
-        image_data = response['Body'].read()
-        
-        # Procesar imagen (INCLUYE DETECCIÓN DE FUEGO)
-        processed_data, fire_info = simple_image_process(image_data)
-        
-        # Analizar condición del campo
-        field_status, confidence = analyze_field_condition(image_data)
-        
-        # Si se detectó fuego, cambiar el field_status
-        if fire_info['fire_detected']:
-            field_status = 'FIRE_DETECTED'
-            confidence = fire_info['fire_coverage'] / 100.0
-            logger.warning(f"🔥 Fire detected in image {s3_key}: {fire_info['fire_coverage']}%")
-        
-        # Subir imagen procesada
-        processed_key = f"processed/{s3_key}"
-        s3_client.put_object(
-            Bucket=PROCESSED_IMAGES_BUCKET,
-            Key=processed_key,
-            Body=processed_data,
-            ContentType='image/jpeg'
-        )
-        
-        # Guardar en RDS con análisis
-        save_to_db(user_id, s3_key, processed_key, field_status, confidence)
-        
-        logger.info(f"✅ Processed image: {s3_key} - Status: {field_status}")
-        
+        with S3_SECONDS.time(operation="get_object"):
+            response = s3_client.get_object(Bucket=RAW_IMAGES_BUCKET, Key=s3_key)
+    except Exception:
+        S3_ERRORS.inc(operation="get_object")
+        raise
+
+    # La consulta a la BD queda fuera de los timers de S3 (se mide como etapa "dedup_lookup")
+    declared = response.get('Metadata', {}).get('sha256')
+    duplicate_id = find_processed_duplicate(declared)
+    if duplicate_id is not None:
+        response['Body'].close()
+        return None, declared, duplicate_id
+    size = response['ContentLength']
+    image_data = get_buffer(size)[:size]
+    try:
+        with S3_SECONDS.time(operation="get_object_body"):
+            read_body_into(response['Body'], image_data)
+    except Exception:
+        S3_ERRORS.inc(operation="get_object_body")
+        raise
+
+    # Hash calculado en la primera lectura (imágenes subidas sin metadata, o metadata incorrecta)
+    content_sha256 = hashlib.sha256(image_data).hexdigest()
+    if content_sha256 != declared:
+        duplicate_id = find_processed_duplicate(content_sha256)
+    return image_data, content_sha256, duplicate_id
+
+
+def upload_image(s3_key, image_size, renditions, fire_info, content_sha256=None):
+    """Análisis de campo y subida de la imagen procesada; devuelve la fila para el writer de la BD"""
+    # Extraer user_id del s3_key
+    user_id = extract_user_id_from_key(s3_key)
+
+    # Analizar condición del campo
+    with IMAGE_STAGE_SECONDS.time(stage="field_analysis"):
+        field_status, confidence = analyze_field_condition(image_size)
+
+    # Si se detectó fuego, cambiar el field_status
+    if fire_info['fire_detected']:
+        field_status = 'FIRE_DETECTED'
+        confidence = fire_info['fire_coverage'] / 100.0
+        logger.warning(f"🔥 Fire detected in image {s3_key}: {fire_info['fire_coverage']}%")
+
+    # Subir imagen procesada y sus renditions
+    keys = {}
+    for name, data in renditions.items():
+        keys[name] = rendition_key(s3_key, name)
+        try:
+            with S3_SECONDS.time(operation="put_object"):
+                s3_client.put_object(
+                    Bucket=PROCESSED_IMAGES_BUCKET,
+                    Key=keys[name],
+                    Body=data,
+                    ContentType=RENDITION_CONTENT_TYPES[name]
+                )
+        except Exception:
+            S3_ERRORS.inc(operation="put_object")
+            raise
+
+    return ImageRecord(s3_key, user_id, keys["full"], field_status, confidence, fire_info['fire_detected'],
+                       fire_info.get('fire_clusters'), keys.get("preview"), keys.get("thumbnail"),
+                       content_sha256, fire_info.get('perceptual_hash'))
+
+
+# ---------------------
+# Image process pool
+# ---------------------
+image_executor = None
+image_executor_lock = threading.Lock()
+
+
+def get_image_executor():
+    """
+    Pool de procesos para el trabajo de CPU de las imágenes. Usa 'spawn' para que los hijos
+    no hereden por fork los threads, locks ni conexiones (BD, SMTP, boto3) del proceso principal.
+    """
+    global image_executor
+    with image_executor_lock:
+        if image_executor is None:
+            image_executor = ProcessPoolExecutor(
+                max_workers=IMAGE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            logger.info(f"Image process pool started with {IMAGE_WORKERS} workers")
+        return image_executor
+
+
+def reset_image_executor():
+    """Descarta un pool roto (p.ej. un hijo murió por OOM) para que el próximo uso cree otro"""
+    global image_executor
+    with image_executor_lock:
+        if image_executor is not None:
+            image_executor.shutdown(wait=False, cancel_futures=True)
+            image_executor = None
+
+
+class SharedImageBuffers:
+    """
+    Segmentos de memoria compartida reutilizables donde la etapa de descarga lee el body de S3
+    y la de CPU decodifica (en el thread de CPU o en un hijo del pool, sin serializar la imagen
+    por el pipe). Se conservan a lo sumo IMAGE_MAX_IN_FLIGHT segmentos libres.
+    """
+
+    def __init__(self):
+        self._free = []
+        self._lock = threading.Lock()
+
+    def acquire(self, size):
+        with self._lock:
+            fits = [segment for segment in self._free if segment.size >= size]
+            if fits:
+                segment = min(fits, key=lambda s: s.size)
+                self._free.remove(segment)
+                return segment
+        # Crear el primer segmento antes de lanzar el pool también arranca el resource tracker,
+        # que así comparten los hijos (si no, cada hijo borraría los segmentos al terminar)
+        return shared_memory.SharedMemory(create=True, size=max(size, 1))
+
+    def release(self, segment):
+        if segment.size > IMAGE_BUFFER_KEEP_BYTES:
+            self._destroy(segment)
+            return
+        with self._lock:
+            self._free.append(segment)
+            excess = None
+            if len(self._free) > IMAGE_MAX_IN_FLIGHT:
+                excess = min(self._free, key=lambda s: s.size)
+                self._free.remove(excess)
+        if excess is not None:
+            self._destroy(excess)
+
+    def clear(self):
+        with self._lock:
+            free, self._free = self._free, []
+        for segment in free:
+            self._destroy(segment)
+
+    @staticmethod
+    def _destroy(segment):
+        try:
+            segment.close()
+        except BufferError:
+            pass  # alguna vista sigue viva: el mapeo se libera cuando se recolecte
+        segment.unlink()
+
+
+shared_image_buffers = SharedImageBuffers()
+atexit.register(shared_image_buffers.clear)
+
+
+def render_image_task(buffer_name, size):
+    """
+    Corre en un proceso del pool: solo CPU, sin S3 ni BD. Lee la imagen del segmento de memoria
+    compartida buffer_name. Devuelve las duraciones por etapa.
+    """
+    timings = {}
+    segment = shared_memory.SharedMemory(name=buffer_name)
+    image_data = segment.buf[:size]
+    try:
+        renditions, fire_info = simple_image_process(image_data, timings)
+    finally:
+        try:
+            image_data.release()
+            segment.close()
+        except BufferError:
+            pass  # alguna vista sigue viva: el mapeo se libera cuando se recolecte
+    return renditions, fire_info, timings
+
+
+# ---------------------
+# Image pipeline
+# ---------------------
+image_pipeline_utilization = {}  # etapa -> utilización (0..1) de la última corrida
+
+
+@dataclass
+class ImageJob:
+    """Imagen en tránsito entre las etapas del pipeline"""
+    s3_key: str
+    content_sha256: str = None
+    segment: object = None  # shared_memory.SharedMemory con la imagen descargada
+    size: int = 0
+    owns_hash: bool = False  # las copias en vuelo con el mismo sha256 esperan a este job
+    renditions: dict = None
+    fire_info: dict = None
+
+
+class ImagePipeline:
+    """
+    Procesa imágenes en etapas que corren a la vez, conectadas por colas acotadas (backpressure),
+    para que la red y la CPU estén ocupadas al mismo tiempo:
+    - download: IMAGE_IO_THREADS threads bajan cada imagen a un segmento de memoria compartida
+    - process: un thread de CPU, o el pool de procesos (IMAGE_WORKERS > 0) con hasta
+      IMAGE_MAX_IN_FLIGHT imágenes en vuelo
+    - upload: IMAGE_IO_THREADS threads hacen el análisis de campo y suben las renditions
+    - db: un writer que guarda de a IMAGE_DB_BATCH filas por transacción
+    Las copias de una imagen que todavía está en vuelo esperan a que se guarde y reutilizan su
+    análisis. close() espera a que se vacíen las etapas, reporta la utilización de cada una
+    (tiempo ocupado / (workers * duración)) y devuelve las keys que fallaron.
+    """
+
+    def __init__(self):
+        self._keys = queue.Queue(maxsize=IMAGE_CLAIM_BATCH)
+        self._to_process = queue.Queue(maxsize=IMAGE_STAGE_QUEUE_SIZE)
+        self._to_upload = queue.Queue(maxsize=IMAGE_STAGE_QUEUE_SIZE)
+        self._to_save = queue.Queue(maxsize=2 * IMAGE_DB_BATCH)
+        self._lock = threading.Lock()
+        self._waiting = {}  # sha256 en vuelo -> keys con el mismo contenido
+        self._failed = []
+        self._workers = {"download": IMAGE_IO_THREADS, "process": max(IMAGE_WORKERS, 1),
+                         "upload": IMAGE_IO_THREADS, "db": 1}
+        self._busy = dict.fromkeys(self._workers, 0.0)
+        self._started = time.monotonic()
+        targets = {
+            "download": [self._download_worker] * IMAGE_IO_THREADS,
+            "process": [self._pool_dispatcher if IMAGE_WORKERS > 0 else self._process_worker],
+            "upload": [self._upload_worker] * IMAGE_IO_THREADS,
+            "db": [self._db_writer],
+        }
+        self._threads = {}
+        for stage, stage_targets in targets.items():
+            self._threads[stage] = [
+                threading.Thread(target=target, daemon=True, name=f"image-{stage}-{i}")
+                for i, target in enumerate(stage_targets)
+            ]
+            for thread in self._threads[stage]:
+                thread.start()
+
+    def submit(self, s3_key):
+        """Encola una key ya reservada (bloquea si la etapa de descarga está atrasada)"""
+        self._keys.put(s3_key)
+
+    def close(self):
+        """Cierra las etapas en orden (sentinel por worker) y devuelve las keys que fallaron"""
+        for stage, inbox in (("download", self._keys), ("process", self._to_process),
+                             ("upload", self._to_upload), ("db", self._to_save)):
+            for _ in self._threads[stage]:
+                inbox.put(None)
+            for thread in self._threads[stage]:
+                thread.join()
+        self._report()
+        return self._failed
+
+    def _account(self, stage, seconds):
+        with self._lock:
+            self._busy[stage] += seconds
+        IMAGE_PIPELINE_BUSY.inc(seconds, stage=stage)
+
+    def _release_segment(self, job):
+        if job.segment is not None:
+            shared_image_buffers.release(job.segment)
+            job.segment = None
+
+    def _fail(self, job, error):
+        IMAGES_PROCESSED.inc(result="error")
+        logger.error(f"❌ Error processing {job.s3_key}: {error}")
+        self._release_segment(job)
+        with self._lock:
+            self._failed.append(job.s3_key)
+        if job.owns_hash:
+            self._settle_copies(job.content_sha256, saved=False)
+
+    def _settle_copies(self, content_sha256, saved):
+        """
+        Resuelve las copias que esperaban a la imagen original. Si el original falló (o perdió el
+        lease), las copias se liberan junto con él y se reintentan en el próximo poll.
+        """
+        with self._lock:
+            copies = self._waiting.pop(content_sha256, [])
+        if not copies:
+            return
+        duplicate_id = find_processed_duplicate(content_sha256) if saved else None
+        for copy_key in copies:
+            try:
+                if duplicate_id is None:
+                    raise RuntimeError("original image was not saved")
+                save_duplicate(copy_key, content_sha256, duplicate_id)
+            except Exception as e:
+                if duplicate_id is not None:
+                    IMAGES_PROCESSED.inc(result="error")
+                    logger.error(f"❌ Error processing {copy_key}: {e}")
+                with self._lock:
+                    self._failed.append(copy_key)
+
+    def _download_worker(self):
+        while True:
+            s3_key = self._keys.get()
+            if s3_key is None:
+                return
+            job = ImageJob(s3_key)
+
+            def shared_buffer(size):
+                job.segment = shared_image_buffers.acquire(size)
+                return job.segment.buf
+
+            start = time.perf_counter()
+            try:
+                image_data, job.content_sha256, duplicate_id = download_image(s3_key, shared_buffer)
+                if image_data is not None:
+                    # Las etapas siguientes leen del segmento: acá solo hace falta el tamaño
+                    job.size = len(image_data)
+                    image_data.release()
+                if duplicate_id is not None:
+                    self._release_segment(job)
+                    save_duplicate(s3_key, job.content_sha256, duplicate_id)
+                    continue
+                with self._lock:
+                    job.owns_hash = not (IMAGE_DEDUP and job.content_sha256 in self._waiting)
+                    if job.owns_hash:
+                        self._waiting[job.content_sha256] = []
+                    else:
+                        self._waiting[job.content_sha256].append(s3_key)
+                if not job.owns_hash:
+                    self._release_segment(job)
+                    continue
+            except Exception as e:
+                self._fail(job, e)
+                continue
+            finally:
+                self._account("download", time.perf_counter() - start)
+            self._to_process.put(job)
+
+    def _process_worker(self):
+        """Etapa de CPU sin pool de procesos (IMAGE_WORKERS=0)"""
+        while True:
+            job = self._to_process.get()
+            if job is None:
+                return
+            start = time.perf_counter()
+            try:
+                image_data = job.segment.buf[:job.size]
+                try:
+                    job.renditions, job.fire_info = simple_image_process(image_data)
+                finally:
+                    try:
+                        image_data.release()
+                    except BufferError:
+                        pass  # alguna vista sigue viva: el mapeo se libera cuando se recolecte
+                self._release_segment(job)
+            except Exception as e:
+                self._fail(job, e)
+                continue
+            finally:
+                self._account("process", time.perf_counter() - start)
+            self._to_upload.put(job)
+
+    def _pool_dispatcher(self):
+        """
+        Etapa de CPU con el pool de procesos: entrega las imágenes a los hijos (hasta
+        IMAGE_MAX_IN_FLIGHT en vuelo) y pasa los resultados a la etapa de subida. El tiempo
+        ocupado de la etapa es el de CPU medido en los hijos.
+        """
+        in_flight = {}
+        closing = False
+        while not closing or in_flight:
+            if not closing and len(in_flight) < IMAGE_MAX_IN_FLIGHT:
+                try:
+                    job = self._to_process.get(timeout=0.05 if in_flight else None)
+                except queue.Empty:
+                    pass
+                else:
+                    if job is None:
+                        closing = True
+                    else:
+                        try:
+                            in_flight[get_image_executor().submit(render_image_task, job.segment.name, job.size)] = job
+                        except Exception as e:
+                            self._fail(job, e)
+                            if isinstance(e, BrokenProcessPool):
+                                reset_image_executor()
+            if not in_flight:
+                continue
+            saturated = closing or len(in_flight) >= IMAGE_MAX_IN_FLIGHT
+            done, _ = wait(list(in_flight), timeout=None if saturated else 0, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = in_flight.pop(future)
+                self._release_segment(job)
+                try:
+                    job.renditions, job.fire_info, timings = future.result()
+                except BrokenProcessPool as e:
+                    self._fail(job, f"image process pool broken: {e}")
+                    reset_image_executor()
+                    continue
+                except Exception as e:
+                    self._fail(job, e)
+                    continue
+                record_image_stages(timings)
+                self._account("process", sum(timings.values()))
+                self._to_upload.put(job)
+
+    def _upload_worker(self):
+        while True:
+            job = self._to_upload.get()
+            if job is None:
+                return
+            start = time.perf_counter()
+            try:
+                record = upload_image(job.s3_key, job.size, job.renditions, job.fire_info, job.content_sha256)
+            except Exception as e:
+                self._fail(job, e)
+                continue
+            finally:
+                self._account("upload", time.perf_counter() - start)
+            self._to_save.put(record)
+
+    def _db_writer(self):
+        """Junta filas hasta IMAGE_DB_BATCH (o IMAGE_DB_BATCH_WAIT segundos) y las guarda juntas"""
+        stopping = False
+        while not stopping:
+            record = self._to_save.get()
+            if record is None:
+                return
+            batch = [record]
+            deadline = time.monotonic() + IMAGE_DB_BATCH_WAIT
+            while len(batch) < IMAGE_DB_BATCH:
+                try:
+                    record = self._to_save.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if record is None:
+                    stopping = True
+                    break
+                batch.append(record)
+
+            start = time.perf_counter()
+            try:
+                saved = save_to_db(batch)
+            except Exception as e:
+                IMAGES_PROCESSED.inc(len(batch), result="error")
+                logger.error(f"Error saving {len(batch)} images to DB: {e}")
+                saved = set()
+            finally:
+                self._account("db", time.perf_counter() - start)
+            for record in batch:
+                if record.raw_key not in saved:
+                    with self._lock:
+                        self._failed.append(record.raw_key)
+                self._settle_copies(record.content_sha256, saved=record.raw_key in saved)
+
+    def _report(self):
+        elapsed = max(time.monotonic() - self._started, 1e-6)
+        utilization = {stage: min(self._busy[stage] / (workers * elapsed), 1.0)
+                       for stage, workers in self._workers.items()}
+        image_pipeline_utilization.update(utilization)
+        logger.info(f"📊 Image pipeline finished in {elapsed:.1f}s - utilization: "
+                    + ", ".join(f"{stage} {value:.0%}" for stage, value in utilization.items()))
+
+
+# ---------------------
+# Raw bucket scan (reconciliador)
+# ---------------------
+RAW_IMAGES_PREFIX = 'drone-images/'
+SCAN_STATE_NAME = 'raw_images_scan'
+RAW_IMAGE_PARTITION = re.compile(r'^drone-images/(\d{4}/\d{2}/\d{2})/')
+MAX_SCAN_DAYS = 366  # tope de prefijos diarios por ciclo (watermark muy atrasado)
+scan_watermark = None  # último watermark conocido (si la BD no responde se sigue con este)
+
+
+def load_scan_watermark():
+    """Partición (drone-images/YYYY/MM/DD/) desde la que escanea el reconciliador (None = listar todo)"""
+    global scan_watermark
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT watermark FROM image_scan_state WHERE name = %s", (SCAN_STATE_NAME,))
+            row = cursor.fetchone()
+        scan_watermark = row[0] if row else None
     except Exception as e:
-        logger.error(f"❌ Error processing {s3_key}: {e}")
+        logger.error(f"Error loading scan watermark, using {scan_watermark!r}: {e}")
+    return scan_watermark
 
-def poll_s3_for_images():
-    """Revisa S3 bucket por imágenes nuevas"""
-    logger.info("Polling S3 for new images...")
-    logger.info(f"S3 Client: {s3_client}")
-    logger.info(f"RAW_IMAGES_BUCKET: {RAW_IMAGES_BUCKET}")
+
+def save_scan_watermark(watermark):
+    global scan_watermark
+    scan_watermark = watermark
     try:
-        
-        if not s3_client or not RAW_IMAGES_BUCKET:
-            logger.error("S3 client or RAW_IMAGES_BUCKET not configured")
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO image_scan_state (name, watermark, updated_at) VALUES (%s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (name) DO UPDATE SET watermark = EXCLUDED.watermark, updated_at = EXCLUDED.updated_at
+            """, (SCAN_STATE_NAME, watermark))
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Error saving scan watermark: {e}")
+
+
+def list_raw_image_pages(prefix):
+    """Páginas de keys (hasta 1000 por llamada) bajo prefix"""
+    params = {'Bucket': RAW_IMAGES_BUCKET, 'Prefix': prefix}
+    while True:
+        try:
+            with S3_SECONDS.time(operation="list_objects"):
+                response = s3_client.list_objects_v2(**params)
+        except Exception:
+            S3_ERRORS.inc(operation="list_objects")
+            raise
+        yield [obj['Key'] for obj in response.get('Contents', [])]
+        if not response.get('IsTruncated'):
             return
+        params['ContinuationToken'] = response['NextContinuationToken']
 
-            
-        # Listar objetos en raw-images bucket
-        response = s3_client.list_objects_v2(
-            Bucket=RAW_IMAGES_BUCKET,
-            Prefix='drone-images/'
-        )
-        
-        objects = response.get('Contents', [])
-        logger.info(f"Found {len(objects)} objects in S3")
-        
-        for obj in objects:
-            s3_key = obj['Key']
-            
-            # Verificar si ya fue procesada
-            if not is_image_processed(s3_key):
-                logger.info(f"Processing new image: {s3_key}")
-                process_image_from_s3(s3_key)
-                
+
+def raw_image_day_prefixes(watermark):
+    """Prefijos drone-images/YYYY/MM/DD/ desde el día del watermark hasta hoy (UTC)"""
+    day = datetime.strptime(RAW_IMAGE_PARTITION.match(watermark).group(1), '%Y/%m/%d').date()
+    today = datetime.utcnow().date()
+    day = max(day, today - timedelta(days=MAX_SCAN_DAYS - 1))
+    while day <= today:
+        yield f"{RAW_IMAGES_PREFIX}{day:%Y/%m/%d}/"
+        day += timedelta(days=1)
+
+
+def next_scan_watermark(previous, failed_keys):
+    """
+    Las keys están particionadas por fecha de subida (drone-images/YYYY/MM/DD/), así que una
+    partición anterior a hoy - IMAGE_SCAN_LOOKBACK_DAYS ya no recibe imágenes nuevas: el próximo
+    scan arranca desde ahí, o desde la partición de la imagen fallida más vieja para reintentarla.
+    """
+    start = (datetime.utcnow() - timedelta(days=IMAGE_SCAN_LOOKBACK_DAYS)).strftime('%Y/%m/%d')
+    for s3_key in failed_keys:
+        match = RAW_IMAGE_PARTITION.match(s3_key)
+        if match:
+            start = min(start, match.group(1))
+    watermark = f"{RAW_IMAGES_PREFIX}{start}/"
+    return max(watermark, previous) if previous else watermark
+
+
+def poll_s3_for_images():
+    """
+    Revisa el bucket raw por imágenes nuevas. Sin watermark (primer scan) lista todo
+    drone-images/, incluidas las keys viejas sin partición de fecha (drone-images/{user}_{ts}.jpg);
+    después lista solo los prefijos diarios desde el día del watermark hasta hoy, así el costo de
+    cada ciclo depende de las subidas recientes y no del tamaño del bucket. Las keys sin fecha ya
+    no se vuelven a listar: los uploaders actuales siempre escriben con fecha y las que fallaron
+    en el primer scan se reintentan por su reserva vencida.
+    """
+    if not s3_client or not RAW_IMAGES_BUCKET:
+        logger.error("S3 client or RAW_IMAGES_BUCKET not configured")
+        return
+    try:
+        watermark = load_scan_watermark()
+        if watermark and not RAW_IMAGE_PARTITION.match(watermark):
+            logger.warning(f"Ignoring unexpected scan watermark {watermark!r}")
+            watermark = None
+        if watermark:
+            prefixes = list(raw_image_day_prefixes(watermark))
+            logger.info(f"Scanning s3://{RAW_IMAGES_BUCKET}/ {prefixes[0]} .. {prefixes[-1]}")
+        else:
+            prefixes = [RAW_IMAGES_PREFIX]
+            logger.info(f"Scanning all of s3://{RAW_IMAGES_BUCKET}/{RAW_IMAGES_PREFIX} (no watermark)")
+        listed, failed = 0, []
+        for prefix in prefixes:
+            for keys in list_raw_image_pages(prefix):
+                listed += len(keys)
+                failed.extend(process_new_images(keys))
+        logger.info(f"Scanned {listed} objects in S3 ({len(failed)} failed)")
+
+        # Reservas vencidas (tasks caídas, imágenes fallidas) aunque ya estén detrás del watermark;
+        # las que fallaron en este mismo ciclo esperan al próximo
+        failed_now = set(failed)
+        expired = [s3_key for s3_key in expired_image_claims() if s3_key not in failed_now]
+        if expired:
+            logger.info(f"Retrying {len(expired)} images with expired claims")
+            process_new_images(expired)
+
+        new_watermark = next_scan_watermark(watermark, failed)
+        if new_watermark != watermark:
+            save_scan_watermark(new_watermark)
     except Exception as e:
         logger.error(f"Error polling S3: {e}")
 
+
+image_processing_lock = threading.Lock()
+
+
+def process_new_images(s3_keys):
+    """
+    Procesa las keys que todavía no están en drone_images (en el pipeline de imágenes) y devuelve
+    las que fallaron. El lock evita que el consumidor de eventos y el reconciliador procesen la misma
+    imagen a la vez.
+    """
+    with image_processing_lock:
+        # Verificar cuáles no fueron procesadas todavía (una query por página)
+        pending = processed_image_keys.unprocessed(s3_keys)
+        if not pending:
+            return []
+        pipeline = ImagePipeline()
+        try:
+            # Reservar de a tandas chicas: el lease tiene que alcanzar para procesar toda la tanda.
+            # La cola de entrada del pipeline (IMAGE_CLAIM_BATCH) frena la reserva de la próxima
+            # tanda hasta que la anterior avance
+            for start in range(0, len(pending), IMAGE_CLAIM_BATCH):
+                claimed = claim_images(pending[start:start + IMAGE_CLAIM_BATCH])
+                if not claimed:
+                    continue
+                logger.info(f"Processing {len(claimed)} new images")
+                for s3_key in claimed:
+                    pipeline.submit(s3_key)
+        finally:
+            failed = pipeline.close()
+        release_image_claims(failed)
+        return failed
+
+
+# ---------------------
+# Image events (S3 ObjectCreated -> SQS)
+# ---------------------
+def receive_image_events(sqs):
+    """Long-poll de la cola de eventos de imágenes (lista vacía si no llegó nada en 20s)"""
+    try:
+        response = sqs.receive_message(
+            QueueUrl=IMAGE_EVENTS_QUEUE_URL,
+            MaxNumberOfMessages=10,
+            WaitTimeSeconds=20,
+            VisibilityTimeout=300,
+            AttributeNames=['ApproximateReceiveCount']
+        )
+    except Exception:
+        SQS_ERRORS.inc(operation="receive_image_events")
+        raise
+    return response.get('Messages', [])
+
+
+def parse_image_event(message):
+    """
+    Keys de imágenes nuevas en un mensaje de la cola: notificación de S3 (Records[].s3.object.key,
+    URL-encoded) o {"s3_key": "..."} de otro productor. Lista vacía para s3:TestEvent y eventos
+    que no son de imágenes del bucket raw. ValueError/KeyError si el mensaje es inválido.
+    """
+    body = json.loads(message['Body'])
+    if 'Records' in body:
+        keys = []
+        for record in body['Records']:
+            if not record.get('eventName', '').startswith('ObjectCreated'):
+                continue
+            if RAW_IMAGES_BUCKET and record['s3']['bucket']['name'] != RAW_IMAGES_BUCKET:
+                continue
+            keys.append(unquote_plus(record['s3']['object']['key']))
+        return [key for key in keys if key.startswith('drone-images/')]
+    if body.get('s3_key'):
+        return [body['s3_key']]
+    return []
+
+
+def image_events_worker(sqs):
+    """
+    Consume la cola de eventos y procesa cada imagen apenas se sube. Los mensajes se borran después
+    de procesar; si una imagen falla se libera su reserva y la reintenta el reconciliador
+    (poll_s3_for_images).
+    """
+    logger.info(f"Image events worker started, polling SQS queue: {IMAGE_EVENTS_QUEUE_URL}")
+    while worker_running:
+        try:
+            messages = receive_image_events(sqs)
+        except Exception as e:
+            logger.error(f"Error receiving image events: {e}")
+            time.sleep(5)
+            continue
+        if not messages:
+            continue
+
+        keys, handled, poison = [], [], []
+        for message in messages:
+            try:
+                keys.extend(parse_image_event(message))
+                handled.append(message)
+            except (ValueError, KeyError, TypeError) as e:
+                IMAGE_EVENTS.inc(result="poison")
+                logger.warning(f"Invalid image event {message.get('MessageId')}: {e}")
+                poison.append(message)
+        IMAGE_EVENTS.inc(len(handled), result="received")
+
+        try:
+            process_new_images(keys)
+        except Exception as e:
+            # Error inesperado (p.ej. sin S3): los eventos vuelven a la cola con backoff
+            logger.error(f"Error processing image events: {e}")
+            release_messages(sqs, IMAGE_EVENTS_QUEUE_URL, retryable=handled, poison=poison)
+            continue
+        delete_messages(sqs, IMAGE_EVENTS_QUEUE_URL, handled)
+        if poison:
+            release_messages(sqs, IMAGE_EVENTS_QUEUE_URL, poison=poison)
+    logger.info("Image events worker stopped")
+
+
 def image_polling_worker():
-    """Worker thread que revisa S3 cada 30 segundos"""
+    """
+    Worker thread de imágenes: lista S3 cada IMAGE_POLL_INTERVAL segundos (0 = nunca) y, si hay
+    IMAGE_EVENTS_QUEUE_URL, consume además la cola de eventos en otro thread
+    """
     global worker_running
     logger.info("Image polling For the Worker started")
 
-    
+    events_thread = None
+    if IMAGE_EVENTS_QUEUE_URL:
+        sqs, _ = get_aws_clients()
+        if sqs:
+            events_thread = threading.Thread(target=image_events_worker, args=(sqs,), name="image-events", daemon=True)
+            events_thread.start()
+        else:
+            logger.error("Image events disabled: AWS clients unavailable")
+
+    next_poll = time.monotonic()
     while worker_running:
-        poll_s3_for_images()
-        time.sleep(30)  # Esperar 30 segundos
-    
+        if IMAGE_POLL_INTERVAL > 0 and time.monotonic() >= next_poll:
+            poll_s3_for_images()
+            next_poll = time.monotonic() + IMAGE_POLL_INTERVAL
+        time.sleep(1)
+
+    if events_thread is not None:
+        events_thread.join()
+    reset_image_executor()
+    shared_image_buffers.clear()
     logger.info("Image polling worker stopped")
 
 
@@ -994,74 +3813,101 @@ def run_startup_migrations():
     """Run database migrations on container startup"""
     try:
         logger.info("🚀 Running startup database migrations...")
-        conn = psycopg2.connect(
-            host=DB_HOST, port=DB_PORT, user=DB_USER, 
-            password=DB_PASS, dbname=DB_NAME
-        )
-        cursor = conn.cursor()
-        
-        logger.info("Creating users table...")
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                userid SERIAL PRIMARY KEY,
-                mail   VARCHAR(255) NOT NULL UNIQUE
-            );
-        """)
+        with db_connection() as conn:
+            cursor = conn.cursor()
         
-        logger.info("Creating parameters table...")
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS parameters (
-                id SERIAL PRIMARY KEY,
-                userid             INTEGER REFERENCES users(userid),
-                min_temperature    FLOAT,
-                max_temperature    FLOAT,
-                min_humidity       FLOAT,
-                max_humidity       FLOAT,
-                min_soil_moisture  FLOAT,
-                max_soil_moisture  FLOAT,
-                UNIQUE (userid)
-            );
-        """)
+            logger.info("Creating users table...")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    userid SERIAL PRIMARY KEY,
+                    mail   VARCHAR(255) NOT NULL UNIQUE
+                );
+            """)
         
-        logger.info("Creating sensor_data table...")
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS sensor_data (
-                id SERIAL PRIMARY KEY,
-                userid     INTEGER REFERENCES users(userid),
-                timestamp  TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                temp       FLOAT,
-                hum        FLOAT,
-                soil       FLOAT
+            logger.info("Creating parameters table...")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS parameters (
+                    id SERIAL PRIMARY KEY,
+                    userid             INTEGER REFERENCES users(userid),
+                    min_temperature    FLOAT,
+                    max_temperature    FLOAT,
+                    min_humidity       FLOAT,
+                    max_humidity       FLOAT,
+                    min_soil_moisture  FLOAT,
+                    max_soil_moisture  FLOAT,
+                    UNIQUE (userid)
                 );
+            """)
+        
+            logger.info("Creating sensor_data table...")
+            ensure_sensor_data_schema(cursor)
 
-        """)
-
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS reports (
-                id SERIAL primary key,
-                userid     INTEGER REFERENCES users(userid),
-                time  date NOT NULL DEFAULT CURRENT_DATE,
-                report text not null,
-                unique (userid,  time)
-                );
-        """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS reports (
+                    id SERIAL primary key,
+                    userid     INTEGER REFERENCES users(userid),
+                    time  date NOT NULL DEFAULT CURRENT_DATE,
+                    report text not null,
+                    unique (userid,  time)
+                    );
+            """)
         
-        logger.info("Creating drone_images table...")
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS drone_images (
-                id SERIAL PRIMARY KEY,
-                user_id VARCHAR(255),
-                raw_s3_key VARCHAR(500),
-                processed_s3_key VARCHAR(500),
-                field_status VARCHAR(50) DEFAULT 'unknown',
-                analysis_confidence REAL DEFAULT 0.0,
-                processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                analyzed_at TIMESTAMP
-            )
-        """)
+            logger.info("Creating drone_images table...")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS drone_images (
+                    id SERIAL PRIMARY KEY,
+                    user_id VARCHAR(255),
+                    raw_s3_key VARCHAR(500),
+                    processed_s3_key VARCHAR(500),
+                    field_status VARCHAR(50) DEFAULT 'unknown',
+                    analysis_confidence REAL DEFAULT 0.0,
+                    processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    analyzed_at TIMESTAMP
+                )
+            """)
+
+            # Clusters de fuego detectados (lista JSON con área, centroide y bounding box)
+            cursor.execute("ALTER TABLE drone_images ADD COLUMN IF NOT EXISTS fire_clusters JSONB")
+            # Renditions para el dashboard (la imagen completa sigue en processed_s3_key)
+            cursor.execute("ALTER TABLE drone_images ADD COLUMN IF NOT EXISTS preview_s3_key VARCHAR(500)")
+            cursor.execute("ALTER TABLE drone_images ADD COLUMN IF NOT EXISTS thumbnail_s3_key VARCHAR(500)")
+            # Deduplicación por contenido (SHA-256) + hash perceptual de referencia
+            cursor.execute("ALTER TABLE drone_images ADD COLUMN IF NOT EXISTS content_sha256 CHAR(64)")
+            cursor.execute("ALTER TABLE drone_images ADD COLUMN IF NOT EXISTS perceptual_hash VARCHAR(16)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_drone_images_content_sha256 ON drone_images (content_sha256)")
+
+            # Una fila por imagen raw. Migración única: solo antes de crear el índice se limpian los
+            # duplicados de polls concurrentes (se conserva la primera); después el índice los impide
+            cursor.execute("SELECT to_regclass('uq_drone_images_raw_s3_key')")
+            if cursor.fetchone()[0] is None:
+                cursor.execute("""
+                    DELETE FROM drone_images a USING drone_images b
+                    WHERE a.raw_s3_key = b.raw_s3_key AND a.id > b.id
+                """)
+                if cursor.rowcount:
+                    logger.warning(f"⚠️  Removed {cursor.rowcount} duplicate drone_images rows before creating uq_drone_images_raw_s3_key")
+                cursor.execute("CREATE UNIQUE INDEX uq_drone_images_raw_s3_key ON drone_images (raw_s3_key)")
+
+            # Reserva de imágenes entre tasks: las filas existentes ya están procesadas ('done')
+            cursor.execute("ALTER TABLE drone_images ADD COLUMN IF NOT EXISTS status VARCHAR(20) NOT NULL DEFAULT 'done'")
+            cursor.execute("ALTER TABLE drone_images ADD COLUMN IF NOT EXISTS lease_owner VARCHAR(100)")
+            cursor.execute("ALTER TABLE drone_images ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP")
+            cursor.execute("ALTER TABLE drone_images ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0")
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_drone_images_expired_claims
+                ON drone_images (lease_expires_at) WHERE status = 'processing'
+            """)
+
+            # Watermark (StartAfter) del scan incremental del bucket raw
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS image_scan_state (
+                    name VARCHAR(100) PRIMARY KEY,
+                    watermark VARCHAR(1024),
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
         
-        conn.commit()
-        conn.close()
+            conn.commit()
         logger.info("✅ Startup database migrations completed successfully!")
         
     except Exception as e:
@@ -1069,10 +3915,26 @@ def run_startup_migrations():
         logger.warning("⚠️  Continuing without migrations - tables may not exist")
 
 if __name__ == "__main__":
+    # Migración única de sensor_data a particiones: `python main.py migrate-sensor-data`
+    if sys.argv[1:] == ["migrate-sensor-data"]:
+        migrate_legacy_sensor_data()
+        sys.exit(0)
+
     logger.info("Starting Processing Engine (SQS + Image processing version)...")
     get_aws_clients()
+    run_startup_migrations()
     
     
+    # Escuchar cambios de parámetros; el listener precarga el cache con el LISTEN ya activo
+    threading.Thread(target=parameters_listener, daemon=True).start()
+    try:
+        processed_image_keys.warm_up()
+    except Exception as e:
+        logger.error(f"❌ Processed image keys warm-up failed: {e}")
+    if not parameters_listener_ready.wait(timeout=DB_CONNECT_TIMEOUT + 30):
+        logger.warning("⚠️  User parameters cache not warmed up yet, starting workers anyway")
+    threading.Thread(target=sensor_partition_maintainer, daemon=True).start()
+
     # Iniciar workers automáticamente
     worker_running = True
     
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# main.py es un módulo suelto (no un paquete): los tests lo importan desde src/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
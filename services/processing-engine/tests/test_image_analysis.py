@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+import main
+
+
+def old_kernel(pixels):
+    """detect_fire + calculate_vegetation_metrics + máscara verde del heatmap originales (floats)"""
+    r = pixels[:, :, 0].astype(float)
+    g = pixels[:, :, 1].astype(float)
+    b = pixels[:, :, 2].astype(float)
+    fire_mask = (r > 180) & (g > 80) & (g < r * 0.8) & (b < g * 0.7) & ((r + g + b) > 400)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        green_index = np.where((g + r) > 0, (g - r) / (g + r), 0)
+    green_percentage = (np.clip(green_index, -1, 1) + 1) / 2 * 100
+    green_mask = (g > r * 1.1) & (g > b * 1.1)
+    return {
+        "fire_mask": fire_mask,
+        "green_mask": green_mask,
+        "fire_coverage": round(fire_mask.sum() / fire_mask.size * 100, 2),
+        "green_coverage": round(float(np.mean(green_percentage)), 1),
+        "brightness": round(float(np.mean(pixels)), 1),
+    }
+
+
+@pytest.mark.parametrize("shape", [(1, 1), (37, 53), (main.ANALYSIS_STRIP_ROWS * 2 + 5, 300)])
+def test_analyze_pixels_matches_old_kernel(shape):
+    rng = np.random.default_rng(shape[0])
+    pixels = rng.integers(0, 256, (*shape, 3), dtype=np.uint8)
+    # Zonas con fuego y vegetación, más los bordes exactos de cada regla
+    pixels[::3, ::3] = (250, 150, 40)
+    pixels[1::5, ::4] = (40, 160, 30)
+    pixels[0, :1] = (200, 160, 112)
+    pixels[-1, -1:] = (0, 0, 0)
+
+    fire_mask, green_mask, totals = main.analyze_pixels(pixels)
+    analysis = main.ImageAnalysis.from_totals(fire_mask, green_mask, totals)
+    expected = old_kernel(pixels)
+
+    assert np.array_equal(fire_mask, expected["fire_mask"])
+    assert np.array_equal(green_mask, expected["green_mask"])
+    assert analysis.fire_coverage == expected["fire_coverage"]
+    assert analysis.green_coverage == pytest.approx(expected["green_coverage"], abs=0.1)
+    assert analysis.brightness == expected["brightness"]
+
+
+def test_analysis_totals_add_up_across_bands():
+    pixels = np.random.default_rng(1).integers(0, 256, (100, 80, 3), dtype=np.uint8)
+    _, _, whole = main.analyze_pixels(pixels)
+
+    totals = main.AnalysisTotals()
+    for top in range(0, 100, 30):
+        totals.add(main.analyze_pixels(pixels[top:top + 30])[2])
+
+    assert (totals.pixel_count, totals.fire_pixels, totals.channel_sum) == \
+        (whole.pixel_count, whole.fire_pixels, whole.channel_sum)
+    assert totals.green_index_sum == pytest.approx(whole.green_index_sum)
+
+
+def test_find_fire_clusters_empty_mask():
+    assert main.find_fire_clusters(np.zeros((50, 50), dtype=bool)) == []
+
+
+def test_find_fire_clusters_separates_regions_largest_first():
+    mask = np.zeros((100, 200), dtype=bool)
+    mask[10:20, 10:30] = True     # 200 px
+    mask[60:90, 150:190] = True   # 1200 px
+
+    clusters = main.find_fire_clusters(mask, grid_size=200, min_area=0)
+
+    assert [cluster["area"] for cluster in clusters] == [6.0, 1.0]
+    assert clusters[0]["bbox"] == [0.75, 0.6, 0.95, 0.9]
+    assert clusters[0]["centroid"] == [0.85, 0.75]
+    assert clusters[1]["bbox"] == [0.05, 0.1, 0.15, 0.2]
+
+
+def test_find_fire_clusters_joins_diagonal_neighbours():
+    mask = np.zeros((10, 10), dtype=bool)
+    mask[2, 2] = mask[3, 3] = mask[4, 4] = True
+    # Forma de U: dos brazos que se unen recién en la última fila
+    mask[0:5, 7] = mask[0:5, 9] = mask[5, 7:10] = True
+
+    clusters = main.find_fire_clusters(mask, grid_size=10, min_area=0)
+
+    assert sorted(cluster["area"] for cluster in clusters) == [3.0, 13.0]
+
+
+def test_find_fire_clusters_drops_small_clusters_and_works_on_reduced_grid():
+    mask = np.zeros((1000, 1000), dtype=bool)
+    mask[100:300, 100:300] = True   # 4% de la imagen
+    mask[900, 900] = True           # 0.0001%: ruido
+
+    clusters = main.find_fire_clusters(mask, grid_size=64, min_area=0.05)
+
+    assert len(clusters) == 1
+    assert clusters[0]["area"] == 4.0
+    assert clusters[0]["centroid"] == pytest.approx([0.2, 0.2], abs=0.01)
@@ -0,0 +1,65 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+
+
+def s3_event(*keys, bucket="raw-bucket", event="ObjectCreated:Put"):
+    records = [{"eventName": event, "s3": {"bucket": {"name": bucket}, "object": {"key": key}}} for key in keys]
+    return {"Body": json.dumps({"Records": records})}
+
+
+@pytest.fixture(autouse=True)
+def raw_bucket(monkeypatch):
+    monkeypatch.setattr(main, "RAW_IMAGES_BUCKET", "raw-bucket")
+    monkeypatch.setattr(main, "IMAGE_SCAN_LOOKBACK_DAYS", 1)
+
+
+def test_parse_image_event_decodes_s3_notification_keys():
+    message = s3_event("drone-images/2025/10/19/drone001_a+b%C3%B1.jpg", "drone-images/2025/10/19/drone002.jpg")
+
+    assert main.parse_image_event(message) == [
+        "drone-images/2025/10/19/drone001_a bñ.jpg",
+        "drone-images/2025/10/19/drone002.jpg",
+    ]
+
+
+def test_parse_image_event_skips_other_buckets_events_and_prefixes():
+    assert main.parse_image_event(s3_event("drone-images/x.jpg", bucket="other-bucket")) == []
+    assert main.parse_image_event(s3_event("drone-images/x.jpg", event="ObjectRemoved:Delete")) == []
+    assert main.parse_image_event(s3_event("processed/drone-images/x.jpg")) == []
+
+
+def test_parse_image_event_test_event_and_direct_keys():
+    assert main.parse_image_event({"Body": json.dumps({"Event": "s3:TestEvent"})}) == []
+    assert main.parse_image_event({"Body": json.dumps({"s3_key": "drone-images/x.jpg"})}) == ["drone-images/x.jpg"]
+
+
+def test_parse_image_event_rejects_invalid_messages():
+    with pytest.raises(ValueError):
+        main.parse_image_event({"Body": "not json"})
+    with pytest.raises(KeyError):
+        main.parse_image_event({"Body": json.dumps({"Records": [{"eventName": "ObjectCreated:Put"}]})})
+
+
+def lookback_watermark(days=1):
+    return f"drone-images/{(datetime.utcnow() - timedelta(days=days)):%Y/%m/%d}/"
+
+
+def test_next_scan_watermark_starts_at_lookback_window():
+    assert main.next_scan_watermark(None, []) == lookback_watermark()
+
+
+def test_next_scan_watermark_goes_back_to_oldest_failed_partition():
+    failed = ["drone-images/2020/01/02/a.jpg", "drone-images/2021/05/06/b.jpg", "drone-images/legacy_1.jpg"]
+
+    assert main.next_scan_watermark(None, failed) == "drone-images/2020/01/02/"
+
+
+def test_next_scan_watermark_never_moves_backwards():
+    ahead = "drone-images/2999/01/01/"
+
+    assert main.next_scan_watermark(ahead, []) == ahead
+    assert main.next_scan_watermark("drone-images/2000/01/01/", []) == lookback_watermark()
@@ -0,0 +1,121 @@
+import random
+
+import pytest
+
+import main
+
+PARAMETERS = {
+    "email": "farmer@example.com",
+    "min_temperature": 10.0, "max_temperature": 30.0,
+    "min_humidity": 40.0, "max_humidity": 80.0,
+    "min_soil_moisture": 20.0, "max_soil_moisture": 60.0,
+}
+
+
+@pytest.fixture(autouse=True)
+def alert_state(monkeypatch):
+    """Cada test arranca sin alertas activas (el tracker es global del módulo)"""
+    state = main.AlertStateTracker(0.1)
+    monkeypatch.setattr(main, "alert_state", state)
+    return state
+
+
+def reading(user_id=1, temperature=20.0, humidity=60.0, soil_moisture=40.0):
+    return {"user_id": user_id, "temperature": temperature, "humidity": humidity, "soil_moisture": soil_moisture}
+
+
+def evaluate(*readings, parameters=PARAMETERS):
+    return main.evaluate_sensor_alerts(list(readings), [parameters] * len(readings))
+
+
+def test_in_range_readings_do_not_alert():
+    assert evaluate(reading(), reading(temperature=10.0), reading(temperature=30.0)) == []
+
+
+def test_violation_alerts_once_until_back_in_range():
+    alerts = evaluate(reading(temperature=35.0), reading(temperature=36.0))
+
+    assert alerts == [{
+        "email": "farmer@example.com",
+        "user_id": 1,
+        "measurement": "Temperatura",
+        "value": 35.0,
+        "expected_range": "10.0 - 30.0",
+    }]
+    assert evaluate(reading(temperature=40.0)) == []
+
+
+def test_switching_from_high_to_low_alerts_again():
+    assert len(evaluate(reading(temperature=35.0))) == 1
+    assert [alert["value"] for alert in evaluate(reading(temperature=5.0))] == [5.0]
+
+
+def test_rearms_only_past_the_hysteresis_margin():
+    # Rango 10-30 con ratio 0.1: se rearma recién entre 12 y 28
+    assert len(evaluate(reading(temperature=35.0))) == 1
+    assert evaluate(reading(temperature=29.0), reading(temperature=31.0)) == []
+    assert evaluate(reading(temperature=27.0)) == []
+    assert len(evaluate(reading(temperature=31.0))) == 1
+
+
+def test_rearm_and_new_violation_in_the_same_batch():
+    assert len(evaluate(reading(temperature=35.0))) == 1
+    alerts = evaluate(reading(temperature=20.0), reading(temperature=35.0))
+    assert [alert["value"] for alert in alerts] == [35.0]
+
+
+def test_one_sided_ranges_and_missing_values_are_skipped(alert_state):
+    one_sided = {**PARAMETERS, "max_temperature": None, "min_humidity": None}
+
+    alerts = evaluate(reading(temperature=-50.0, humidity=99.0, soil_moisture=None), parameters=one_sided)
+
+    # Temperatura bajo el mínimo sin máximo, humedad sobre el máximo sin mínimo, suelo sin valor
+    assert alerts == []
+    assert alert_state.firing_count() == 0
+
+
+def test_users_in_the_same_batch_are_tracked_separately():
+    other = {**PARAMETERS, "email": "other@example.com", "min_temperature": 0.0, "max_temperature": 50.0}
+
+    alerts = main.evaluate_sensor_alerts(
+        [reading(user_id=1, temperature=35.0), reading(user_id=2, temperature=35.0), reading(user_id=2, humidity=90.0)],
+        [PARAMETERS, other, other],
+    )
+
+    assert [(alert["email"], alert["measurement"]) for alert in alerts] == [
+        ("farmer@example.com", "Temperatura"),
+        ("other@example.com", "Humedad"),
+    ]
+
+
+def test_matches_scalar_tracker_on_random_batches(alert_state):
+    """El camino vectorizado da las mismas alertas que AlertStateTracker lectura por lectura"""
+    rng = random.Random(7)
+    reference = main.AlertStateTracker(0.1)
+    users = {
+        user_id: {**PARAMETERS, "email": f"user{user_id}@example.com",
+                  "max_humidity": None if user_id == 3 else 80.0}
+        for user_id in range(1, 5)
+    }
+    fired = 0
+    for _ in range(200):
+        batch = [reading(user_id=rng.randint(1, 4),
+                         temperature=rng.choice([None, rng.uniform(0, 40)]),
+                         humidity=rng.uniform(30, 90),
+                         soil_moisture=rng.uniform(10, 70))
+                 for _ in range(rng.randint(1, 8))]
+        parameters = [users[item["user_id"]] for item in batch]
+
+        expected = []
+        for item, params in zip(batch, parameters):
+            for field, param, label in main.SENSOR_MEASURES:
+                low, high = params[f"min_{param}"], params[f"max_{param}"]
+                if item[field] is None or low is None or high is None:
+                    continue
+                if reference.update(item["user_id"], field, item[field], low, high):
+                    expected.append((item["user_id"], label, item[field]))
+
+        alerts = main.evaluate_sensor_alerts(batch, parameters)
+        assert sorted((a["user_id"], a["measurement"], a["value"]) for a in alerts) == sorted(expected)
+        fired += len(alerts)
+    assert fired > 50
@@ -0,0 +1,106 @@
+import os
+import subprocess
+import sys
+import textwrap
+import zlib
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image, features
+
+import main
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+needs_libtiff = pytest.mark.skipif(not features.check("libtiff"), reason="compressed TIFF needs libtiff")
+
+
+def field_image(width, height):
+    """Campo verde con manchas de fuego: comprime bien y tiene algo que detectar"""
+    pixels = np.zeros((height, width, 3), dtype=np.uint8)
+    pixels[:] = (60, 140, 50)
+    pixels[::97, :] = (120, 90, 60)
+    for y in range(0, height, 211):
+        for x in range(0, width, 173):
+            pixels[y:y + 15, x:x + 15] = (250, 150, 40)
+    return Image.fromarray(pixels)
+
+
+def tiff_bytes(image, **options):
+    output = BytesIO()
+    image.save(output, format="TIFF", **options)
+    return output.getvalue()
+
+
+@needs_libtiff
+@pytest.mark.parametrize("compression", ["tiff_lzw", "tiff_adobe_deflate", "packbits"])
+def test_tiff_band_reader_matches_full_decode(compression):
+    data = tiff_bytes(field_image(517, 333), compression=compression, strip_size=8000)
+    full = np.asarray(Image.open(BytesIO(data)).convert("RGB"))
+
+    read = main._tiff_band_reader(data, main.open_image(data))
+
+    assert read is not None
+    for top, bottom in [(0, 50), (13, 200), (100, 333), (332, 333)]:
+        assert np.array_equal(np.asarray(read(top, bottom)), full[top:bottom])
+
+
+def test_tiff_band_reader_reads_tiled_tiffs():
+    # TIFF por tiles de 64x64 con Deflate, armado a mano (PIL no escribe tiles)
+    width, height, size = 517, 333, 64
+    pixels = np.asarray(field_image(width, height))
+    padded = np.zeros((-(-height // size) * size, -(-width // size) * size, 3), dtype=np.uint8)
+    padded[:height, :width] = pixels
+    chunks = [zlib.compress(padded[y:y + size, x:x + size].tobytes())
+              for y in range(0, padded.shape[0], size) for x in range(0, padded.shape[1], size)]
+    tags = {256: (4, (width,)), 257: (4, (height,)), 258: (3, (8, 8, 8)), 259: (3, (8,)), 262: (3, (2,)),
+            277: (3, (3,)), 284: (3, (1,)), 322: (4, (size,)), 323: (4, (size,))}
+    data = main._tiff_bytes(tags, chunks, 324, 325)
+
+    read = main._tiff_band_reader(data, main.open_image(data))
+
+    assert read is not None
+    assert np.array_equal(np.asarray(read(13, 200)), pixels[13:200])
+
+
+def test_non_streamable_formats_are_rejected_above_tiled_threshold(monkeypatch):
+    monkeypatch.setattr(main, "IMAGE_TILED_MIN_PIXELS", 10_000)
+    output = BytesIO()
+    field_image(400, 300).save(output, format="PNG")
+
+    with pytest.raises(main.ImageTooLargeError):
+        main.simple_image_process(output.getvalue())
+
+
+@needs_libtiff
+def test_tiled_compressed_tiff_peak_memory(tmp_path):
+    """Un TIFF LZW de 80 Mpx (240 MB decodificado) se procesa sin decodificarlo completo"""
+    path = tmp_path / "orthomosaic.tif"
+    generate = textwrap.dedent(f"""
+        import sys
+        sys.path[:0] = [{SRC!r}, {os.path.dirname(os.path.abspath(__file__))!r}]
+        from test_tiled_processing import field_image
+        field_image(10000, 8000).save({str(path)!r}, format="TIFF", compression="tiff_lzw")
+    """)
+    subprocess.run([sys.executable, "-c", generate], check=True)
+
+    # Proceso aparte: ru_maxrss es el pico de todo el proceso
+    measure = textwrap.dedent(f"""
+        import resource, sys
+        sys.path.insert(0, {SRC!r})
+        import main
+        data = open({str(path)!r}, "rb").read()
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        renditions, fire_info = main.simple_image_process(data)
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        assert "preview" in renditions and fire_info["fire_coverage"] > 0.5, fire_info
+        print(after - before)
+    """)
+    result = subprocess.run([sys.executable, "-c", measure], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr[-2000:]
+    growth_mb = int(result.stdout.split()[-1]) / 1024
+
+    # Decodificado completo son 240 MB solo la imagen (~410 MB de pico); por bandas ~150 MB
+    decoded_mb = 10000 * 8000 * 3 / 2**20
+    assert growth_mb < 0.75 * decoded_mb, f"peak RSS grew {growth_mb:.0f} MB"
@@ -234,6 +234,7 @@ const DroneImages = ({ userId }) => {
                         <img 
                           src={image.raw_url} 
                           alt="Imagen original del campo"
+                          loading="lazy"
                           style={{
                             width: '100%',
                             height: 'auto',
@@ -293,20 +294,28 @@ const DroneImages = ({ userId }) => {
                           ? '0 0 20px rgba(231, 76, 60, 0.5)'
                           : '0 4px 6px rgba(0,0,0,0.1)'
                       }}>
-                        <img 
-                          src={image.processed_url} 
-                          alt="Imagen procesada con análisis"
-                          style={{
-                            width: '100%',
-                            height: 'auto',
-                            display: 'block',
-                            backgroundColor: 'var(--background-secondary)'
-                          }}
-                          onError={(e) => {
-                            e.target.style.display = 'none';
-                            e.target.nextSibling.style.display = 'flex';
-                          }}
-                        />
+                        {/* Preview WebP / thumbnail en la grilla; la imagen completa se abre al hacer click */}
+                        <a href={image.processed_url} target="_blank" rel="noopener noreferrer">
+                          <img 
+                            src={image.preview_url || image.processed_url} 
+                            srcSet={image.thumbnail_url && image.preview_url
+                              ? `${image.thumbnail_url} 320w, ${image.preview_url} 960w`
+                              : undefined}
+                            sizes="(max-width: 700px) 100vw, 50vw"
+                            alt="Imagen procesada con análisis"
+                            loading="lazy"
+                            style={{
+                              width: '100%',
+                              height: 'auto',
+                              display: 'block',
+                              backgroundColor: 'var(--background-secondary)'
+                            }}
+                            onError={(e) => {
+                              e.target.style.display = 'none';
+                              e.target.parentNode.nextSibling.style.display = 'flex';
+                            }}
+                          />
+                        </a>
                         <div style={{
                           display: 'none',
                           alignItems: 'center',
@@ -126,6 +126,61 @@ module "sqs" {
   }
 }
 
+# Eventos ObjectCreated del bucket raw: el processing engine procesa cada imagen al subirse
+module "image_events_sqs" {
+  source = "./modules/sqs"
+
+  project_name = local.project_name
+
+  queue_name_suffix         = "image-events-queue"
+  dlq_name_suffix           = "image-events-dlq"
+  queue_purpose             = "image_processing"
+  receive_wait_time_seconds = 20
+  sqs_managed_sse           = true
+
+  additional_tags = {
+    Environment = local.environment
+    Component   = "messaging"
+  }
+}
+
+data "aws_iam_policy_document" "image_events_queue" {
+  statement {
+    sid       = "AllowRawImagesBucketNotifications"
+    actions   = ["sqs:SendMessage"]
+    resources = [module.image_events_sqs.queue_arn]
+
+    principals {
+      type        = "Service"
+      identifiers = ["s3.amazonaws.com"]
+    }
+
+    condition {
+      test     = "ArnEquals"
+      variable = "aws:SourceArn"
+      values   = [module.s3.raw_images_bucket_arn]
+    }
+  }
+}
+
+resource "aws_sqs_queue_policy" "image_events" {
+  queue_url = module.image_events_sqs.queue_url
+  policy    = data.aws_iam_policy_document.image_events_queue.json
+}
+
+resource "aws_s3_bucket_notification" "raw_images" {
+  bucket = module.s3.raw_images_bucket_name
+
+  queue {
+    queue_arn     = module.image_events_sqs.queue_arn
+    events        = ["s3:ObjectCreated:*"]
+    filter_prefix = "drone-images/"
+  }
+
+  # S3 valida que la cola acepte mensajes del bucket al crear la notificación
+  depends_on = [aws_sqs_queue_policy.image_events]
+}
+
 # =============================================================================
 # S3 STORAGE CONFIGURATION
 # =============================================================================
@@ -278,6 +333,8 @@ module "fargate" {
   sqs_queue_url = module.sqs.queue_url
   sqs_queue_arn = module.sqs.queue_arn
 
+  image_events_queue_url = module.image_events_sqs.queue_url
+
   # S3 integration
   raw_images_bucket_name       = module.s3.raw_images_bucket_name
   raw_images_bucket_arn        = module.s3.raw_images_bucket_arn
@@ -290,7 +347,7 @@ module "fargate" {
   rds_username = module.rds.db_instance_username
   rds_password = var.db_password
 
-  depends_on = [module.sqs, module.s3, module.rds]
+  depends_on = [module.sqs, module.image_events_sqs, module.s3, module.rds]
 }
 
 # =============================================================================
@@ -142,6 +142,10 @@ resource "aws_ecs_task_definition" "processing_engine" {
           name  = "SQS_QUEUE_URL"
           value = var.sqs_queue_url
         },
+        {
+          name  = "IMAGE_EVENTS_QUEUE_URL"
+          value = var.image_events_queue_url
+        },
         {
           name  = "RAW_IMAGES_BUCKET"
           value = var.raw_images_bucket_name
@@ -169,6 +173,15 @@ resource "aws_ecs_task_definition" "processing_engine" {
         {
           name  = "DB_PASSWORD"
           value = var.rds_password
+        },
+        {
+          name  = "LOG_FORMAT"
+          value = "json"
+        },
+        {
+          # Un proceso de imágenes por vCPU completa (0 = procesamiento serial)
+          name  = "IMAGE_WORKERS"
+          value = tostring(floor(var.fargate_cpu / 1024))
         }
       ]
 
@@ -39,6 +39,12 @@ variable "sqs_queue_arn" {
   type        = string
 }
 
+variable "image_events_queue_url" {
+  description = "SQS queue URL with S3 ObjectCreated events for raw images (empty = S3 polling only)"
+  type        = string
+  default     = ""
+}
+
 variable "raw_images_bucket_name" {
   description = "Raw images S3 bucket name"
   type        = string
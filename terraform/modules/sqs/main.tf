@@ -7,8 +7,11 @@ resource "aws_sqs_queue" "main" {
   receive_wait_time_seconds  = var.receive_wait_time_seconds
   visibility_timeout_seconds = var.visibility_timeout_seconds
 
-  kms_master_key_id                 = "alias/aws/sqs"
-  kms_data_key_reuse_period_seconds = 300
+  # S3 no puede publicar en una cola cifrada con la clave administrada alias/aws/sqs:
+  # las colas que reciben notificaciones de S3 usan SSE-SQS
+  kms_master_key_id                 = var.sqs_managed_sse ? null : "alias/aws/sqs"
+  kms_data_key_reuse_period_seconds = var.sqs_managed_sse ? null : 300
+  sqs_managed_sse_enabled           = var.sqs_managed_sse ? true : null
 
   redrive_policy = jsonencode({
     deadLetterTargetArn = aws_sqs_queue.dlq.arn
@@ -67,4 +67,10 @@ variable "queue_purpose" {
   description = "Purpose/type of the queue for tagging (e.g., 'sensor_messages', 'image_processing')"
   type        = string
   default     = "general"
-}
\ No newline at end of file
+}
+
+variable "sqs_managed_sse" {
+  description = "Use SQS-managed encryption (SSE-SQS) instead of the AWS managed KMS key; required for queues that receive S3 event notifications"
+  type        = bool
+  default     = false
+}
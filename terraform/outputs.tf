@@ -34,6 +34,11 @@ output "sqs_dlq_url" {
   value       = module.sqs.dlq_url
 }
 
+output "image_events_queue_url" {
+  description = "SQS queue URL for raw image upload events"
+  value       = module.image_events_sqs.queue_url
+}
+
 output "rds_endpoint" {
   description = "RDS instance endpoint"
   value       = module.rds.db_instance_endpoint